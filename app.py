@@ -1,5 +1,6 @@
-from flask import Flask, request, send_file, jsonify, render_template
+from flask import Flask, Response, request, send_file, jsonify, render_template
 import os
+import sys
 import requests
 from bs4 import BeautifulSoup
 import wget
@@ -11,17 +12,97 @@ import re
 import json
 import mimetypes
 import hashlib
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import codecs
+import tempfile
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 import chardet
+from http_client import http_get, iter_body, get_scheduler, AssetTooLarge, ByteBudget, ByteBudgetExceeded, ASSET_MAX_BYTES
+from driver_pool import get_driver_pool, warm_driver_pool_async
+from jobs import JobManager, SharedJobQueue, JobQueueFull, JOB_QUEUE_DB, JOB_RESULT_DIR
+from asset_cache import get_asset_cache, download_uncached, file_digest, SharedAssetStore, ContentIndex
+from output import DirectoryOutput, ZipOutput, PrefixedOutput, SiteOutput, QueueStream, CloneCancelled, as_output, is_rewritable
+from tracking_rules import get_tracking_rules
+from metrics import REGISTRY, CloneMetrics
+from css_rewriter import CssPipeline
+from image_optimizer import ImageOptimizer, OUTPUT_FORMATS, image_settings
+from clone_state import CloneState, IncrementalStore, archive_digests, replace_entries, write_delta
+from network_capture import NetworkCapture, CaptureStore
+from result_cache import get_result_cache, result_key
+from readiness import ready_settings, load_page, wait_until_ready
+from resource_blocking import block_settings, blocked_url_patterns, start_blocking, count_blocked
 
 app = Flask(__name__)
 app.logger.setLevel('INFO')  # Set the logging level
 
+# Asset download concurrency (overridable per /download request)
+ASSET_CONCURRENCY = int(os.environ.get('ASSET_CONCURRENCY', 8))
+ASSET_CONCURRENCY_MAX = int(os.environ.get('ASSET_CONCURRENCY_MAX', 32))
+# What to do with an asset over ASSET_MAX_BYTES: 'skip' keeps the remote URL, 'stub' saves an empty placeholder
+ASSET_OVERSIZE_ACTION = os.environ.get('ASSET_OVERSIZE_ACTION', 'skip')
+
+# Pages of one /batch or /crawl request cloned at the same time, and the most pages one batch may list
+BATCH_PAGE_CONCURRENCY = int(os.environ.get('BATCH_PAGE_CONCURRENCY', 4))
+BATCH_MAX_PAGES = int(os.environ.get('BATCH_MAX_PAGES', 100))
+
+# Crawl defaults (overridable per /crawl request up to CRAWL_PAGES_LIMIT)
+CRAWL_MAX_DEPTH = int(os.environ.get('CRAWL_MAX_DEPTH', 2))
+CRAWL_MAX_PAGES = int(os.environ.get('CRAWL_MAX_PAGES', 20))
+CRAWL_PAGES_LIMIT = int(os.environ.get('CRAWL_PAGES_LIMIT', 200))
+# Link targets with these extensions (or none) are treated as pages when crawling
+PAGE_EXTENSIONS = {'', '.html', '.htm', '.php', '.asp', '.aspx', '.jsp', '.shtml'}
+
+# BeautifulSoup backend: 'html.parser' (default) or the faster 'lxml'
+HTML_PARSERS = ('html.parser', 'lxml')
+HTML_PARSER = os.environ.get('HTML_PARSER', 'html.parser')
+try:
+    import lxml  # noqa: F401
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+# Charset sniffing only looks at the start of the document
+CHARSET_SNIFF_BYTES = 4096
+CHARSET_DETECT_BYTES = 64 * 1024
+META_CHARSET_PATTERN = re.compile(
+    rb'''<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)''',
+    re.IGNORECASE
+)
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# How the page HTML is obtained: 'static' (HTTP only), 'browser' (headless Chrome) or
+# 'auto' (HTTP first, Chrome only when the page looks JS-rendered)
+RENDER_STRATEGIES = ('static', 'browser', 'auto')
+RENDER_STRATEGY = os.environ.get('RENDER_STRATEGY', 'browser')
+AUTO_RENDER_SAMPLE_BYTES = 512 * 1024
+AUTO_MIN_TEXT_BYTES = int(os.environ.get('AUTO_MIN_TEXT_BYTES', 200))
+# Markers of client-side rendered apps whose static HTML is only a shell
+SPA_MARKERS = [
+    ('empty SPA root', re.compile(rb'''<div[^>]+id=["'](?:root|app|__next|__nuxt|svelte)["'][^>]*>\s*</div>''', re.IGNORECASE)),
+    ('Angular app', re.compile(rb'<[^>]+\bng-(?:app|version)\b', re.IGNORECASE)),
+    ('requires JavaScript', re.compile(rb'<noscript[^>]*>[^<]*(?:enable|requires?)\s+javascript', re.IGNORECASE)),
+]
+HIDDEN_BLOCK_PATTERN = re.compile(rb'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(rb'<[^>]*>')
+
+# Folder each asset is saved into, chosen by file extension
+ASSET_TYPES = {
+    'images': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg'],
+    'css': ['.css'],
+    'js': ['.js'],
+    'videos': ['.mp4', '.webm', '.ogg'],
+    'fonts': ['.woff', '.woff2', '.ttf', '.eot', '.otf'],
+    'icons': ['.ico', '.png'],
+    'others': []
+}
+
 def get_file_extension(url, content_type=None):
     """Get file extension from URL or content type"""
     # Try to get extension from URL first
@@ -81,6 +162,115 @@ def safe_filename(url):
     except:
         return hashlib.md5(url.encode()).hexdigest()[:10]
 
+def get_asset_type(url):
+    """Pick the asset folder for a URL based on its extension"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    for type_name, extensions in ASSET_TYPES.items():
+        if ext in extensions:
+            return type_name
+    return 'others'
+
+# Folder for assets whose URL has no known extension, by Content-Type substring
+CONTENT_TYPE_FOLDERS = (
+    ('image/x-icon', 'icons'),
+    ('image/vnd.microsoft.icon', 'icons'),
+    ('image/', 'images'),
+    ('font/', 'fonts'),
+    ('application/font', 'fonts'),
+    ('application/x-font', 'fonts'),
+    ('application/vnd.ms-fontobject', 'fonts'),
+    ('video/', 'videos'),
+    ('text/css', 'css'),
+    ('javascript', 'js'),
+)
+
+def classify_asset(url, content_type=None):
+    """Pick the asset folder from the URL extension, falling back to the Content-Type"""
+    asset_type = get_asset_type(url)
+    if asset_type != 'others' or not content_type:
+        return asset_type
+    content_type = content_type.lower()
+    for marker, folder in CONTENT_TYPE_FOLDERS:
+        if marker in content_type:
+            return folder
+    return 'others'
+
+class ConcurrentFetcher:
+    """Runs per-URL work on a bounded thread pool; requests per host are capped by the HTTP client's HostScheduler"""
+
+    def __init__(self, max_workers=None, progress=None, cancelled=None):
+        self.max_workers = max(1, max_workers or ASSET_CONCURRENCY)
+        self.progress = progress  # progress('assets', fetched=..., total=...)
+        self.cancelled = cancelled  # cancelled() is True once the clone's output is no longer read
+        self.fetched = 0
+        self.total = 0
+        self._stopped = None  # the CloneCancelled that stops the remaining work
+        self._lock = threading.Lock()
+
+    def _count(self, fetched=0, total=0):
+        with self._lock:
+            self.fetched += fetched
+            self.total += total
+            counts = {'fetched': self.fetched, 'total': self.total}
+        if self.progress:
+            self.progress('assets', **counts)
+
+    def _run_group(self, fn, urls, results):
+        # Items in a group run one after another, in the order they were queued
+        for item_url in urls:
+            if self._stopped is None and self.cancelled and self.cancelled():
+                self._stopped = CloneCancelled('Client stopped reading the archive')
+            if self._stopped is not None:
+                return
+            try:
+                results[item_url] = fn(item_url)
+            except CloneCancelled as e:
+                self._stopped = e
+                return
+            except Exception as e:
+                print(f'Error fetching {item_url}: {str(e)}')
+            self._count(fetched=1)
+
+    def map(self, fn, urls, group_key=None):
+        """Call fn(url) for every unique URL and return {url: result}.
+
+        URLs sharing the same group_key are never run at the same time, so
+        work that writes to the same file keeps the serial last-write-wins order.
+        Raises CloneCancelled, once the running items finish, when the output stops being read.
+        """
+        groups = OrderedDict()
+        for item_url in urls:
+            key = group_key(item_url) if group_key else item_url
+            group = groups.setdefault(key, [])
+            if item_url not in group:
+                group.append(item_url)
+
+        results = {}
+        if not groups:
+            return results
+        self._count(total=sum(len(group) for group in groups.values()))
+        if self.max_workers == 1 or len(groups) == 1:
+            for group in groups.values():
+                self._run_group(fn, group, results)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as pool:
+                futures = [pool.submit(self._run_group, fn, group, results) for group in groups.values()]
+                for future in futures:
+                    future.result()
+        if self._stopped is not None:
+            raise self._stopped
+        return results
+
+def asset_file_key(url):
+    """Group key so downloads that may land on the same local file run one after another, in document order.
+
+    Only the filename stem counts: classify_asset() may pick the folder (and
+    the extension) from the response's Content-Type, which is not known yet,
+    so logo and logo.png can end up as the same file. Running them in order
+    means the first URL in the document always keeps the plain name.
+    """
+    return os.path.splitext(safe_filename(url))[0].lower()
+
 def safe_download(url, save_path):
     try:
         # Ensure the URL is valid
@@ -90,26 +280,23 @@ def safe_download(url, save_path):
         if not parsed_url.scheme and not parsed_url.netloc:
             return None
 
-        # Download with timeout and proper headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, stream=True, timeout=(10, 30), headers=headers, allow_redirects=True)
-        response.raise_for_status()
+        # Download through the shared session (timeout, headers and retries come from http_client)
+        with http_get(url, stream=True) as response:
+            response.raise_for_status()
 
-        # Get content type and extension
-        content_type = response.headers.get('Content-Type', '').split(';')[0]
-        ext = get_file_extension(url, content_type)
+            # Get content type and extension
+            content_type = response.headers.get('Content-Type', '').split(';')[0]
+            ext = get_file_extension(url, content_type)
 
-        # Create unique filename using hash of URL
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:10]
-        filename = f"{url_hash}{ext}"
-        full_path = os.path.join(save_path, filename)
+            # Create unique filename using hash of URL
+            url_hash = hashlib.md5(url.encode()).hexdigest()[:10]
+            filename = f"{url_hash}{ext}"
+            full_path = os.path.join(save_path, filename)
 
-        # Save file with proper encoding to handle unicode characters
-        with open(full_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            # Save file with proper encoding to handle unicode characters
+            with open(full_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
 
         return filename
     except Exception as e:
@@ -144,236 +331,517 @@ def replace_domain_in_url(url, original_domains, new_domains, base_url):
         pass
     return url
 
+def trie_pattern(words):
+    """Build a regex matching any of words, factored into a prefix trie so each position is tried once"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True  # End of a word
+
+    def build(node):
+        if '' in node and len(node) == 1:
+            return ''
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Optional tail: keep going for the longest match, but a word may also end here
+        if '' in node:
+            pattern = f'(?:{pattern})?'
+        return pattern
+
+    return build(trie)
+
+class DomainReplacer:
+    """Single-pass replacement of every domain pair, compiled once per request.
+
+    The www. form and the bare domain are matched in one combined pattern, so
+    quoted, escaped (\\"domain\\") and URL-encoded (%22domain%22) occurrences are
+    all rewritten, and the output of one pair is never rewritten by another.
+    Where domains overlap, the longest match wins.
+    """
+
+    def __init__(self, original_domains, replacement_domains):
+        self.replacements = {}
+        for orig_domain, repl_domain in zip(original_domains or [], replacement_domains or []):
+            orig_domain = orig_domain.strip().lower()
+            repl_domain = repl_domain.strip().lower()
+            if not orig_domain:
+                continue
+            # Replace both www and non-www versions; the first pair for a domain wins
+            self.replacements.setdefault(f'www.{orig_domain}', repl_domain)
+            self.replacements.setdefault(orig_domain, repl_domain)
+        self.pattern = re.compile(trie_pattern(self.replacements)) if self.replacements else None
+
+    def __call__(self, text):
+        if not text or self.pattern is None:
+            return text
+        return self.pattern.sub(lambda match: self.replacements[match.group(0)], text)
+
 def replace_text_content(text, original_domains, replacement_domains):
     if not text:
         return text
-    
-    # Process each domain pair
-    for orig_domain, repl_domain in zip(original_domains, replacement_domains):
-        orig_domain = orig_domain.strip().lower()
-        repl_domain = repl_domain.strip().lower()
-        
-        # Replace both www and non-www versions
-        text = text.replace(f'www.{orig_domain}', repl_domain)
-        text = text.replace(orig_domain, repl_domain)
-        
-        # Replace encoded versions (for JavaScript/JSON content)
-        text = text.replace(f'\\"{orig_domain}\\"', f'\\"{repl_domain}\\"')
-        text = text.replace(f"\\'{orig_domain}\\'", f"\\'{repl_domain}\\'")
-        
-        # Replace URL-encoded versions
-        text = text.replace(f'%22{orig_domain}%22', f'%22{repl_domain}%22')
-    
-    return text
+    return DomainReplacer(original_domains, replacement_domains)(text)
+
+def claim_cached(cached, url):
+    """Apply the per-asset cap to a body served from a store or the cache.
 
-def download_and_save_asset(url, base_url, save_path, asset_type):
-    """Download asset and return local path"""
+    The byte budget is charged while bodies download, so hits cost nothing here.
+    """
+    if ASSET_MAX_BYTES and cached.size > ASSET_MAX_BYTES:
+        if cached.temporary:
+            os.remove(cached.path)
+        raise AssetTooLarge(url, cached.size, ASSET_MAX_BYTES, cached.content_type)
+
+def download_and_save_asset(url, base_url, save_path, asset_type, store=None, metrics=None, budget=None, index=None, optimizer=None):
+    """Download asset and return local path (save_path is a directory or an output object).
+
+    asset_type None picks the folder from the URL or the response Content-Type.
+    store is an optional SharedAssetStore that downloads each URL once across pages;
+    metrics is an optional CloneMetrics that records the fetch; budget is the
+    clone's ByteBudget. Bodies are streamed in STREAM_CHUNK_BYTES chunks and
+    assets over ASSET_MAX_BYTES are skipped or stubbed (ASSET_OVERSIZE_ACTION).
+    index is the clone's ContentIndex: a body already saved under another URL
+    is not written again, and the existing path is returned. optimizer is an
+    optional ImageOptimizer that recompresses images before they are saved.
+    """
+    started = time.perf_counter()
+    full_url = url
     try:
         # Handle URL-encoded paths and make URL absolute
         full_url = urljoin(base_url, url.strip())
         if not urlparse(full_url).scheme:
             full_url = 'https://' + full_url
 
-        asset_dir = os.path.join(save_path, asset_type)
-        os.makedirs(asset_dir, exist_ok=True)
+        output = as_output(save_path)
+        if getattr(output, 'cancelled', False):
+            raise CloneCancelled('Client stopped reading the archive')
 
         # Get the original filename
         original_filename = safe_filename(full_url)
         
-        # Get content type and extension
-        response = requests.get(full_url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }, stream=True)
-        content_type = response.headers.get('Content-Type', '').split(';')[0]
-        
+        # Serve from the batch store or the shared asset cache when possible (revalidating stale entries);
+        # otherwise stream to a temp file, hashing as we go
+        asset_cache = get_asset_cache()
+        if store or asset_cache:
+            cached = (store or asset_cache).fetch(full_url, budget=budget)
+            claim_cached(cached, full_url)
+            status = cached.status
+        else:
+            cached = download_uncached(full_url, tempfile.gettempdir(), budget=budget)
+            status = 'uncached'
+        asset_type = asset_type or classify_asset(full_url, cached.content_type)
+
         # If no extension in original filename, try to get it from content type
         if not os.path.splitext(original_filename)[1]:
-            ext = get_file_extension(full_url, content_type)
-            original_filename = original_filename + ext
+            original_filename = original_filename + get_file_extension(full_url, cached.content_type)
 
-        # Save the file
-        full_path = os.path.join(asset_dir, original_filename)
-        with open(full_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        return f'{asset_type}/{original_filename}'
+        relpath = f'{asset_type}/{original_filename}'
+        digest = cached.digest or (file_digest(cached.path) if index else None)
+        # Recompress each distinct image once; the optimized file takes the output format's extension
+        if optimizer and asset_type == 'images' and not (index and index.lookup(digest)):
+            optimized = optimizer.optimize(full_url, cached)
+            if optimized:
+                cached, extension = optimized
+                relpath = os.path.splitext(relpath)[0] + extension
+        duplicate = False
+        if index:
+            relpath, duplicate = index.place(output, relpath, cached, digest)
+        else:
+            output.write_cached(relpath, cached)
+        if metrics:
+            metrics.asset(asset_type, urlparse(full_url).netloc, time.perf_counter() - started, cached.size, status)
+            if duplicate:
+                metrics.duplicate(asset_type, cached.size)
+        return relpath
+    except AssetTooLarge as e:
+        print(f'Skipping oversized asset {url}: {e.size} bytes (limit {e.limit})')
+        if metrics:
+            metrics.skip(asset_type or get_asset_type(full_url), 'oversized')
+        if ASSET_OVERSIZE_ACTION != 'stub':
+            return url
+        # An empty file keeps the reference local without storing the body
+        asset_type = asset_type or classify_asset(full_url, e.content_type)
+        if not os.path.splitext(original_filename)[1]:
+            original_filename = original_filename + get_file_extension(full_url, e.content_type)
+        relpath = f'{asset_type}/{original_filename}'
+        if index:
+            # Keyed by URL so every stub keeps a name of its own
+            relpath, _ = index.claim(relpath, f'stub:{full_url}')
+        output.write_bytes(relpath, b'')
+        return relpath
+    except CloneCancelled:
+        raise
+    except ByteBudgetExceeded as e:
+        print(f'Skipping asset {url}: {str(e)}')
+        if metrics:
+            metrics.skip(asset_type or get_asset_type(full_url), 'budget')
+        return url
     except Exception as e:
         print(f'Error downloading asset {url}: {str(e)}')
+        if metrics:
+            metrics.asset(asset_type or get_asset_type(full_url), urlparse(full_url).netloc, time.perf_counter() - started, failed=True)
         return url  # Return original URL if download fails
 
-def remove_tracking_scripts(soup, remove_tracking=True, remove_custom_tracking=True, remove_redirects=False):
+def fetch_text(url, store=None, metrics=None, asset_type='others', budget=None):
+    """GET a stylesheet or script as text (None on an error status), through store or the asset cache.
+
+    The body is streamed under the same per-asset cap and byte budget as binary assets.
+    """
+    started = time.perf_counter()
+    encoding = None
+    source = store or get_asset_cache()
+    try:
+        if source is None:
+            with http_get(url, stream=True) as response:
+                ok, status, encoding = response.ok, 'uncached', response.encoding
+                content = b''.join(iter_body(response, budget=budget))
+        else:
+            cached = source.fetch(url, budget=budget)
+            claim_cached(cached, url)
+            ok, status = cached.ok, cached.status
+            with open(cached.path, 'rb') as f:
+                content = f.read()
+            if cached.temporary:
+                os.remove(cached.path)
+    except Exception:
+        if metrics:
+            metrics.asset(asset_type, urlparse(url).netloc, time.perf_counter() - started, failed=True)
+        raise
+    if metrics:
+        metrics.asset(asset_type, urlparse(url).netloc, time.perf_counter() - started, len(content), status, failed=not ok)
+    if not ok:
+        return None
+    if encoding:
+        try:
+            return content.decode(encoding, errors='replace')
+        except LookupError:
+            pass
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode(detect_encoding(content), errors='replace')
+
+def decompose_all(elements):
+    """Decompose many elements, skipping those inside another element that is removed anyway"""
+    doomed = {id(element) for element in elements}
+    outermost = []
+    for element in elements:
+        ancestor = element.parent
+        while ancestor is not None and id(ancestor) not in doomed:
+            ancestor = ancestor.parent
+        # Elements inside another removed element go away with it
+        if ancestor is None and element.parent is not None:
+            outermost.append(element)
+    for element in outermost:
+        element.decompose()
+
+def remove_tracking_scripts(soup, remove_tracking=True, remove_custom_tracking=True, remove_redirects=False, base_url=None):
     """Remove various tracking scripts from the HTML"""
     if not (remove_tracking or remove_custom_tracking or remove_redirects):
         return
 
-    # Common tracking script patterns
-    tracking_patterns = [
-        # Meta Pixel
-        r'connect\.facebook\.net/[^/]+/fbevents\.js',
-        r'facebook-jssdk',
-        r'fb-root',
-        # Google Analytics
-        r'google-analytics\.com/analytics\.js',
-        r'googletagmanager\.com/gtag/js',
-        r'ga\.js',
-        r'gtag',
-        # Google Tag Manager
-        r'googletagmanager\.com/gtm\.js',
-        r'gtm\.js',
-        # Ringba
-        r'ringba\.com',
-        r'ringba\.js',
-        # Other common trackers
-        r'analytics',
-        r'pixel\.js',
-        r'tracking\.js',
-        r'mixpanel',
-        r'segment\.com',
-        r'hotjar\.com',
-    ]
-
-    # Custom track.js patterns
-    custom_tracking_patterns = [
-        r'track\.js',
-        r'tracking\.js',
-        r'tracker\.js',
-    ]
-
-    def matches_patterns(src, patterns):
-        if not src:
+    # Rules are compiled once and reloaded only when the override file (TRACKING_RULES_PATH) changes
+    rules = get_tracking_rules()
+    matches = rules.matches
+    base_netloc = urlparse(base_url).netloc if base_url else None
+
+    def is_external(link):
+        if not link:
             return False
-        return any(re.search(pattern, src, re.IGNORECASE) for pattern in patterns)
+        netloc = urlparse(link).netloc
+        return bool(netloc and netloc != base_netloc)
 
-    # Remove script tags
-    for script in soup.find_all('script'):
-        src = script.get('src', '')
-        content = script.string or ''
-        
-        should_remove = False
-        
-        if remove_tracking:
-            should_remove = should_remove or matches_patterns(src, tracking_patterns)
-            should_remove = should_remove or any(p in content.lower() for p in ['fbq(', 'gtag(', 'ga(', '_ringba', 'mixpanel'])
-            
-        if remove_custom_tracking:
-            should_remove = should_remove or matches_patterns(src, custom_tracking_patterns)
-            should_remove = should_remove or 'track' in content.lower()
-        
-        if should_remove:
-            script.decompose()
-
-    # Remove meta tags related to tracking
-    if remove_tracking:
-        for meta in soup.find_all('meta'):
-            if meta.get('name') in ['facebook-domain-verification', 'google-site-verification']:
-                meta.decompose()
-
-    # Remove noscript tags that might contain tracking pixels
-    for noscript in soup.find_all('noscript'):
-        content = str(noscript).lower()
-        if any(tracker in content for tracker in ['facebook', 'gtm', 'google-analytics']):
-            noscript.decompose()
-
-    # Remove inline tracking scripts from onclick and other event handlers
+    # Single pass over the document handles scripts, meta, noscript, event handlers and redirects.
+    # Removals are collected and applied afterwards so the walk never touches a detached subtree.
+    doomed = []
     for element in soup.find_all(True):
-        for attr in list(element.attrs):
-            if attr.startswith('on'):
-                value = element[attr].lower()
-                if 'track' in value or any(tracker in value for tracker in ['gtag', 'ga', 'fbq']):
-                    del element[attr]
-
-    # Remove links that redirect to external sites
-    if remove_redirects:
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if urlparse(href).netloc and urlparse(href).netloc != urlparse(base_url).netloc:
-                link.decompose()  # Remove the link if it redirects to an external site
-
-    # Remove script tags that redirect to external sites
-    if remove_redirects:
-        for script in soup.find_all('script'):
-            src = script.get('src', '')
-            if src and urlparse(src).netloc and urlparse(src).netloc != urlparse(base_url).netloc:
-                script.decompose()  # Remove the script if it redirects to an external site
-
-def detect_encoding(content):
+        if element.name == 'script':
+            src = element.get('src', '')
+            content = element.string or ''
+            if (remove_tracking and (matches(rules.tracking_script_src, src) or matches(rules.tracking_script_content, content))) \
+                    or (remove_custom_tracking and (matches(rules.custom_script_src, src) or matches(rules.custom_script_content, content))) \
+                    or (remove_redirects and is_external(src)):
+                doomed.append(element)
+                continue
+
+        # Remove meta tags related to tracking
+        elif element.name == 'meta':
+            if remove_tracking and element.get('name') in rules.tracking_meta_names:
+                doomed.append(element)
+                continue
+
+        # Remove noscript tags that might contain tracking pixels
+        elif element.name == 'noscript':
+            if matches(rules.noscript_keywords, str(element)):
+                doomed.append(element)
+                continue
+
+        # Remove links that redirect to external sites
+        elif element.name == 'a':
+            if remove_redirects and is_external(element.get('href')):
+                doomed.append(element)
+                continue
+
+        # Remove inline tracking scripts from onclick and other event handlers
+        for attr in [attr for attr in element.attrs if attr.startswith('on')]:
+            value = element[attr]
+            if matches(rules.event_handler_keywords, value if isinstance(value, str) else ' '.join(value)):
+                del element[attr]
+
+    decompose_all(doomed)
+
+def normalize_encoding(name):
+    """Return the Python codec name for a charset label, or None if it is unknown"""
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip().strip('"\'').lower()).name
+    except LookupError:
+        return None
+
+def sniff_declared_charset(content):
+    """Find a <meta charset> or http-equiv charset in the first few KB without parsing the document"""
+    match = META_CHARSET_PATTERN.search(content[:CHARSET_SNIFF_BYTES])
+    if match:
+        return normalize_encoding(match.group(1).decode('ascii', errors='ignore'))
+    return None
+
+def detect_encoding(content, declared=None):
     """Detects the correct encoding of a webpage."""
-    # First try to detect encoding from the content
-    detected = chardet.detect(content)
-    encoding = detected.get("encoding", "utf-8")
-    
-    # If confidence is low, try to find encoding in meta tags
-    if detected.get("confidence", 0) < 0.8:
-        soup = BeautifulSoup(content, 'html.parser')
-        meta_charset = soup.find('meta', charset=True)
-        if meta_charset:
-            return meta_charset['charset']
-        
-        # Look for content-type meta tag
-        meta_content_type = soup.find('meta', attrs={'http-equiv': 'Content-Type'})
-        if meta_content_type and 'charset=' in meta_content_type.get('content', ''):
-            return meta_content_type['content'].split('charset=')[-1]
-    
-    return encoding
+    # A byte order mark wins over everything else
+    for bom, encoding in BOM_ENCODINGS:
+        if content.startswith(bom):
+            return encoding
+
+    # Then the charset we were told about (HTTP header, or utf-8 for browser page_source)
+    encoding = normalize_encoding(declared)
+    if encoding:
+        return encoding
+
+    # Then a charset declared in the document head
+    encoding = sniff_declared_charset(content)
+    if encoding:
+        return encoding
+
+    # Finally guess from a sample of the content
+    detected = chardet.detect(content[:CHARSET_DETECT_BYTES])
+    return normalize_encoding(detected.get("encoding")) or 'utf-8'
+
+def content_type_charset(content_type):
+    """Charset parameter of a Content-Type header, if one is given"""
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip()
+    return None
 
-def download_assets(url, original_domains=None, replacement_domains=None, save_dir=None, remove_tracking=False, remove_custom_tracking=False, remove_redirects=False):
-    driver = None
+def resolve_parser(parser=None):
+    """Pick the BeautifulSoup backend, falling back to html.parser when lxml is missing"""
+    parser = parser or HTML_PARSER
+    if parser == 'lxml' and not LXML_AVAILABLE:
+        print('lxml is not installed, falling back to html.parser')
+        return 'html.parser'
+    return parser
+
+def fetch_static(url):
+    """Plain HTTP fetch of the page; returns (raw bytes, charset from the Content-Type header, response)"""
+    response = http_get(url)
+    return response.content, content_type_charset(response.headers.get('Content-Type')), response
+
+def render_in_browser(url, metrics=None, capture=None, ready=None, block=None):
+    """Render the page in a pooled headless Chrome; returns (page source as utf-8 bytes, details).
+
+    capture is an optional NetworkCapture that keeps the body of every
+    response the browser received while loading the page. ready is the
+    ready_settings() for when to take the page, block the block_settings()
+    for requests the browser skips (defaults when None). details holds the
+    readiness report and, when anything was blocked, the blocked counts.
+    """
+    metrics = metrics or CloneMetrics()
+    ready = ready or ready_settings(None)
+    block = block or block_settings(None)
+    # Borrow a warm browser from the shared pool (this includes Chrome startup when none is idle)
+    pool = get_driver_pool()
+    with metrics.stage('browser_checkout'):
+        pooled = pool.acquire()
     try:
-        # Get the website name for the save directory
-        website_name = urlparse(url).netloc.replace('www.', '')
-        if not save_dir:
-            save_dir = f'{website_name}_{int(time.time())}'
-        
-        # Set up Selenium WebDriver with improved options
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--disable-extensions')
-        options.add_argument('--disable-infobars')
-        options.add_argument('--remote-debugging-port=9222')
-        options.add_argument('--window-size=1920,1080')
-        
-        # Add user agent to avoid detection
-        options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
-        
+        driver = pooled.driver
+        # Set on every render, so the previous page's block list never carries over
+        patterns = blocked_url_patterns(block)
         try:
-            # Initialize ChromeDriver with error handling
-            service = ChromeService(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=options)
-            driver.set_page_load_timeout(30)  # Set page load timeout
+            start_blocking(driver, patterns)
         except Exception as e:
-            print(f"Error initializing WebDriver: {str(e)}")
-            # Fallback to using requests if WebDriver fails
-            response = requests.get(url, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            })
-            html_content = response.content  # Get raw content instead of text
-        else:
-            # Use Selenium to load the page and check content type
-            driver.get(url)
-            
-            # Wait for page to load with improved error handling
+            print(f"Resource blocking unavailable: {str(e)}")
+            patterns = []
+        # After blocking: Network.enable there would reset the capture's buffer sizes
+        if capture:
             try:
-                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+                capture.start(driver)
             except Exception as e:
-                print(f"Timeout waiting for page load: {str(e)}")
-                # Get the page source even if timeout occurs
-                html_content = driver.page_source.encode('utf-8')
-            else:
-                html_content = driver.page_source.encode('utf-8')
-        
-        # Close the browser if it was successfully created
-        if driver:
+                print(f"Network capture unavailable: {str(e)}")
+                capture = None
+        # Performance log entries the readiness wait reads, kept for the block counts and the capture
+        network_log = []
+        started = time.perf_counter()
+        with metrics.stage('browser_load'):
+            # Load the page, cut off at the readiness deadline
+            loaded = load_page(driver, url, ready)
+        with metrics.stage('browser_ready'):
+            # Wait for the network to go quiet (and scroll lazy content in) as configured
             try:
-                driver.quit()
+                readiness = wait_until_ready(driver, ready, started, loaded, network_log)
             except Exception as e:
-                print(f"Error closing WebDriver: {str(e)}")
+                print(f"Error waiting for page readiness: {str(e)}")
+                readiness = {'strategy': ready['strategy'], 'outcome': 'error', 'seconds': round(time.perf_counter() - started, 3), 'scroll_steps': 0}
+            # Get the page source even if the deadline passed
+            page_source = driver.page_source.encode('utf-8')
+        metrics.ready(readiness)
+        details = {'ready': readiness}
+        if capture or patterns:
+            try:
+                entries = network_log + driver.get_log('performance')
+            except Exception as e:
+                print(f"Error reading the network log: {str(e)}")
+                entries = network_log
+            if patterns:
+                details['blocked'] = count_blocked(entries)
+                metrics.blocked(details['blocked'])
+            if capture:
+                # Bodies must be read before the browser goes back to the pool and leaves the page
+                with metrics.stage('capture'):
+                    try:
+                        capture.collect(driver, {url, driver.current_url}, entries)
+                    except Exception as e:
+                        print(f"Error reading captured network traffic: {str(e)}")
+        return page_source, details
+    except Exception:
+        # Recycle the browser if it crashed while rendering
+        pooled.broken = not pool.is_healthy(pooled)
+        raise
+    finally:
+        # Hand the browser back for the next request
+        pool.release(pooled)
+
+def needs_browser(html_content, response=None):
+    """Return why a statically fetched page looks JS-rendered, or None if the HTML is usable as is"""
+    if response is not None:
+        if response.status_code >= 400:
+            return f'HTTP {response.status_code}'
+        content_type = response.headers.get('Content-Type', '').lower()
+        if content_type and 'html' not in content_type:
+            return f'content type {content_type.split(";")[0]}'
+
+    sample = html_content[:AUTO_RENDER_SAMPLE_BYTES]
+    for name, pattern in SPA_MARKERS:
+        if pattern.search(sample):
+            return name
+
+    # Visible text left in the body once scripts, styles and tags are stripped
+    body = sample.split(b'<body', 1)[-1]
+    text = HIDDEN_BLOCK_PATTERN.sub(b' ', body)
+    text = TAG_PATTERN.sub(b' ', text)
+    if len(b''.join(text.split())) < AUTO_MIN_TEXT_BYTES:
+        return 'little visible text'
+    return None
+
+def render_page(url, strategy=None, metrics=None, capture=None, ready=None, block=None):
+    """Get the page HTML with the requested render strategy.
+
+    Returns (html bytes, declared encoding, info) where info holds the strategy
+    actually used, why it was chosen and the seconds spent, plus the readiness
+    report and blocked counts for browser renders. capture (a NetworkCapture)
+    is filled only when the page ends up rendered in the browser; ready and
+    block are passed to render_in_browser().
+    """
+    strategy = strategy or RENDER_STRATEGY
+    metrics = metrics or CloneMetrics()
+    start = time.time()
+    response = None
+
+    def done(html_content, declared_encoding, used, reason):
+        return html_content, declared_encoding, {
+            'strategy': used,
+            'requested': strategy,
+            'reason': reason,
+            'seconds': round(time.time() - start, 3),
+        }
+
+    if strategy in ('static', 'auto'):
+        try:
+            with metrics.stage('static_fetch'):
+                html_content, declared_encoding, response = fetch_static(url)
+        except requests.RequestException:
+            if strategy == 'static':
+                raise
+            reason = 'static fetch failed'
+        else:
+            if strategy == 'static':
+                return done(html_content, declared_encoding, 'static', 'requested')
+            reason = needs_browser(html_content, response)
+            if reason is None:
+                return done(html_content, declared_encoding, 'static', 'server-rendered HTML')
+    else:
+        reason = 'requested'
+
+    try:
+        html_content, details = render_in_browser(url, metrics, capture, ready, block)
+    except Exception as e:
+        print(f"Error rendering with WebDriver: {str(e)}")
+        # Fallback to using requests if WebDriver fails
+        if response is not None:
+            return done(html_content, declared_encoding, 'static', f'browser unavailable ({reason})')
+        with metrics.stage('static_fetch'):
+            html_content, declared_encoding, _ = fetch_static(url)
+        return done(html_content, declared_encoding, 'static', 'browser unavailable')
+    # page_source is text, and we encode it as utf-8 ourselves
+    html_content, declared_encoding, info = done(html_content, 'utf-8', 'browser', reason)
+    info.update(details)
+    return html_content, declared_encoding, info
+
+def download_assets(url, original_domains=None, replacement_domains=None, save_dir=None, remove_tracking=False, remove_custom_tracking=False, remove_redirects=False, concurrency=None, progress=None, output=None, parser=None, render=None, asset_store=None, page_name='index.html', link_rewriter=None, metrics=None, budget=None, content_index=None, optimize_images=None, rendered=None, capture_network=False, ready=None, block=None):
+    # progress(stage, **details) is called as the clone moves through render, assets, rewrite and zip
+    # metrics (a CloneMetrics) receives stage timings and per-asset counters
+    # budget (a ByteBudget) caps the bytes downloaded; pages of one batch or crawl share it
+    # asset_store is shared between pages when several are cloned together
+    # link_rewriter(soup, url) lets a crawl rewrite <a href> to other cloned pages before assets are fetched
+    report = progress or (lambda stage, **details: None)
+    metrics = metrics or CloneMetrics()
+    budget = budget or ByteBudget()
+    content_index = content_index or ContentIndex()
+    # optimize_images is the settings dict from image_settings(), or None to keep images as downloaded
+    optimizer = ImageOptimizer(optimize_images) if optimize_images else None
+    # capture_network builds the clone from the bodies the browser loaded; only the rest is fetched again
+    capture = NetworkCapture() if capture_network and rendered is None else None
+    capture_store = None
+    # Stop fetching once a streaming client disconnects (output is assigned below when not given)
+    fetcher = ConcurrentFetcher(max_workers=concurrency, progress=progress, cancelled=lambda: getattr(output, 'cancelled', False))
+    try:
+        # Get the website name for the save directory
+        website_name = urlparse(url).netloc.replace('www.', '')
+        if not save_dir:
+            save_dir = f'{website_name}_{int(time.time())}'
+
+        # Where the clone is written: a temp directory zipped at the end, or straight into a zip stream
+        if output is None:
+            output = DirectoryOutput(save_dir, directories=ASSET_TYPES)
+        
+        # rendered is a (html, declared encoding, info) result of render_page() when the caller already has the page
+        if rendered is None:
+            report('render', state='running')
+            with metrics.stage('render'):
+                rendered = render_page(url, render, metrics, capture, ready, block)
+        html_content, declared_encoding, render_info = rendered
+        print(f"Rendered with {render_info['strategy']} in {render_info['seconds']}s ({render_info['reason']})")  # Debug log
         
+        report('render', state='done', **render_info)
+        if capture and capture.entries:
+            print(f"Captured {len(capture.entries)} responses ({capture.bytes} bytes) while rendering")  # Debug log
+            asset_store = capture_store = CaptureStore(capture, asset_store)
+
         # Detect the correct encoding
-        encoding = detect_encoding(html_content)
+        decode_started = time.perf_counter()
+        encoding = detect_encoding(html_content, declared_encoding)
         print(f"Detected encoding: {encoding}")  # Debug log
         
         # Decode the content with the detected encoding
@@ -389,32 +857,19 @@ def download_assets(url, original_domains=None, replacement_domains=None, save_d
                     break
                 except UnicodeDecodeError:
                     continue
+        metrics.add_stage('detect_encoding', time.perf_counter() - decode_started)
         
-        # Create directories for different asset types
-        asset_types = {
-            'images': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg'],
-            'css': ['.css'],
-            'js': ['.js'],
-            'videos': ['.mp4', '.webm', '.ogg'],
-            'fonts': ['.woff', '.woff2', '.ttf', '.eot', '.otf'],
-            'icons': ['.ico', '.png'],
-            'others': []
-        }
-        
-        for asset_type in asset_types:
-            os.makedirs(os.path.join(save_dir, asset_type), exist_ok=True)
-        
-        # Ensure content is extracted properly with the correct encoding
-        soup = BeautifulSoup(html_content, 'html.parser', from_encoding=encoding)
+        # Parse once; the same tree is serialized once at the end
+        with metrics.stage('parse'):
+            soup = BeautifulSoup(html_content, resolve_parser(parser))
         
         # Remove tracking scripts if requested and remove redirects if enabled
         if remove_tracking or remove_custom_tracking or remove_redirects:
-            remove_tracking_scripts(soup, remove_tracking, remove_custom_tracking, remove_redirects)
-        
-        # Save the cleaned HTML content to a file with proper encoding
-        html_file_path = os.path.join(save_dir, 'index.html')
-        with open(html_file_path, 'w', encoding=encoding, errors='replace') as html_file:
-            html_file.write(soup.prettify())
+            with metrics.stage('tracking'):
+                remove_tracking_scripts(soup, remove_tracking, remove_custom_tracking, remove_redirects, base_url=url)
+
+        if link_rewriter:
+            link_rewriter(soup, url)
             
         # Continue with the rest of the asset downloading process
         # Dictionary to store downloaded files and their local paths
@@ -422,6 +877,7 @@ def download_assets(url, original_domains=None, replacement_domains=None, save_d
 
         # Step 2: First download all assets
         def download_all_assets():
+            stage_started = time.perf_counter()
             # Process all elements with URL attributes
             url_attributes = {
                 'img': ['src', 'data-src', 'data-srcset'],
@@ -437,322 +893,468 @@ def download_assets(url, original_domains=None, replacement_domains=None, save_d
                 'meta': ['content']
             }
 
+            # Collect every URL attribute first so the downloads can run in parallel
+            references = []
             for tag, attrs in url_attributes.items():
                 for element in soup.find_all(tag):
+                    # Stylesheets are fetched and rewritten by the CSS stage below
+                    if tag == 'link' and 'stylesheet' in (element.get('rel') or []):
+                        continue
                     for attr in attrs:
                         if element.has_attr(attr):
                             original_url = element[attr]
                             if original_url.startswith('data:'):
                                 continue
-                                
+
                             try:
                                 # Make URL absolute
-                                absolute_url = urljoin(url, original_url)
-                                
-                                # Skip if already downloaded
-                                if absolute_url in downloaded_files:
-                                    element[attr] = downloaded_files[absolute_url]
-                                    continue
-
-                                # Determine asset type and download
-                                ext = os.path.splitext(urlparse(absolute_url).path)[1].lower()
-                                asset_type = 'others'
-                                for type_name, extensions in asset_types.items():
-                                    if ext in extensions:
-                                        asset_type = type_name
-                                        break
-
-                                local_path = download_and_save_asset(absolute_url, url, save_dir, asset_type)
-                                if local_path:
-                                    downloaded_files[absolute_url] = local_path
-                                    element[attr] = local_path
+                                references.append((element, attr, urljoin(url, original_url)))
                             except Exception as e:
                                 print(f'Error processing URL {original_url}: {str(e)}')
 
-            # Download and process CSS files
+            pending = [absolute_url for _, _, absolute_url in references if absolute_url not in downloaded_files]
+            downloaded_files.update(fetcher.map(
+                lambda asset_url: download_and_save_asset(asset_url, url, output, get_asset_type(asset_url), asset_store, metrics, budget, content_index, optimizer),
+                pending,
+                group_key=asset_file_key
+            ))
+
+            # Rewrite all attributes in one pass
+            for element, attr, absolute_url in references:
+                if downloaded_files.get(absolute_url):
+                    element[attr] = downloaded_files[absolute_url]
+
+            metrics.add_stage('assets', time.perf_counter() - stage_started)
+            stage_started = time.perf_counter()
+
+            # Stylesheets, <style> blocks and style attributes go through one CSS pipeline
+            def fetch_css_asset(asset_url):
+                local_path = download_and_save_asset(asset_url, url, output, None, asset_store, metrics, budget, content_index, optimizer)
+                return local_path if local_path != asset_url else None
+
+            def css_filename(sheet):
+                filename = safe_filename(sheet.url)
+                if not filename.endswith('.css'):
+                    filename += '.css'
+                # Claimed in the content index shared by every page of a crawl: the key covers the text and where its
+                # references point, so identical sheets share a file and different ones with the same name get a suffix
+                text = '\n'.join([sheet.text] + [sheet.absolute(reference) for reference in sheet.references])
+                key = hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+                relpath, _ = content_index.claim(f'css/{filename}', f'css:{key}', len(sheet.text))
+                return relpath.split('/', 1)[1]
+
+            css = CssPipeline(
+                fetch_text=lambda css_url: fetch_text(css_url, asset_store, metrics, 'css', budget),
+                fetch_asset=fetch_css_asset,
+                map_urls=lambda fn, urls: fetcher.map(fn, urls, group_key=asset_file_key),
+                filename_for=css_filename,
+            )
+
+            links = []
             for link in soup.find_all('link', rel='stylesheet'):
                 if link.get('href'):
                     try:
-                        css_url = urljoin(url, link['href'])
-                        if css_url in downloaded_files:
-                            link['href'] = downloaded_files[css_url]
-                            continue
-
-                        css_response = requests.get(css_url, headers={
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                        })
-                        if css_response.ok:
-                            css_content = css_response.text
-                            
-                            # Download assets referenced in CSS
-                            url_pattern = r'url\((.*?)\)'
-                            for match in re.finditer(url_pattern, css_content):
-                                css_asset_url = match.group(1)
-                                if not css_asset_url.startswith('data:'):
-                                    absolute_url = urljoin(css_url, css_asset_url)
-                                    if absolute_url not in downloaded_files:
-                                        local_path = download_and_save_asset(absolute_url, url, save_dir, 'images')
-                                        if local_path:
-                                            downloaded_files[absolute_url] = local_path
-                                            css_content = css_content.replace(css_asset_url, f'../{local_path}')
-
-                            # Save CSS with original filename
-                            css_filename = safe_filename(css_url)
-                            if not css_filename.endswith('.css'):
-                                css_filename += '.css'
-                            css_path = os.path.join(save_dir, 'css', css_filename)
-                            with open(css_path, 'w', encoding='utf-8', errors='ignore') as f:
-                                f.write(css_content)
-                            
-                            downloaded_files[css_url] = f'css/{css_filename}'
-                            link['href'] = f'css/{css_filename}'
+                        links.append((link, urljoin(url, link['href'])))
                     except Exception as e:
                         print(f'Error processing CSS file: {str(e)}')
+            css.load(css_url for _, css_url in links)
+
+            style_blocks = [(style, css.add_inline(style.string, url)) for style in soup.find_all('style') if style.string]
+            style_attributes = [(element, css.add_inline(element['style'], url)) for element in soup.find_all(style=True)]
+
+            css.fetch_assets()
+
+            for sheet in css.sheets.values():
+                try:
+                    output.write_text(f'css/{sheet.filename}', css.rewrite(sheet, 'css'))
+                except Exception as e:
+                    print(f'Error processing CSS file: {str(e)}')
+            for link, css_url in links:
+                if css_url in css.sheets:
+                    link['href'] = css.local_path(css_url)
+
+            # Embedded CSS is relative to the page itself
+            for style, sheet in style_blocks:
+                if sheet.references:
+                    style.string = css.rewrite(sheet, '.')
+            for element, sheet in style_attributes:
+                if sheet.references:
+                    element['style'] = css.rewrite(sheet, '.')
+
+            downloaded_files.update((css_url, css.local_path(css_url)) for css_url in css.sheets)
+            downloaded_files.update((asset_url, local_path) for asset_url, local_path in css.assets.items() if local_path)
+
+            metrics.add_stage('css', time.perf_counter() - stage_started)
+            stage_started = time.perf_counter()
 
             # Download JavaScript files
+            scripts = []
             for script in soup.find_all('script', src=True):
                 if script.get('src'):
                     try:
-                        js_url = urljoin(url, script['src'])
-                        if js_url in downloaded_files:
-                            script['src'] = downloaded_files[js_url]
-                            continue
-
-                        js_response = requests.get(js_url, headers={
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                        })
-                        if js_response.ok:
-                            js_content = js_response.text
-                            
-                            # Save JavaScript with original filename
-                            js_filename = safe_filename(js_url)
-                            if not js_filename.endswith('.js'):
-                                js_filename += '.js'
-                            js_path = os.path.join(save_dir, 'js', js_filename)
-                            with open(js_path, 'w', encoding='utf-8', errors='ignore') as f:
-                                f.write(js_content)
-                            
-                            downloaded_files[js_url] = f'js/{js_filename}'
-                            script['src'] = f'js/{js_filename}'
+                        scripts.append((script, urljoin(url, script['src'])))
+                    except Exception as e:
+                        print(f'Error processing JavaScript file: {str(e)}')
+
+            js_texts = fetcher.map(lambda js_url: fetch_text(js_url, asset_store, metrics, 'js', budget), [js_url for _, js_url in scripts if js_url not in downloaded_files])
+
+            for script, js_url in scripts:
+                if js_url in downloaded_files:
+                    script['src'] = downloaded_files[js_url]
+                    continue
+
+                js_content = js_texts.get(js_url)
+                if js_content is not None:
+                    try:
+                        # Save JavaScript with original filename
+                        js_filename = safe_filename(js_url)
+                        if not js_filename.endswith('.js'):
+                            js_filename += '.js'
+                        js_bytes = js_content.encode('utf-8', errors='ignore')
+                        js_path, duplicate = content_index.claim(f'js/{js_filename}', hashlib.sha256(js_bytes).hexdigest(), len(js_bytes))
+                        if duplicate:
+                            metrics.duplicate('js', len(js_bytes))
+                        else:
+                            output.write_text(js_path, js_content)
+
+                        downloaded_files[js_url] = js_path
+                        script['src'] = js_path
                     except Exception as e:
                         print(f'Error processing JavaScript file: {str(e)}')
 
+            metrics.add_stage('js', time.perf_counter() - stage_started)
+
         # Step 3: Download all assets first
+        report('assets', state='running', fetched=0, total=0)
         download_all_assets()
+        images_started = time.perf_counter()
+
+        def download_images(image_urls, base_url, save_dir):
+            """Download image URLs in parallel and return {url: local_path}"""
+            return fetcher.map(
+                lambda image_url: download_and_save_asset(image_url, base_url, output, 'images', asset_store, metrics, budget, content_index, optimizer),
+                image_urls,
+                group_key=asset_file_key
+            )
 
-        # Download background images from styles and update paths in the CSS
-        def download_background_images(soup, base_url, save_dir):
-            """Download background images from styles and update paths in the soup object."""
-            styles = soup.find_all('style')
+        def rewrite_srcsets(elements, base_url, save_dir, label):
+            """Download images from the srcset of each element and update the paths in place"""
             image_formats = ['.png', '.jpeg', '.jpg', '.gif', '.webp', '.webm']
-            for style in styles:
-                css_content = style.string
-                if css_content:
-                    # Find all URLs in the CSS content
-                    urls = re.findall(r'url\((.*?)\)', css_content)
-                    for url in urls:
-                        url = url.strip('"')  # Clean URL
-                        # Convert relative URLs to absolute URLs
-                        full_url = urljoin(base_url, url)
-                        # Check if the URL ends with an image format
-                        if any(full_url.endswith(fmt) for fmt in image_formats):
-                            print(f'Downloading image from: {full_url}')  # Debug log
-                            local_path = download_and_save_asset(full_url, base_url, save_dir, 'images')
-                            if local_path:
-                                # Update the CSS content with the local path
-                                css_content = css_content.replace(url, f'../{local_path}')
-                    # Update the style tag with modified CSS
-                    style.string = css_content
-
-            # Check for background images in all elements with inline styles
-            for element in soup.find_all(style=True):
-                inline_style = element['style']
-                urls = re.findall(r'background-image:\s*url\((.*?)\)', inline_style)
+            srcsets = []
+            for element in elements:
+                srcset = element.get('srcset')
+                if srcset:
+                    # Split the srcset into individual URLs, keeping the part before any size descriptor
+                    urls = [src.strip().split(' ')[0] for src in srcset.split(',')]
+                    # Keep only URLs that end with an image format
+                    urls = [url for url in urls if any(urljoin(base_url, url).endswith(fmt) for fmt in image_formats)]
+                    srcsets.append((element, srcset, urls))
+
+            image_urls = [urljoin(base_url, url) for _, _, urls in srcsets for url in urls]
+            for full_url in dict.fromkeys(image_urls):
+                print(f'Downloading image from {label}: {full_url}')  # Debug log
+            local_paths = download_images(image_urls, base_url, save_dir)
+
+            for element, srcset, urls in srcsets:
                 for url in urls:
-                    url = url.strip('"')  # Clean URL
-                    full_url = urljoin(base_url, url)
-                    if any(full_url.endswith(fmt) for fmt in image_formats):
-                        print(f'Downloading background image from: {full_url}')  # Debug log
-                        local_path = download_and_save_asset(full_url, base_url, save_dir, 'images')
-                        if local_path:
-                            # Update the inline style with the local path
-                            inline_style = inline_style.replace(url, f'../{local_path}')
-                element['style'] = inline_style
-
-        download_background_images(soup, url, save_dir)  # Call to download background images
+                    local_path = local_paths.get(urljoin(base_url, url))
+                    if local_path:
+                        # Update the srcset with the local path
+                        srcset = srcset.replace(url, local_path)
+                        if element.get('type') and optimizer and local_path.endswith(OUTPUT_FORMATS[optimizer.settings['format']][1]):
+                            # A <source type> must match the optimized format or browsers may skip it
+                            element['type'] = OUTPUT_FORMATS[optimizer.settings['format']][2]
+                element['srcset'] = srcset
 
         # Download images from srcset attributes
         def download_images_from_srcset(soup, base_url, save_dir):
             """Download images from srcset attributes and update paths in the soup object."""
-            image_formats = ['.png', '.jpeg', '.jpg', '.gif', '.webp', '.webm']
-            for img in soup.find_all('img'):
-                srcset = img.get('srcset')
-                if srcset:
-                    # Split the srcset into individual URLs
-                    sources = [src.strip() for src in srcset.split(',')]
-                    for source in sources:
-                        url = source.split(' ')[0]  # Get the URL before any size descriptor
-                        full_url = urljoin(base_url, url)
-                        # Check if the URL ends with an image format
-                        if any(full_url.endswith(fmt) for fmt in image_formats):
-                            print(f'Downloading image from srcset: {full_url}')  # Debug log
-                            local_path = download_and_save_asset(full_url, base_url, save_dir, 'images')
-                            if local_path:
-                                # Update the srcset with the local path
-                                srcset = srcset.replace(url, local_path)
-                    # Update the img tag with modified srcset
-                    img['srcset'] = srcset
+            rewrite_srcsets(soup.find_all('img'), base_url, save_dir, 'srcset')
 
         download_images_from_srcset(soup, url, save_dir)
 
         # Download images from picture tags
         def download_images_from_picture_tags(soup, base_url, save_dir):
             """Download images from srcset attributes in picture tags and update paths in the soup object."""
-            image_formats = ['.png', '.jpeg', '.jpg', '.gif', '.webp', '.webm']
-            for picture in soup.find_all('picture'):
-                for source in picture.find_all('source'):
-                    srcset = source.get('srcset')
-                    if srcset:
-                        # Split the srcset into individual URLs
-                        sources = [src.strip() for src in srcset.split(',')]
-                        for source_url in sources:
-                            url = source_url.split(' ')[0]  # Get the URL before any size descriptor
-                            full_url = urljoin(base_url, url)
-                            # Check if the URL ends with an image format
-                            if any(full_url.endswith(fmt) for fmt in image_formats):
-                                print(f'Downloading image from picture tag srcset: {full_url}')  # Debug log
-                                local_path = download_and_save_asset(full_url, base_url, save_dir, 'images')
-                                if local_path:
-                                    # Update the srcset with the local path
-                                    srcset = srcset.replace(url, local_path)
-                        # Update the source tag with modified srcset
-                        source['srcset'] = srcset
+            sources = [source for picture in soup.find_all('picture') for source in picture.find_all('source')]
+            rewrite_srcsets(sources, base_url, save_dir, 'picture tag srcset')
 
         download_images_from_picture_tags(soup, url, save_dir)
 
+        # Lazy images, fonts and XHR/fetch data the page loaded from scripts are archived even though no tag references them
+        if capture_store:
+            extras = [extra_url for extra_url in capture.extra_urls() if extra_url not in capture_store.requested]
+            fetcher.map(
+                lambda extra_url: download_and_save_asset(extra_url, url, output, None, asset_store, metrics, budget, content_index, optimizer),
+                extras,
+                group_key=asset_file_key
+            )
+            report('capture', state='done', extras=len(extras), **capture_store.capture_stats())
+        metrics.add_stage('images', time.perf_counter() - images_started)
+        if optimizer:
+            metrics.add_stage('optimize_images', optimizer.wall_seconds())
+            metrics.optimized_images(optimizer.report())
+
+        report('assets', state='done')
+        report('rewrite', state='running')
+
+        # Serialize the document once
+        with metrics.stage('serialize'):
+            html_content = soup.prettify()
+
         # Step 4: Now perform domain replacements if needed
         if original_domains and replacement_domains:
-            # Replace domains in HTML content
-            html_content = str(soup)
-            html_content = replace_text_content(html_content, original_domains, replacement_domains)
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Replace domains in all downloaded JavaScript files
-            for js_file in os.listdir(os.path.join(save_dir, 'js')):
-                js_path = os.path.join(save_dir, 'js', js_file)
-                try:
-                    with open(js_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        js_content = f.read()
-                    js_content = replace_text_content(js_content, original_domains, replacement_domains)
-                    with open(js_path, 'w', encoding='utf-8', errors='ignore') as f:
-                        f.write(js_content)
-                except Exception as e:
-                    print(f'Error processing JavaScript file {js_file}: {str(e)}')
+            with metrics.stage('domain_replace'):
+                # One compiled matcher shared by the HTML, JS and CSS rewrites
+                rewrite_domains = DomainReplacer(original_domains, replacement_domains)
 
-            # Replace domains in all downloaded CSS files
-            for css_file in os.listdir(os.path.join(save_dir, 'css')):
-                css_path = os.path.join(save_dir, 'css', css_file)
-                try:
-                    with open(css_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        css_content = f.read()
-                    css_content = replace_text_content(css_content, original_domains, replacement_domains)
-                    with open(css_path, 'w', encoding='utf-8', errors='ignore') as f:
-                        f.write(css_content)
-                except Exception as e:
-                    print(f'Error processing CSS file {css_file}: {str(e)}')
+                # Replace domains in the serialized HTML instead of re-parsing it
+                html_content = rewrite_domains(html_content)
+
+                # Replace domains in all downloaded JavaScript and CSS files
+                output.rewrite_text('js', rewrite_domains)
+                output.rewrite_text('css', rewrite_domains)
 
         # Save the final modified HTML file
-        with open(os.path.join(save_dir, 'index.html'), 'w', encoding='utf-8', errors='ignore') as f:
-            f.write(str(soup.prettify()))
+        output.write_text(page_name, html_content)
 
-        # Create zip file
-        zip_name = f'website_{int(time.time())}.zip'
-        shutil.make_archive(os.path.splitext(zip_name)[0], 'zip', save_dir)
+        report('rewrite', state='done')
+        report('zip', state='running')
 
-        # Clean up the temporary directory
-        try:
-            shutil.rmtree(save_dir)
-        except Exception as e:
-            print(f'Error cleaning up temporary directory: {str(e)}')
+        # Create zip file (suffix keeps concurrent clones from sharing a name)
+        zip_name = f'website_{int(time.time())}_{uuid.uuid4().hex[:8]}.zip'
+        with metrics.stage('finalize'):
+            zip_name = output.finalize(zip_name)
+        report('zip', state='done')
 
+        metrics.finish('done')
         return zip_name
+    except CloneCancelled as e:
+        metrics.finish('cancelled')
+        output.abort()
+        print(f'Clone of {url} cancelled: {str(e)}')
+        return f'Clone cancelled: {str(e)}'
     except requests.RequestException as e:
+        metrics.finish('failed')
+        if output is not None:
+            output.abort()
         return f"Error accessing the website: {str(e)}"
     except Exception as e:
+        metrics.finish('failed')
+        if output is not None:
+            output.abort()
         # Log the error message
         print(f'Error occurred: {str(e)}')  # Debug log
         
-        # Check content type to ensure we're getting HTML
-        content_type = e.response.headers.get('Content-Type', '').lower()
-        print(f'Content-Type: {content_type}')  # Debug log
-        if 'text/html' not in content_type and 'application/xhtml+xml' not in content_type:
-            print(f'Unexpected content type: {content_type}')  # Log unexpected content types
-            return "Error: URL does not return HTML content"
+        # Check content type to ensure we're getting HTML (only HTTP errors carry a response)
+        response = getattr(e, 'response', None) if isinstance(e, requests.RequestException) else None
+        if response is not None:
+            content_type = response.headers.get('Content-Type', '').lower()
+            print(f'Content-Type: {content_type}')  # Debug log
+            if 'text/html' not in content_type and 'application/xhtml+xml' not in content_type:
+                print(f'Unexpected content type: {content_type}')  # Log unexpected content types
+                return "Error: URL does not return HTML content"
         return f"An unexpected error occurred: {str(e)}"
+    finally:
+        if capture_store:
+            capture_store.close()
+        if capture:
+            capture.close()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def parse_download_options(data):
+    """Validate a clone request body and return keyword arguments for download_assets"""
+    if not data:
+        raise ValueError('Invalid JSON data')
+
+    url = data.get('url')
+    app.logger.info('URL provided: %s', url)
+    if not url:
+        raise ValueError('URL is required')
+
+    # Handle optional domain replacement
+    original_domains = [d.strip() for d in data.get('originalDomain', '').split(',') if d.strip()]
+    replacement_domains = [d.strip() for d in data.get('replacementDomain', '').split(',') if d.strip()]
+    app.logger.info('Original domains: %s', original_domains)
+    app.logger.info('Replacement domains: %s', replacement_domains)
+    
+    # Get optional tracking removal settings
+    remove_tracking = data.get('removeTracking', False)
+    remove_custom_tracking = data.get('removeCustomTracking', False)
+    remove_redirects = data.get('removeRedirects', False)  # New parameter for removing redirects
+    app.logger.info('Remove tracking: %s, Remove custom tracking: %s, Remove redirects: %s', remove_tracking, remove_custom_tracking, remove_redirects)
+
+    # Optional number of parallel asset downloads
+    concurrency = data.get('concurrency')
+    if concurrency is not None:
+        try:
+            concurrency = int(concurrency)
+        except (TypeError, ValueError):
+            raise ValueError('concurrency must be an integer')
+        if not 1 <= concurrency <= ASSET_CONCURRENCY_MAX:
+            raise ValueError(f'concurrency must be between 1 and {ASSET_CONCURRENCY_MAX}')
+    app.logger.info('Asset concurrency: %s', concurrency or ASSET_CONCURRENCY)
+
+    # Optional render strategy: static, browser or auto
+    render = data.get('render') or None
+    if render is not None and render not in RENDER_STRATEGIES:
+        raise ValueError(f'render must be one of: {", ".join(RENDER_STRATEGIES)}')
+    app.logger.info('Render strategy: %s', render or RENDER_STRATEGY)
+
+    # Optional HTML parser backend
+    parser = data.get('parser') or None
+    if parser is not None and parser not in HTML_PARSERS:
+        raise ValueError(f'parser must be one of: {", ".join(HTML_PARSERS)}')
+
+    # Optional image recompression: true or {format, quality, maxWidth, maxHeight, minBytes}
+    optimize_images = image_settings(data.get('optimizeImages'))
+
+    # Optional readiness for browser renders: 'load', 'idle' or {strategy, quietMs, scroll, deadline}
+    ready = ready_settings(data.get('ready'))
+
+    # Optional: build the clone from the responses the browser received while rendering
+    capture_network = bool(data.get('captureNetwork', False))
+    if capture_network and render == 'static':
+        raise ValueError('captureNetwork needs render browser or auto')
+
+    # Optional requests the browser skips while rendering: true/false or {types, trackers}
+    block = block_settings(data.get('block'), remove_tracking, remove_custom_tracking, capture_network)
+    
+    # Validate domains if they are provided
+    if original_domains or replacement_domains:
+        if not original_domains:
+            raise ValueError('Original domains are required when using domain replacement')
+        if not replacement_domains:
+            raise ValueError('Replacement domains are required when using domain replacement')
+        if len(original_domains) != len(replacement_domains):
+            raise ValueError('Number of original domains must match number of replacement domains')
+        
+        # Clean up domain inputs
+        original_domains = [d.strip().lower().replace('www.', '') for d in original_domains]
+        replacement_domains = [d.strip().lower().replace('www.', '') for d in replacement_domains]
+        app.logger.info('Cleaned original domains: %s', original_domains)
+        app.logger.info('Cleaned replacement domains: %s', replacement_domains)
+
+    return {
+        'url': url,
+        'original_domains': original_domains,
+        'replacement_domains': replacement_domains,
+        'remove_tracking': remove_tracking,
+        'remove_custom_tracking': remove_custom_tracking,
+        'remove_redirects': remove_redirects,
+        'concurrency': concurrency,
+        'parser': parser,
+        'render': render,
+        'optimize_images': optimize_images,
+        'capture_network': capture_network,
+        'ready': ready,
+        'block': block,
+    }
+
+class StageCollector:
+    """Progress callback that keeps the latest details and wall time of each stage for response metadata"""
+
+    def __init__(self):
+        self.stages = {}
+        self._started = {}
+
+    def __call__(self, stage, **details):
+        state = details.get('state')
+        if state == 'running' and stage not in self._started:
+            self._started[stage] = time.perf_counter()
+        elif state == 'done' and stage in self._started:
+            details['seconds'] = details.get('seconds', round(time.perf_counter() - self._started[stage], 3))
+        self.stages.setdefault(stage, {}).update(details)
+
+    def timings(self):
+        return {stage: details['seconds'] for stage, details in self.stages.items() if 'seconds' in details}
+
+    def headers(self):
+        render = self.stages.get('render', {})
+        headers = {}
+        if 'strategy' in render:
+            headers['X-Render-Strategy'] = render['strategy']
+            headers['X-Render-Reason'] = render['reason']
+            headers['X-Render-Seconds'] = str(render['seconds'])
+        if render.get('ready'):
+            headers['X-Render-Ready'] = f"{render['ready']['outcome']};dur={render['ready']['seconds'] * 1000:.1f}"
+        return headers
+
 @app.route('/download', methods=['POST'])
 def download_website():
     try:
         data = request.json
         app.logger.error('Received data: %s', data)
-        if not data:
-            app.logger.error('Invalid JSON data')
-            return jsonify({'error': 'Invalid JSON data'}), 400
-
-        url = data.get('url')
-        app.logger.info('URL provided: %s', url)
-        if not url:
-            app.logger.error('URL is required')
-            return jsonify({'error': 'URL is required'}), 400
-
-        # Handle optional domain replacement
-        original_domains = [d.strip() for d in data.get('originalDomain', '').split(',') if d.strip()]
-        replacement_domains = [d.strip() for d in data.get('replacementDomain', '').split(',') if d.strip()]
-        app.logger.info('Original domains: %s', original_domains)
-        app.logger.info('Replacement domains: %s', replacement_domains)
-        
-        # Get optional tracking removal settings
-        remove_tracking = data.get('removeTracking', False)
-        remove_custom_tracking = data.get('removeCustomTracking', False)
-        remove_redirects = data.get('removeRedirects', False)  # New parameter for removing redirects
-        app.logger.info('Remove tracking: %s, Remove custom tracking: %s, Remove redirects: %s', remove_tracking, remove_custom_tracking, remove_redirects)
-        
-        # Validate domains if they are provided
-        if original_domains or replacement_domains:
-            if not original_domains:
-                app.logger.error('Original domains are required when using domain replacement')
-                return jsonify({'error': 'Original domains are required when using domain replacement'}), 400
-            if not replacement_domains:
-                app.logger.error('Replacement domains are required when using domain replacement')
-                return jsonify({'error': 'Replacement domains are required when using domain replacement'}), 400
-            if len(original_domains) != len(replacement_domains):
-                app.logger.error('Number of original domains must match number of replacement domains')
-                return jsonify({'error': 'Number of original domains must match number of replacement domains'}), 400
-            
-            # Clean up domain inputs
-            original_domains = [d.strip().lower().replace('www.', '') for d in original_domains]
-            replacement_domains = [d.strip().lower().replace('www.', '') for d in replacement_domains]
-            app.logger.info('Cleaned original domains: %s', original_domains)
-            app.logger.info('Cleaned replacement domains: %s', replacement_domains)
+        try:
+            options = parse_download_options(data)
+        except ValueError as e:
+            app.logger.error('%s', str(e))
+            return jsonify({'error': str(e)}), 400
+
+        # Repeated requests for the same URL and options are served from the result cache ("cache": false skips it)
+        result_cache = get_result_cache() if data.get('cache', True) else None
+        key = download_result_key(options) if result_cache else None
+
+        # With a shared queue a worker does the clone: serve a cached archive, or hand back the job to poll like /jobs.
+        # An identical request still queued or running gets that job back; the worker fills the result cache.
+        if JOB_QUEUE_DB:
+            cached = result_cache.lookup(key) if result_cache else None
+            if cached:
+                return cached_result_response(cached, 'hit')
+            try:
+                job = job_manager.submit(options, result_key=key)
+            except JobQueueFull as e:
+                app.logger.error('%s', str(e))
+                return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+            app.logger.info('Download job queued: %s', job.id)
+            return jsonify({
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/jobs/{job.id}',
+                'download_url': f'/jobs/{job.id}/download',
+            }), 202
+
+        # Stream the archive to the client while the clone is still running
+        if data.get('stream'):
+            cached = result_cache.lookup(key) if result_cache else None
+            if cached:
+                return cached_result_response(cached, 'hit')
+            return stream_download(options)
         
-        save_dir = f'temp_website_{int(time.time())}'
-        zip_file = download_assets(
-            url=url,
-            original_domains=original_domains,
-            replacement_domains=replacement_domains,
-            save_dir=save_dir,
-            remove_tracking=remove_tracking,
-            remove_custom_tracking=remove_custom_tracking,
-            remove_redirects=remove_redirects  # Pass the new parameter
-        )
+        save_dir = f'temp_website_{uuid.uuid4().hex}'
+        stages = StageCollector()
+        metrics = CloneMetrics()
+
+        def clone():
+            zip_file = download_assets(save_dir=save_dir, progress=stages, metrics=metrics, **options)
+            app.logger.info('Zip file generated: %s', zip_file)
+            if not zip_file.endswith('.zip'):
+                raise CloneFailed(zip_file)
+            return zip_file
+
+        if result_cache:
+            try:
+                zip_file, status = result_cache.fetch(key, clone)
+            except CloneFailed as e:
+                app.logger.error('Error in zip file generation: %s', str(e))
+                return jsonify({'error': str(e)}), 500
+            app.logger.info('Result cache %s: %s', status, zip_file)
+            response = cached_result_response(zip_file, status)
+            if status == 'miss':
+                response.headers.update(stages.headers())
+                response.headers['Server-Timing'] = metrics.server_timing()
+            return response
+
+        zip_file = download_assets(save_dir=save_dir, progress=stages, metrics=metrics, **options)
         app.logger.info('Zip file generated: %s', zip_file)
         
         if zip_file.endswith('.zip'):
-            response = send_file(zip_file, as_attachment=True, mimetype='application/zip')
+            response = send_file(os.path.abspath(zip_file), as_attachment=True, mimetype='application/zip')
+            response.headers.update(stages.headers())
+            response.headers['Server-Timing'] = metrics.server_timing()
             # Clean up zip file after sending
             try:
                 os.remove(zip_file)
@@ -767,5 +1369,668 @@ def download_website():
         app.logger.error('Exception occurred: %s', str(e))
         return jsonify({'error': str(e)}), 500
 
+class CloneFailed(Exception):
+    """A clone that ended with an error message instead of an archive"""
+
+def download_result_key(options):
+    """Result cache key of a /download request: the normalized URL plus the options that shape the archive"""
+    return result_key(normalize_page_url(options['url']), {name: value for name, value in options.items() if name not in ('url', 'concurrency')})
+
+def cached_result_response(path, status):
+    """Send an archive owned by the result cache (left in place for later requests)"""
+    # Opened right away so a concurrent eviction can not remove it before it is sent
+    response = send_file(open(path, 'rb'), as_attachment=True, download_name=f'website_{int(time.time())}.zip', mimetype='application/zip')
+    response.headers['X-Result-Cache'] = status
+    return response
+
+def stream_download(options):
+    """Run the clone on a background thread and stream its zip as a chunked response"""
+    stream = QueueStream()
+    output = ZipOutput(stream, directories=ASSET_TYPES)
+    stages = StageCollector()
+    result = {}
+
+    def run():
+        try:
+            result['zip'] = download_assets(output=output, progress=stages, **options)
+        except Exception as e:
+            result['zip'] = str(e)
+        finally:
+            stream.finish()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    # Nothing reaches the client until the first asset is archived, so failures before that still get a JSON error
+    stream.wait_started()
+    if 'zip' in result and not result['zip'].endswith('.zip'):
+        app.logger.error('Error in zip stream generation: %s', result.get('zip'))
+        return jsonify({'error': result.get('zip')}), 500
+
+    filename = f'website_{int(time.time())}.zip'
+    app.logger.info('Streaming zip: %s', filename)
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    headers.update(stages.headers())
+    return Response(stream.iter_chunks(), mimetype='application/zip', headers=headers)
+
+def parse_batch_options(data):
+    """Validate a /batch body: top-level options are defaults that each page entry may override"""
+    if not data:
+        raise ValueError('Invalid JSON data')
+    pages = data.get('pages')
+    if not isinstance(pages, list) or not pages:
+        raise ValueError('pages must be a non-empty list')
+    if len(pages) > BATCH_MAX_PAGES:
+        raise ValueError(f'At most {BATCH_MAX_PAGES} pages can be cloned in one batch')
+
+    defaults = {key: value for key, value in data.items() if key != 'pages'}
+    parsed = []
+    for index, page in enumerate(pages):
+        if isinstance(page, str):
+            page = {'url': page}
+        if not isinstance(page, dict):
+            raise ValueError(f'pages[{index}] must be a URL or an object')
+        try:
+            parsed.append(parse_download_options(dict(defaults, **page)))
+        except ValueError as e:
+            raise ValueError(f'pages[{index}]: {str(e)}')
+    return {'pages': parsed}
+
+def batch_folder(index, url, count):
+    """Archive subfolder for one page of a batch, e.g. 03_example.com"""
+    host = re.sub(r'[^A-Za-z0-9._-]', '_', urlparse(url).netloc.replace('www.', '')) or 'page'
+    return f'{index + 1:0{len(str(count))}d}_{host}'
+
+def download_batch(pages, output, progress=None):
+    """Clone several pages into one archive, one subfolder per page plus manifest.json.
+
+    Pages share a download store, so an asset used by several pages is fetched
+    once; parallel pages do not multiply the load on one server because every
+    request goes through the HTTP client's per-host scheduler. Returns the manifest.
+    """
+    report = progress or (lambda stage, **details: None)
+    store = SharedAssetStore()
+    budget = ByteBudget()
+    folders = [batch_folder(index, page['url'], len(pages)) for index, page in enumerate(pages)]
+    results = [None] * len(pages)
+    done = [0]
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def clone(index):
+        page = pages[index]
+        stages = StageCollector()
+        metrics = CloneMetrics()
+        page_started = time.perf_counter()
+        try:
+            result = download_assets(
+                output=PrefixedOutput(output, folders[index]),
+                progress=stages,
+                metrics=metrics,
+                asset_store=store,
+                budget=budget,
+                **page
+            )
+        except Exception as e:
+            # One broken page is recorded as failed in the manifest instead of failing the batch
+            print(f'Error cloning batch page {page["url"]}: {str(e)}')
+            result = str(e)
+        ok = result.endswith('.zip')
+        results[index] = {
+            'url': page['url'],
+            'folder': folders[index],
+            'status': 'done' if ok else 'failed',
+            'error': None if ok else result,
+            'render': {key: stages.stages.get('render', {}).get(key) for key in ('strategy', 'reason')},
+            'assets': stages.stages.get('assets', {}).get('total', 0),
+            'timings': dict(stages.timings(), total=round(time.perf_counter() - page_started, 3)),
+            'metrics': metrics.to_dict(),
+        }
+        with lock:
+            done[0] += 1
+            report('pages', state='running', done=done[0], total=len(pages))
+
+    report('pages', state='running', done=0, total=len(pages))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_PAGE_CONCURRENCY, len(pages)))) as executor:
+            list(executor.map(clone, range(len(pages))))
+        report('pages', state='done', done=len(pages), total=len(pages))
+
+        manifest = {
+            'pages': results,
+            'succeeded': sum(1 for result in results if result['status'] == 'done'),
+            'failed': sum(1 for result in results if result['status'] != 'done'),
+            'shared_assets': store.stats(),
+            # Each page folder is self-contained, so bodies are deduplicated within a page only
+            'bytes_deduplicated': sum(result['metrics']['duplicates']['bytes_saved'] for result in results),
+            'bytes_downloaded': budget.used,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        output.write_text('manifest.json', json.dumps(manifest, indent=2))
+        return manifest
+    finally:
+        store.close()
+
+def normalize_page_url(url):
+    """Canonical form of a page URL for crawl dedup: no fragment, lowercase host, no default port, sorted query"""
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    port = parsed.port
+    netloc = host if port is None or (scheme, port) in (('http', 80), ('https', 443)) else f'{host}:{port}'
+    query = '&'.join(sorted(part for part in parsed.query.split('&') if part))
+    return urlunparse((scheme, netloc, parsed.path or '/', '', query, ''))
+
+def same_site(url, start_url):
+    """True when url is on the start page's host (www. is ignored)"""
+    return urlparse(url).netloc.lower().replace('www.', '') == urlparse(start_url).netloc.lower().replace('www.', '')
+
+def page_filename(url, taken):
+    """Local HTML file name for a crawled page, unique within taken"""
+    path = urlparse(url).path.strip('/')
+    stem = re.sub(r'[^A-Za-z0-9._-]+', '_', os.path.splitext(path)[0]).strip('_') or 'index'
+    name = f'{stem}.html'
+    if name in taken or urlparse(url).query:
+        name = f'{stem}_{hashlib.sha1(url.encode()).hexdigest()[:8]}.html'
+    return name
+
+class CrawlFrontier:
+    """Pages admitted to a crawl, keyed by normalized URL, within depth and page limits"""
+
+    def __init__(self, start_url, max_depth, max_pages):
+        self.start_url = start_url
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.pages = OrderedDict()  # normalized URL -> {'url', 'depth', 'file'}
+        self.pages[normalize_page_url(start_url)] = {'url': start_url, 'depth': 0, 'file': 'index.html'}
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def admit(self, url, depth):
+        """Return (page, added) for url; page is None when the link is not crawled"""
+        if urlparse(url).scheme not in ('http', 'https') or not same_site(url, self.start_url):
+            return None, False
+        if os.path.splitext(urlparse(url).path)[1].lower() not in PAGE_EXTENSIONS:
+            return None, False
+        key = normalize_page_url(url)
+        with self._lock:
+            if key in self.pages:
+                return self.pages[key], False
+            if depth > self.max_depth or len(self.pages) >= self.max_pages:
+                self.skipped += 1
+                return None, False
+            page = self.pages[key] = {'url': url, 'depth': depth, 'file': page_filename(key, {page['file'] for page in self.pages.values()})}
+            return page, True
+
+def crawl_site(options, output, max_depth=None, max_pages=None, progress=None):
+    """Clone the start page and same-site pages linked from it into one tree with manifest.json.
+
+    Pages are fetched concurrently as they are discovered. Every page is
+    written next to the others (index.html for the start page), so links
+    between cloned pages become relative file names and all pages share one
+    set of asset folders and one download store. Returns the manifest.
+    """
+    report = progress or (lambda stage, **details: None)
+    max_depth = CRAWL_MAX_DEPTH if max_depth is None else max_depth
+    max_pages = CRAWL_MAX_PAGES if max_pages is None else max_pages
+    frontier = CrawlFrontier(options['url'], max_depth, max_pages)
+    site = SiteOutput(output)
+    store = SharedAssetStore()
+    content_index = ContentIndex()
+    budget = ByteBudget()
+    results = OrderedDict()
+    futures = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def executor_submit(page):
+        future = executor.submit(clone, page)
+        with lock:
+            futures.append(future)
+
+    def clone(page):
+        def rewrite_links(soup, page_url):
+            for link in soup.find_all('a', href=True):
+                href = link['href'].strip()
+                if not href or href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
+                    continue
+                target_url = urljoin(page_url, href)
+                target, added = frontier.admit(target_url, page['depth'] + 1)
+                if target is None:
+                    continue
+                if added:
+                    executor_submit(target)
+                fragment = urlparse(target_url).fragment
+                link['href'] = target['file'] + (f'#{fragment}' if fragment else '')
+
+        stages = StageCollector()
+        metrics = CloneMetrics()
+        page_started = time.perf_counter()
+        try:
+            result = download_assets(
+                output=site,
+                progress=stages,
+                metrics=metrics,
+                asset_store=store,
+                budget=budget,
+                content_index=content_index,
+                page_name=page['file'],
+                link_rewriter=rewrite_links,
+                **dict(options, url=page['url'])
+            )
+        except Exception as e:
+            print(f'Error cloning crawled page {page["url"]}: {str(e)}')
+            result = str(e)
+        ok = result.endswith('.zip')
+        with lock:
+            results[page['file']] = {
+                'url': page['url'],
+                'file': page['file'],
+                'depth': page['depth'],
+                'status': 'done' if ok else 'failed',
+                'error': None if ok else result,
+                'timings': dict(stages.timings(), total=round(time.perf_counter() - page_started, 3)),
+                'metrics': metrics.to_dict(),
+            }
+            report('pages', state='running', done=len(results), discovered=len(frontier.pages))
+
+    report('pages', state='running', done=0, discovered=1)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, BATCH_PAGE_CONCURRENCY)) as executor:
+            executor_submit(next(iter(frontier.pages.values())))
+            # Pages submit the pages they discover, so wait until no future is left running
+            while True:
+                with lock:
+                    running = [future for future in futures if not future.done()]
+                if not running:
+                    break
+                for future in running:
+                    future.exception()
+        site.apply_rewrites()
+        report('pages', state='done', done=len(results), discovered=len(frontier.pages))
+
+        pages = [results[page['file']] for page in frontier.pages.values() if page['file'] in results]
+        manifest = {
+            'start_url': options['url'],
+            'max_depth': max_depth,
+            'max_pages': max_pages,
+            'pages': pages,
+            'succeeded': sum(1 for page in pages if page['status'] == 'done'),
+            'failed': sum(1 for page in pages if page['status'] != 'done'),
+            'links_not_followed': frontier.skipped,
+            'shared_assets': store.stats(),
+            'deduplicated': content_index.stats(),
+            'bytes_downloaded': budget.used,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        output.write_text('manifest.json', json.dumps(manifest, indent=2))
+        return manifest
+    finally:
+        store.close()
+
+def options_fingerprint(options):
+    """Stable text of the options that shape an archive; rewritten files are only reused under the same options"""
+    return json.dumps(options, sort_keys=True, default=str)
+
+def reclone(options, archive, delta=False, progress=None, metrics=None):
+    """Clone options['url'] again, refetching only what changed since the last clone of that URL.
+
+    Every asset the last clone fetched is requested conditionally. When the
+    page and all assets are unchanged the previous archive is reused as is;
+    when only binary assets changed, their files are swapped into it without
+    parsing or rewriting anything; otherwise the pipeline runs again with
+    unchanged bodies served from the kept copies. archive receives the full
+    clone, or with delta only the files that differ plus delta.json.
+    Returns a summary of what was reused.
+    """
+    report = progress or (lambda stage, **details: None)
+    metrics = metrics or CloneMetrics()
+    state = CloneState(options['url'])
+    full_archive = f'{os.path.splitext(archive)[0]}_full.zip' if delta else archive
+    with state.lock:
+        previous = state.load()
+        store = IncrementalStore(state)
+        content_index = ContentIndex()
+        fingerprint = options_fingerprint(options)
+        try:
+            report('render', state='running')
+            with metrics.stage('render'):
+                rendered = render_page(options['url'], options.get('render'), metrics, ready=options.get('ready'), block=options.get('block'))
+            page_digest = hashlib.sha256(rendered[0]).hexdigest()
+
+            mode = 'full'
+            if previous and previous['options'] == fingerprint and previous['page_digest'] == page_digest:
+                # Same page under the same options, so only assets can have changed
+                report('render', state='done', **rendered[2])
+                report('assets', state='running', fetched=0, total=len(previous['assets']))
+                with metrics.stage('revalidate'):
+                    ConcurrentFetcher(max_workers=options.get('concurrency'), progress=progress).map(store.fetch, list(previous['assets']))
+                report('assets', state='done')
+                changed = [asset_url for asset_url in previous['assets'] if store.outcomes.get(asset_url) != 'unchanged']
+                path_users = Counter(entry['path'] for entry in previous['assets'].values() if entry['path'])
+                # A changed file can be swapped in place when it is never rewritten, recompressed or shared with another URL
+                swappable = not options.get('optimize_images') and all(
+                    asset_url in store.records and previous['assets'][asset_url]['path'] and path_users[previous['assets'][asset_url]['path']] == 1
+                    for asset_url in changed
+                )
+                if not changed:
+                    mode = 'unchanged'
+                    shutil.copyfile(state.archive_path, full_archive)
+                elif swappable:
+                    mode = 'assets'
+                    with metrics.stage('replace_assets'):
+                        replace_entries(state.archive_path, full_archive, {previous['assets'][asset_url]['path']: store.body_path(asset_url) for asset_url in changed})
+                if mode != 'full':
+                    metrics.finish('done')
+
+            if mode == 'full':
+                with open(full_archive, 'wb') as f:
+                    result = download_assets(
+                        output=ZipOutput(f, directories=ASSET_TYPES),
+                        progress=progress,
+                        metrics=metrics,
+                        asset_store=store,
+                        content_index=content_index,
+                        rendered=rendered,
+                        **options
+                    )
+                if not result.endswith('.zip'):
+                    raise RuntimeError(result)
+
+            with metrics.stage('manifest'):
+                files = previous['files'] if mode == 'unchanged' else archive_digests(full_archive)
+                assets = {}
+                for asset_url, record in store.records.items():
+                    if mode == 'full':
+                        path = content_index.lookup(record['digest'])
+                    else:
+                        path = previous['assets'][asset_url]['path']
+                    # Rewritten files (CSS, JS) are never swapped in place, so their paths are not kept
+                    assets[asset_url] = dict(record, path=path if path and not is_rewritable(path) else None)
+                state.save(full_archive, {
+                    'url': options['url'],
+                    'options': fingerprint,
+                    'created': time.time(),
+                    'page_digest': page_digest,
+                    'assets': assets,
+                    'files': files,
+                }, store)
+
+            summary = {'mode': mode, 'previous': previous['created'] if previous else None, 'assets': store.outcome_counts()}
+            if delta:
+                summary['files'] = write_delta(full_archive, files, previous['files'] if previous else {}, archive, base=summary['previous'])
+                os.remove(full_archive)
+            report('incremental', state='done', **summary)
+            return summary
+        except Exception:
+            for path in {full_archive, archive}:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        finally:
+            store.close()
+
+def job_archive_path(job, prefix='website'):
+    """A new archive file for one run of job.
+
+    A job whose lease ran out is run again, possibly on the same host while
+    the first attempt is still going, so every run writes its own file.
+    Queue workers create it in JOB_RESULT_DIR, where finish() moves it.
+    """
+    fd, path = tempfile.mkstemp(prefix=f'{prefix}_{job.id}_', suffix='.zip', dir=JOB_RESULT_DIR if JOB_QUEUE_DB else '.')
+    os.close(fd)
+    return os.path.abspath(path)
+
+def run_crawl_job(job):
+    """Job runner for /crawl: all pages go into one zip with a manifest"""
+    options = dict(job.options)
+    crawl = options.pop('crawl')
+    archive = job_archive_path(job, 'website_crawl')
+    with open(archive, 'wb') as f:
+        output = ZipOutput(f, directories=ASSET_TYPES)
+        try:
+            manifest = crawl_site(options, output, progress=job.update_progress, **crawl)
+        except Exception:
+            output.abort()
+            os.remove(archive)
+            raise
+        output.finalize(archive)
+    if not manifest['succeeded']:
+        os.remove(archive)
+        raise RuntimeError('; '.join(page['error'] for page in manifest['pages']))
+    return archive
+
+def run_batch_job(job):
+    """Job runner for /batch: every page goes into one zip with a manifest"""
+    pages = job.options['pages']
+    archive = job_archive_path(job, 'website_batch')
+    directories = [f'{batch_folder(index, page["url"], len(pages))}/{directory}' for index, page in enumerate(pages) for directory in ASSET_TYPES]
+    with open(archive, 'wb') as f:
+        output = ZipOutput(f, directories=directories)
+        try:
+            manifest = download_batch(pages, output, progress=job.update_progress)
+        except Exception:
+            output.abort()
+            os.remove(archive)
+            raise
+        output.finalize(archive)
+    if not manifest['succeeded']:
+        os.remove(archive)
+        raise RuntimeError('; '.join(result['error'] for result in manifest['pages']))
+    return archive
+
+def run_reclone_job(job):
+    """Job runner for /reclone: an incremental clone, as a full archive or a delta"""
+    options = dict(job.options)
+    incremental = options.pop('incremental')
+    archive = job_archive_path(job)
+    job.metrics = CloneMetrics()
+    reclone(options, archive, delta=incremental['delta'], progress=job.update_progress, metrics=job.metrics)
+    return archive
+
+def run_download_job(job):
+    """Job runner: clone the site straight into its zip and return the archive path"""
+    if 'incremental' in job.options:
+        return run_reclone_job(job)
+    if 'pages' in job.options:
+        return run_batch_job(job)
+    if 'crawl' in job.options:
+        return run_crawl_job(job)
+    archive = job_archive_path(job)
+    job.metrics = CloneMetrics()
+    with open(archive, 'wb') as f:
+        zip_file = download_assets(progress=job.update_progress, output=ZipOutput(f, directories=ASSET_TYPES), metrics=job.metrics, **job.options)
+    if not zip_file.endswith('.zip'):
+        os.remove(archive)
+        raise RuntimeError(zip_file)
+    return archive
+
+def run_queued_job(job):
+    """Worker runner for the shared queue: run_download_job, then keep a copy in the result cache under the job's key"""
+    archive = run_download_job(job)
+    result_cache = get_result_cache()
+    if job.result_key and result_cache:
+        try:
+            # The queue moves the archive itself into JOB_RESULT_DIR, so the cache gets its own copy
+            copy = f'{archive}.{uuid.uuid4().hex}.tmp'
+            shutil.copyfile(archive, copy)
+            result_cache.store(job.result_key, copy)
+        except Exception as e:
+            print(f'Error storing job {job.id} in the result cache: {str(e)}')
+    return archive
+
+# With JOB_QUEUE_DB set this process only enqueues; `python app.py worker` processes run the jobs
+job_manager = SharedJobQueue() if JOB_QUEUE_DB else JobManager(run_download_job)
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    asset_cache = get_asset_cache()
+    result_cache = get_result_cache()
+    results = dict(result_cache.stats(), enabled=True) if result_cache else {'enabled': False}
+    if not asset_cache:
+        return jsonify({'enabled': False, 'results': results})
+    return jsonify(dict(asset_cache.stats(), enabled=True, results=results))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of clone counters plus queue, browser pool, cache and host scheduler gauges"""
+    job_stats = job_manager.stats()
+    pool_stats = get_driver_pool().stats()
+    gauges = {
+        'clone_jobs_queued': ('Jobs waiting for a worker', job_stats['queued']),
+        'clone_jobs_running': ('Jobs being processed', job_stats['running']),
+        'clone_browsers_live': ('Browsers currently started', pool_stats['live']),
+        'clone_browsers_idle': ('Browsers idle in the pool', pool_stats['idle']),
+    }
+    asset_cache = get_asset_cache()
+    if asset_cache:
+        cache_stats = asset_cache.stats()
+        gauges['clone_asset_cache_bytes'] = ('Bytes stored in the asset cache', cache_stats['bytes'])
+    hosts = get_scheduler().stats()
+    gauges.update({
+        'http_queue_depth': ('Requests waiting for the host scheduler', sum(host['queued'] for host in hosts.values())),
+        'http_host_queue_depth': ('Requests waiting for the host scheduler, by host', {host: stats['queued'] for host, stats in hosts.items()}),
+        'http_host_in_flight': ('Requests in progress, by host', {host: stats['in_flight'] for host, stats in hosts.items()}),
+        'http_host_delay_seconds': ('Current gap between request starts, by host', {host: stats['delay'] for host, stats in hosts.items()}),
+        'http_host_paused_seconds': ('Seconds left of a Retry-After pause, by host', {host: stats['paused'] for host, stats in hosts.items()}),
+    })
+    return Response(REGISTRY.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    data = request.json
+    app.logger.info('Received job data: %s', data)
+    try:
+        options = parse_download_options(data)
+    except ValueError as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(options)
+    except JobQueueFull as e:
+        app.logger.error('%s', str(e))
+        # Tell clients to back off instead of piling more work onto the box
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+
+    app.logger.info('Job queued: %s', job.id)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}',
+        'download_url': f'/jobs/{job.id}/download',
+    }), 202
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    data = request.json
+    app.logger.info('Received batch data: %s', data)
+    try:
+        options = parse_batch_options(data)
+    except ValueError as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(options)
+    except JobQueueFull as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+
+    app.logger.info('Batch job queued: %s (%d pages)', job.id, len(options['pages']))
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'pages': len(options['pages']),
+        'status_url': f'/jobs/{job.id}',
+        'download_url': f'/jobs/{job.id}/download',
+    }), 202
+
+@app.route('/crawl', methods=['POST'])
+def create_crawl():
+    data = request.json
+    app.logger.info('Received crawl data: %s', data)
+    try:
+        options = parse_download_options(data)
+        try:
+            max_depth = int(data.get('maxDepth', CRAWL_MAX_DEPTH))
+            max_pages = int(data.get('maxPages', CRAWL_MAX_PAGES))
+        except (TypeError, ValueError):
+            raise ValueError('maxDepth and maxPages must be integers')
+        if max_depth < 0:
+            raise ValueError('maxDepth must not be negative')
+        if not 1 <= max_pages <= CRAWL_PAGES_LIMIT:
+            raise ValueError(f'maxPages must be between 1 and {CRAWL_PAGES_LIMIT}')
+        crawl = options['crawl'] = {'max_depth': max_depth, 'max_pages': max_pages}
+    except ValueError as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(options)
+    except JobQueueFull as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+
+    app.logger.info('Crawl job queued: %s (depth %d, %d pages)', job.id, crawl['max_depth'], crawl['max_pages'])
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}',
+        'download_url': f'/jobs/{job.id}/download',
+    }), 202
+
+@app.route('/reclone', methods=['POST'])
+def create_reclone():
+    data = request.json
+    app.logger.info('Received reclone data: %s', data)
+    try:
+        options = parse_download_options(data)
+        incremental = options['incremental'] = {'delta': bool(data.get('delta', False))}
+    except ValueError as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(options)
+    except JobQueueFull as e:
+        app.logger.error('%s', str(e))
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+
+    app.logger.info('Reclone job queued: %s (%s)', job.id, 'delta' if incremental['delta'] else 'full archive')
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}',
+        'download_url': f'/jobs/{job.id}/download',
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': 'Job is not finished', 'status': job.status}), 409
+    # The archive stays on disk until the job expires, so downloads can be retried
+    return send_file(job.result, as_attachment=True, mimetype='application/zip', download_name=os.path.basename(job.result))
+
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8000)
+    if sys.argv[1:] == ['worker']:
+        if not JOB_QUEUE_DB:
+            sys.exit('Worker mode needs JOB_QUEUE_DB (the shared queue database)')
+        warm_driver_pool_async()
+        job_manager.work(run_queued_job)
+    else:
+        # Web processes of a shared queue only enqueue, so they never need a browser
+        if not JOB_QUEUE_DB:
+            warm_driver_pool_async()
+        app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,439 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from email.utils import parsedate_to_datetime
+from http_client import http_get, iter_body, STREAM_CHUNK_BYTES
+
+# Persistent asset cache shared by every scrape on this box
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR', '.asset_cache')
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+ASSET_CACHE_ENABLED = os.environ.get('ASSET_CACHE_ENABLED', '1') != '0'
+
+# Files the pipeline rewrites in place after download; these are copied, never hard-linked,
+# so an edit to the output tree can not leak back into the cache
+REWRITTEN_EXTENSIONS = {'.css', '.js', '.html', '.htm', '.json', '.svg'}
+
+# ContentIndex keys that are a body's sha256 and can be used as a name suffix directly
+SHA256_HEX = re.compile(r'[0-9a-f]{64}')
+
+# Heuristic freshness for responses with Last-Modified but no explicit lifetime
+HEURISTIC_FRESHNESS_MAX = 24 * 3600
+
+class CachedAsset:
+    """A downloaded body on disk plus the metadata needed to save it"""
+
+    def __init__(self, path, content_type, status, temporary=False, size=0, ok=True, digest=None):
+        self.path = path
+        self.content_type = content_type
+        self.status = status  # 'hit', 'revalidated', 'miss' or 'bypass'
+        self.temporary = temporary  # True when the body was not stored in the cache
+        self.size = size
+        self.ok = ok  # False when the origin answered with an error status
+        self.digest = digest  # sha256 hex of the body
+
+def parse_cache_control(value):
+    """Split a Cache-Control header into {directive: value}"""
+    directives = {}
+    for part in (value or '').split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        name, _, arg = part.partition('=')
+        directives[name.strip()] = arg.strip().strip('"')
+    return directives
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+def freshness_expiry(headers, now=None):
+    """Return the time until which a response may be served without revalidation"""
+    now = now or time.time()
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-cache' in directives or 'no-store' in directives:
+        return now
+
+    age = 0
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        pass
+
+    for name in ('s-maxage', 'max-age'):
+        if directives.get(name, '').isdigit():
+            return now + int(directives[name]) - age
+
+    expires = parse_http_date(headers.get('Expires', ''))
+    if expires is not None:
+        date = parse_http_date(headers.get('Date', '')) or now
+        return now + (expires - date)
+
+    last_modified = parse_http_date(headers.get('Last-Modified', ''))
+    if last_modified is not None:
+        date = parse_http_date(headers.get('Date', '')) or now
+        return now + min(HEURISTIC_FRESHNESS_MAX, max(0, (date - last_modified) / 10))
+    return now
+
+def link_or_copy(src, dest):
+    """Place a cached blob at dest, hard-linking when the file is never rewritten"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    if os.path.splitext(dest)[1].lower() not in REWRITTEN_EXTENSIONS:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass  # Different filesystem or links unsupported
+    shutil.copyfile(src, dest)
+
+def materialize(asset, dest):
+    """Move or link a CachedAsset body to dest"""
+    if asset.temporary:
+        shutil.move(asset.path, dest)
+    else:
+        link_or_copy(asset.path, dest)
+
+def stream_to_file(response, path, chunk_size=None, max_bytes=None, budget=None):
+    """Write a streamed response body to path and return (sha256 hex, size).
+
+    Raises AssetTooLarge (and removes the partial file) when the body is over
+    max_bytes, and ByteBudgetExceeded when budget runs out.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            for chunk in iter_body(response, max_bytes=max_bytes, budget=budget, chunk_size=chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return digest.hexdigest(), size
+
+def download_uncached(url, tmp_dir, chunk_size=None, max_bytes=None, budget=None):
+    """Download url into tmp_dir without touching the cache"""
+    with http_get(url, stream=True) as response:
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        digest, size = stream_to_file(response, tmp_path, chunk_size, max_bytes, budget)
+        return CachedAsset(tmp_path, response.headers.get('Content-Type', '').split(';')[0], 'bypass', temporary=True, size=size, ok=response.ok, digest=digest)
+
+def file_digest(path):
+    """sha256 hex of a file, read in STREAM_CHUNK_BYTES chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AssetCache:
+    """Content-addressed on-disk cache of asset bodies keyed by URL"""
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or ASSET_CACHE_DIR
+        self.max_bytes = ASSET_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.blob_dir = os.path.join(self.root, 'blobs')
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False, timeout=30)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+        ''')
+        self._db.commit()
+        self.counters = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0, 'bytes_saved': 0}
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _lookup(self, url):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT e.digest, e.content_type, e.etag, e.last_modified, e.expires, b.size '
+                'FROM entries e JOIN blobs b ON b.digest = e.digest WHERE e.url = ?', (url,)
+            ).fetchone()
+        if row and os.path.exists(self.blob_path(row[0])):
+            return dict(zip(('digest', 'content_type', 'etag', 'last_modified', 'expires', 'size'), row))
+        return None
+
+    def _touch(self, digest, expires=None, url=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (now, digest))
+            if url is not None:
+                self._db.execute('UPDATE entries SET expires = ? WHERE url = ?', (expires, url))
+            self._db.commit()
+
+    def _store(self, url, tmp_path, digest, size, headers):
+        final_path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)  # Same bytes already cached under another URL
+        else:
+            os.replace(tmp_path, final_path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO blobs (digest, size, last_used) VALUES (?, ?, ?) '
+                'ON CONFLICT(digest) DO UPDATE SET last_used = excluded.last_used', (digest, size, now)
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (url, digest, content_type, etag, last_modified, expires) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, digest, headers.get('Content-Type', '').split(';')[0], headers.get('ETag'),
+                 headers.get('Last-Modified'), freshness_expiry(headers, now))
+            )
+            self._db.commit()
+        self.evict()
+        return final_path
+
+    def evict(self):
+        """Drop least recently used blobs until the cache fits in max_bytes"""
+        removed = []
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for digest, size in self._db.execute('SELECT digest, size FROM blobs ORDER BY last_used').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute('DELETE FROM entries WHERE digest = ?', (digest,))
+                self._db.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                removed.append(digest)
+                total -= size
+            self._db.commit()
+            self.counters['evictions'] += len(removed)
+        for digest in removed:
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError:
+                pass
+
+    def fetch(self, url, chunk_size=None, max_bytes=None, budget=None):
+        """Return a CachedAsset for url, serving, revalidating or downloading as needed.
+
+        Only bytes that come over the network are charged to budget, as they stream in.
+        """
+        entry = self._lookup(url)
+        if entry and entry['expires'] and entry['expires'] > time.time():
+            self._touch(entry['digest'])
+            self._count('hits')
+            self._count('bytes_saved', entry['size'])
+            return CachedAsset(self.blob_path(entry['digest']), entry['content_type'], 'hit', size=entry['size'], digest=entry['digest'])
+
+        # Revalidate with the validators we already hold
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        with http_get(url, stream=True, headers=headers) as response:
+            if entry and response.status_code == 304:
+                self._touch(entry['digest'], freshness_expiry(response.headers), url)
+                self._count('revalidated')
+                self._count('bytes_saved', entry['size'])
+                return CachedAsset(self.blob_path(entry['digest']), entry['content_type'], 'revalidated', size=entry['size'], digest=entry['digest'])
+
+            # Stream the body to a temp file, hashing as we go
+            tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+            digest, size = stream_to_file(response, tmp_path, chunk_size, max_bytes, budget)
+
+            content_type = response.headers.get('Content-Type', '').split(';')[0]
+            cacheable = response.status_code == 200 and 'no-store' not in parse_cache_control(response.headers.get('Cache-Control'))
+            if not cacheable:
+                self._count('bypassed')
+                return CachedAsset(tmp_path, content_type, 'bypass', temporary=True, size=size, ok=response.ok, digest=digest)
+
+            path = self._store(url, tmp_path, digest, size, response.headers)
+            self._count('misses')
+            return CachedAsset(path, content_type, 'miss', size=size, digest=digest)
+
+    def stats(self):
+        with self._lock:
+            blobs, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            urls = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['revalidated'] + counters['misses']
+        counters.update({
+            'urls': urls,
+            'blobs': blobs,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'hit_ratio': round((counters['hits'] + counters['revalidated']) / lookups, 4) if lookups else 0.0,
+        })
+        return counters
+
+class SharedAssetStore:
+    """Downloads each URL once and shares the body between every page of a batch or crawl.
+
+    Concurrent requests for the same URL wait for the first download instead
+    of starting their own.
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='asset_store_')
+        self._entries = {}
+        self._errors = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+    def fetch(self, url, budget=None):
+        """Return a CachedAsset owned by the store for url; the download is charged to budget"""
+        with self._lock:
+            if url in self._entries:
+                entry = self._entries[url]
+                self.counters['hits'] += 1
+                self.counters['bytes_saved'] += entry.size
+                return entry
+            event = self._inflight.get(url)
+            owner = event is None
+            if owner:
+                event = self._inflight[url] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if url in self._entries:
+                    entry = self._entries[url]
+                    self.counters['hits'] += 1
+                    self.counters['bytes_saved'] += entry.size
+                    return entry
+                raise self._errors.get(url) or RuntimeError(f'Download of {url} failed')
+
+        try:
+            cached = self._download(url, budget)
+            path = os.path.join(self.root, uuid.uuid4().hex)
+            materialize(cached, path)
+            entry = CachedAsset(path, cached.content_type, cached.status, size=cached.size, ok=cached.ok, digest=cached.digest)
+            with self._lock:
+                self._entries[url] = entry
+                self.counters['misses'] += 1
+            return entry
+        except Exception as e:
+            with self._lock:
+                self._errors[url] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+
+    def _download(self, url, budget=None):
+        asset_cache = get_asset_cache()
+        return asset_cache.fetch(url, budget=budget) if asset_cache else download_uncached(url, self.root, budget=budget)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, urls=len(self._entries))
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+class ContentIndex:
+    """Places each distinct body once in a clone's output tree.
+
+    Bodies are keyed by their sha256, so the same image fetched under
+    several URLs (cache busters, srcset variants, CDN aliases) is written
+    once and every reference points at that file. When two different
+    bodies want the same name, the one claimed later gets the first 8 hex
+    digits of its hash appended. Callers claim a name in document order
+    (ConcurrentFetcher runs URLs sharing an asset_file_key() in the order
+    they were queued), so the same page always gets the same names.
+    """
+
+    def __init__(self):
+        self._paths = {}  # digest -> relpath
+        self._owners = {}  # relpath -> digest
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def claim(self, relpath, digest, size=0):
+        """Return (relpath to use, True when digest is already placed)"""
+        with self._lock:
+            if digest in self._paths:
+                self.duplicates += 1
+                self.bytes_saved += size
+                return self._paths[digest], True
+            if self._owners.get(relpath, digest) != digest:
+                stem, ext = os.path.splitext(relpath)
+                # Keys other than a body's sha256 (e.g. 'stub:<url>') are hashed so the suffix stays hex
+                suffix = digest if SHA256_HEX.fullmatch(digest) else hashlib.sha256(digest.encode('utf-8')).hexdigest()
+                length = 8
+                relpath = f'{stem}_{suffix[:length]}{ext}'
+                # A longer prefix only matters if two short prefixes collide as well
+                while self._owners.get(relpath, digest) != digest:
+                    length += 8
+                    relpath = f'{stem}_{suffix[:length]}{ext}'
+            self._owners[relpath] = digest
+            self._paths[digest] = relpath
+            return relpath, False
+
+    def lookup(self, digest):
+        """relpath already holding digest, or None"""
+        with self._lock:
+            return self._paths.get(digest)
+
+    def place(self, output, relpath, cached, digest=None):
+        """Write a CachedAsset at relpath unless its body is already placed; returns (relpath, duplicate).
+
+        digest overrides the key, so a recompressed image is keyed by the body it was made from.
+        """
+        digest = digest or cached.digest or file_digest(cached.path)
+        relpath, duplicate = self.claim(relpath, digest, cached.size)
+        if duplicate:
+            if cached.temporary:
+                os.remove(cached.path)
+        else:
+            output.write_cached(relpath, cached)
+        return relpath, duplicate
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._paths), 'duplicates': self.duplicates, 'bytes_saved': self.bytes_saved}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_asset_cache():
+    """Return the process-wide asset cache, or None when caching is disabled"""
+    global _cache
+    if not ASSET_CACHE_ENABLED or ASSET_CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AssetCache()
+    return _cache
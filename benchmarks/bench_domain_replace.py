@@ -0,0 +1,83 @@
+"""Throughput of DomainReplacer against the old per-pair str.replace loop.
+
+Usage: python benchmarks/bench_domain_replace.py [--mb 4] [--pairs 40] [--repeat 3]
+"""
+import os
+import sys
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DomainReplacer
+
+def legacy_replace(text, original_domains, replacement_domains):
+    """The replacement loop DomainReplacer superseded, kept for comparison"""
+    for orig_domain, repl_domain in zip(original_domains, replacement_domains):
+        text = text.replace(f'www.{orig_domain}', repl_domain)
+        text = text.replace(orig_domain, repl_domain)
+        text = text.replace(f'\\"{orig_domain}\\"', f'\\"{repl_domain}\\"')
+        text = text.replace(f"\\'{orig_domain}\\'", f"\\'{repl_domain}\\'")
+        text = text.replace(f'%22{orig_domain}%22', f'%22{repl_domain}%22')
+    return text
+
+def random_domain(rng):
+    name = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+    return name + rng.choice(['.com', '.net', '.io', '.co.uk'])
+
+def make_bundle(rng, size, domains):
+    """Minified-JS-like text with domains sprinkled in the usual forms"""
+    forms = ['https://www.{}/static/app.js', '"{}"', '\\"{}\\"', '%22{}%22', '//cdn.{}/img.png']
+    noise = string.ascii_letters + string.digits + '(){};.=,:+'
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.02:
+            part = rng.choice(forms).format(rng.choice(domains))
+        else:
+            part = ''.join(rng.choices(noise, k=rng.randint(3, 24)))
+        parts.append(part)
+        length += len(part) + 1
+    return ' '.join(parts)
+
+def best_of(repeat, fn, *args):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=float, default=4, help='bundle size in MB')
+    parser.add_argument('--pairs', type=int, default=40, help='number of domain pairs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    original_domains = [random_domain(rng) for _ in range(args.pairs)]
+    replacement_domains = [random_domain(rng) for _ in range(args.pairs)]
+    bundle = make_bundle(rng, int(args.mb * 1024 * 1024), original_domains)
+    size_mb = len(bundle.encode('utf-8')) / (1024 * 1024)
+
+    start = time.perf_counter()
+    replacer = DomainReplacer(original_domains, replacement_domains)
+    compile_time = time.perf_counter() - start
+
+    legacy_time, legacy_output = best_of(args.repeat, legacy_replace, bundle, original_domains, replacement_domains)
+    new_time, new_output = best_of(args.repeat, replacer, bundle)
+
+    print(f'bundle: {size_mb:.2f} MB, {args.pairs} domain pairs')
+    print(f'compile: {compile_time * 1000:.2f} ms')
+    print(f'legacy str.replace loop: {legacy_time:.3f} s  ({size_mb / legacy_time:.1f} MB/s)')
+    print(f'DomainReplacer:          {new_time:.3f} s  ({size_mb / new_time:.1f} MB/s)')
+    print(f'speedup: {legacy_time / new_time:.2f}x')
+    print(f'outputs identical: {legacy_output == new_output}')
+
+if __name__ == '__main__':
+    main()
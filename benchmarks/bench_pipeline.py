@@ -0,0 +1,216 @@
+"""Full download_assets pipeline against local fixture sites, in static render mode with no outside network.
+
+Each run clones a fixture in a fresh subprocess (so peak RSS is per run) and
+reports wall time, peak RSS, bytes written, and requests and bytes served by
+the fixture server. Results are saved as JSON so later commits can be compared.
+
+Usage: python benchmarks/bench_pipeline.py [--scenario all] [--repeat 3]
+           [--latency-ms 20] [--bandwidth-kbps 0] [--cache] [--compare latest]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import SCENARIOS, FixtureServer, write_fixture
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+def run_one(args):
+    """Child process: clone args.url once and write the measurements to args.result_file"""
+    sys.path.insert(0, REPO_ROOT)
+    from app import download_assets
+
+    os.chdir(args.workdir)
+    start = time.perf_counter()
+    result = download_assets(args.url, save_dir='clone', render='static', concurrency=args.concurrency)
+    wall = time.perf_counter() - start
+
+    measurements = {
+        'ok': result.endswith('.zip'),
+        'error': None if result.endswith('.zip') else result,
+        'wall_seconds': wall,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if measurements['ok']:
+        with zipfile.ZipFile(result) as archive:
+            entries = [info for info in archive.infolist() if not info.is_dir()]
+        measurements.update({
+            'archive_bytes': os.path.getsize(result),
+            'bytes_written': sum(info.file_size for info in entries),
+            'files': len(entries),
+        })
+    with open(args.result_file, 'w') as f:
+        json.dump(measurements, f)
+
+def git_revision():
+    """Short commit hash of the tree being measured, with a + suffix when it has local changes"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=REPO_ROOT) != 0
+        return commit + ('+' if dirty else '')
+    except Exception:
+        return 'unknown'
+
+def measure(server, args, workdir, cache_dir):
+    """Clone the served fixture once in a subprocess and return its measurements"""
+    result_file = os.path.join(workdir, 'result.json')
+    env = dict(os.environ, ASSET_CACHE_ENABLED='1' if args.cache else '0', ASSET_CACHE_DIR=cache_dir)
+    command = [
+        sys.executable, os.path.abspath(__file__), '--run-one',
+        '--url', f'{server.base_url}/index.html',
+        '--workdir', workdir,
+        '--result-file', result_file,
+    ]
+    if args.concurrency:
+        command += ['--concurrency', str(args.concurrency)]
+    server.reset_counters()
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL if not args.verbose else None)
+    with open(result_file) as f:
+        measurements = json.load(f)
+    measurements['requests'] = server.requests
+    measurements['bytes_served'] = server.bytes_served
+    return measurements
+
+def run_scenario(scenario, args):
+    root = tempfile.mkdtemp(prefix=f'bench_{scenario}_')
+    try:
+        site_dir = os.path.join(root, 'site')
+        cache_dir = os.path.join(root, 'cache')
+        fixture_bytes = write_fixture(scenario, site_dir, args.seed)
+        server = FixtureServer(site_dir, latency=args.latency_ms / 1000, bandwidth=args.bandwidth_kbps * 1024).start()
+        runs = []
+        try:
+            for i in range(args.repeat):
+                workdir = os.path.join(root, f'run{i}')
+                os.makedirs(workdir)
+                runs.append(measure(server, args, workdir, cache_dir))
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    failed = [run for run in runs if not run['ok']]
+    if failed:
+        return {'fixture_bytes': fixture_bytes, 'error': failed[0]['error']}
+    walls = [run['wall_seconds'] for run in runs]
+    return {
+        'fixture_bytes': fixture_bytes,
+        'wall_seconds': round(statistics.median(walls), 4),
+        'wall_seconds_min': round(min(walls), 4),
+        'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+        'bytes_written': runs[-1]['bytes_written'],
+        'archive_bytes': runs[-1]['archive_bytes'],
+        'files': runs[-1]['files'],
+        # The first run shows cold-cache traffic, later runs show warm-cache traffic when --cache is set
+        'requests': runs[0]['requests'],
+        'requests_warm': runs[-1]['requests'],
+        'bytes_served': runs[0]['bytes_served'],
+    }
+
+def latest_result(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    paths = sorted(
+        (os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR) if name.endswith('.json')),
+        key=os.path.getmtime,
+    )
+    paths = [path for path in paths if path != exclude]
+    return paths[-1] if paths else None
+
+def print_report(results, baseline=None):
+    columns = ('wall_seconds', 'peak_rss_mb', 'bytes_written', 'requests')
+    print(f'{"scenario":<10}' + ''.join(f'{column:>22}' for column in columns))
+    for scenario, metrics in results['scenarios'].items():
+        if 'error' in metrics:
+            print(f'{scenario:<10}  failed: {metrics["error"]}')
+            continue
+        previous = (baseline or {}).get('scenarios', {}).get(scenario, {})
+        cells = []
+        for column in columns:
+            value = metrics[column]
+            cell = f'{value}'
+            if isinstance(previous.get(column), (int, float)) and previous[column]:
+                cell += f' ({(value - previous[column]) / previous[column] * 100:+.1f}%)'
+            cells.append(f'{cell:>22}')
+        print(f'{scenario:<10}' + ''.join(cells))
+    if baseline:
+        print(f'compared with {baseline["revision"]} from {baseline["timestamp"]}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', default='all', help=f'all or a comma-separated list of: {", ".join(SCENARIOS)}')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=20, help='delay added to every fixture response')
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help='KB/s per connection, 0 for unlimited')
+    parser.add_argument('--concurrency', type=int, default=None, help='asset download concurrency (default: ASSET_CONCURRENCY)')
+    parser.add_argument('--cache', action='store_true', help='enable the asset cache (shared across repeats)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', default=None, help='result file (default: benchmarks/results/<time>_<commit>.json)')
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--compare', default=None, help='result file to compare with, or "latest"')
+    parser.add_argument('--verbose', action='store_true', help='show pipeline output')
+    # Internal: one measured clone in a child process
+    parser.add_argument('--run-one', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args)
+        return
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [name.strip() for name in args.scenario.split(',')]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(unknown)}')
+
+    baseline_path = latest_result() if args.compare == 'latest' else args.compare
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'settings': {
+            'repeat': args.repeat,
+            'latency_ms': args.latency_ms,
+            'bandwidth_kbps': args.bandwidth_kbps,
+            'concurrency': args.concurrency,
+            'cache': args.cache,
+            'seed': args.seed,
+        },
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        print(f'running {scenario} ({SCENARIOS[scenario]})...', flush=True)
+        results['scenarios'][scenario] = run_scenario(scenario, args)
+
+    print_report(results, baseline)
+
+    if not args.no_save:
+        path = args.save or os.path.join(RESULTS_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}_{results["revision"]}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'saved {path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""remove_tracking_scripts on a synthetic 5k-element DOM against the old multi-pass version.
+
+Usage: python benchmarks/bench_tracking_rules.py [--elements 5000] [--repeat 5]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import remove_tracking_scripts
+
+def legacy_remove_tracking_scripts(soup, remove_tracking=True, remove_custom_tracking=True):
+    """The multi-pass implementation remove_tracking_scripts replaced, kept for comparison"""
+    tracking_patterns = [
+        r'connect\.facebook\.net/[^/]+/fbevents\.js', r'facebook-jssdk', r'fb-root',
+        r'google-analytics\.com/analytics\.js', r'googletagmanager\.com/gtag/js', r'ga\.js', r'gtag',
+        r'googletagmanager\.com/gtm\.js', r'gtm\.js', r'ringba\.com', r'ringba\.js',
+        r'analytics', r'pixel\.js', r'tracking\.js', r'mixpanel', r'segment\.com', r'hotjar\.com',
+    ]
+    custom_tracking_patterns = [r'track\.js', r'tracking\.js', r'tracker\.js']
+
+    def matches_patterns(src, patterns):
+        if not src:
+            return False
+        return any(re.search(pattern, src, re.IGNORECASE) for pattern in patterns)
+
+    for script in soup.find_all('script'):
+        src = script.get('src', '')
+        content = script.string or ''
+        should_remove = False
+        if remove_tracking:
+            should_remove = should_remove or matches_patterns(src, tracking_patterns)
+            should_remove = should_remove or any(p in content.lower() for p in ['fbq(', 'gtag(', 'ga(', '_ringba', 'mixpanel'])
+        if remove_custom_tracking:
+            should_remove = should_remove or matches_patterns(src, custom_tracking_patterns)
+            should_remove = should_remove or 'track' in content.lower()
+        if should_remove:
+            script.decompose()
+
+    if remove_tracking:
+        for meta in soup.find_all('meta'):
+            if meta.get('name') in ['facebook-domain-verification', 'google-site-verification']:
+                meta.decompose()
+
+    for noscript in soup.find_all('noscript'):
+        content = str(noscript).lower()
+        if any(tracker in content for tracker in ['facebook', 'gtm', 'google-analytics']):
+            noscript.decompose()
+
+    for element in soup.find_all(True):
+        for attr in list(element.attrs):
+            if attr.startswith('on'):
+                value = element[attr].lower()
+                if 'track' in value or any(tracker in value for tracker in ['gtag', 'ga', 'fbq']):
+                    del element[attr]
+
+def make_document(rng, elements):
+    """Landing-page-like HTML with scripts, pixels and event handlers mixed into plain markup"""
+    scripts = [
+        '<script src="https://connect.facebook.net/en_US/fbevents.js"></script>',
+        '<script src="https://www.googletagmanager.com/gtag/js?id=G-1"></script>',
+        '<script src="/static/app.js"></script>',
+        '<script src="/static/track.js"></script>',
+        "<script>fbq('init', '123');</script>",
+        '<script>window.dataLayer = window.dataLayer || [];</script>',
+        '<script>console.log("ready")</script>',
+    ]
+    extras = [
+        '<noscript><img src="https://www.facebook.com/tr?id=1"></noscript>',
+        '<noscript>Please enable JavaScript</noscript>',
+        '<meta name="facebook-domain-verification" content="abc">',
+        '<meta name="viewport" content="width=device-width">',
+        '<button onclick="gtag(\'event\', \'click\')">Call</button>',
+        '<a href="/next" onmouseover="highlight(this)">Next</a>',
+    ]
+    plain = ['<div class="row"><p>Lorem ipsum dolor sit amet</p></div>', '<span>text</span>', '<img src="/img/a.png">', '<li>item</li>']
+    parts = []
+    count = 0
+    while count < elements:
+        roll = rng.random()
+        if roll < 0.03:
+            parts.append(rng.choice(scripts))
+            count += 1
+        elif roll < 0.06:
+            parts.append(rng.choice(extras))
+            count += 2
+        else:
+            part = rng.choice(plain)
+            parts.append(part)
+            count += part.count('<') - part.count('</')
+    return f'<html><head></head><body>{"".join(parts)}</body></html>'
+
+def time_removal(fn, html, repeat):
+    timings = []
+    soup = None
+    for _ in range(repeat):
+        soup = BeautifulSoup(html, 'html.parser')
+        start = time.perf_counter()
+        fn(soup, True, True)
+        timings.append(time.perf_counter() - start)
+    return min(timings), str(soup)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--elements', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    html = make_document(random.Random(args.seed), args.elements)
+    element_count = len(BeautifulSoup(html, 'html.parser').find_all(True))
+
+    legacy_time, legacy_output = time_removal(legacy_remove_tracking_scripts, html, args.repeat)
+    new_time, new_output = time_removal(remove_tracking_scripts, html, args.repeat)
+
+    print(f'document: {element_count} elements, {len(html) / 1024:.0f} KB')
+    print(f'legacy multi-pass:   {legacy_time * 1000:.1f} ms')
+    print(f'compiled single pass: {new_time * 1000:.1f} ms')
+    print(f'speedup: {legacy_time / new_time:.2f}x')
+    print(f'outputs identical: {legacy_output == new_output}')
+
+if __name__ == '__main__':
+    main()
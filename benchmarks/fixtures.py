@@ -0,0 +1,199 @@
+"""Synthetic fixture sites and a local HTTP server with configurable latency and bandwidth.
+
+Used by bench_pipeline.py; can also be run on its own to browse a fixture:
+python benchmarks/fixtures.py --scenario mixed --port 8800
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Scenario name -> what it stresses
+SCENARIOS = {
+    'images': 'hundreds of <img>, srcset and <picture> sources',
+    'bundles': 'a few multi-megabyte JS bundles',
+    'css': 'nested @import chains with url() fonts and background images',
+    'mixed': 'a landing page with some of everything',
+}
+
+def random_bytes(rng, size):
+    return rng.randbytes(size)
+
+def image_files(rng, prefix, count, min_size=2048, max_size=24576):
+    """count fake PNGs of random size, keyed by path"""
+    return {f'{prefix}/img{i}.png': random_bytes(rng, rng.randint(min_size, max_size)) for i in range(count)}
+
+def js_bundle(rng, size):
+    """Minified-looking JavaScript of roughly size bytes"""
+    names = ['render', 'update', 'fetchData', 'dispatch', 'reducer', 'mount', 'useState', 'track']
+    parts = []
+    total = 0
+    while total < size:
+        part = f'function {rng.choice(names)}{rng.randint(0, 99999)}(a,b){{return a+b*{rng.randint(0, 999)}}};'
+        parts.append(part)
+        total += len(part)
+    return ''.join(parts).encode()
+
+def css_chain(rng, depth, fonts_per_sheet=2, images_per_sheet=4):
+    """main.css importing level1.css importing level2.css ... each referencing fonts and images"""
+    files = {}
+    for level in range(depth, -1, -1):
+        name = 'css/main.css' if level == 0 else f'css/level{level}.css'
+        rules = []
+        if level < depth:
+            rules.append(f'@import url("level{level + 1}.css");')
+        for i in range(fonts_per_sheet):
+            font = f'fonts/font{level}_{i}.woff2'
+            files[font] = random_bytes(rng, rng.randint(8192, 32768))
+            rules.append(f'@font-face{{font-family:"f{level}{i}";src:url("../{font}") format("woff2")}}')
+        for i in range(images_per_sheet):
+            image = f'img/bg{level}_{i}.png'
+            files[image] = random_bytes(rng, rng.randint(2048, 16384))
+            rules.append(f'.bg{level}-{i}{{background-image:url(../{image})}}')
+        rules.extend(f'.c{level}-{i}{{margin:{i}px;color:#{rng.randint(0, 0xffffff):06x}}}' for i in range(50))
+        files[name] = '\n'.join(rules).encode()
+    return files
+
+def page(head, body):
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Fixture</title>{head}</head><body>{body}</body></html>'.encode()
+
+def build_images(rng, images=300):
+    files = image_files(rng, 'img', images)
+    names = sorted(files)
+    body = [f'<img src="/{name}" alt="">' for name in names[:images // 2]]
+    # srcset pairs and <picture> sources share files with plain <img> tags, like real responsive pages
+    for i in range(images // 2, images * 3 // 4, 2):
+        body.append(f'<img src="/{names[i]}" srcset="/{names[i]} 1x, /{names[i + 1]} 2x">')
+    for i in range(images * 3 // 4, images - 1, 2):
+        body.append(f'<picture><source srcset="/{names[i]} 800w, /{names[i + 1]} 1600w"><img src="/{names[i]}"></picture>')
+    files['index.html'] = page('', '\n'.join(body))
+    return files
+
+def build_bundles(rng, bundles=4, bundle_bytes=2 * 1024 * 1024):
+    files = {f'js/bundle{i}.js': js_bundle(rng, bundle_bytes) for i in range(bundles)}
+    files.update(image_files(rng, 'img', 10))
+    head = ''.join(f'<script src="/js/bundle{i}.js"></script>' for i in range(bundles))
+    body = ''.join(f'<img src="/img/img{i}.png">' for i in range(10))
+    files['index.html'] = page(head, body)
+    return files
+
+def build_css(rng, depth=5):
+    files = css_chain(rng, depth)
+    inline = image_files(rng, 'img/inline', 20)
+    files.update(inline)
+    names = sorted(inline)
+    style = '<style>' + ''.join(f'.s{i}{{background:url(/{name})}}' for i, name in enumerate(names[:10])) + '</style>'
+    body = ''.join(f'<div style="background-image: url(/{name})"></div>' for name in names[10:])
+    files['index.html'] = page(f'<link rel="stylesheet" href="/css/main.css">{style}', body)
+    return files
+
+def build_mixed(rng):
+    files = css_chain(rng, 3)
+    files.update(image_files(rng, 'img', 60))
+    files.update({f'js/bundle{i}.js': js_bundle(rng, 512 * 1024) for i in range(2)})
+    body = [f'<img src="/img/img{i}.png">' for i in range(40)]
+    body += [f'<img src="/img/img{i}.png" srcset="/img/img{i}.png 1x, /img/img{i + 1}.png 2x">' for i in range(40, 50, 2)]
+    body += [f'<picture><source srcset="/img/img{i}.png"><img src="/img/img{i + 1}.png"></picture>' for i in range(50, 60, 2)]
+    head = '<link rel="stylesheet" href="/css/main.css">' + ''.join(f'<script src="/js/bundle{i}.js"></script>' for i in range(2))
+    files['index.html'] = page(head, '\n'.join(body))
+    return files
+
+BUILDERS = {'images': build_images, 'bundles': build_bundles, 'css': build_css, 'mixed': build_mixed}
+
+def write_fixture(scenario, root, seed=1):
+    """Write a scenario's files under root and return the total bytes"""
+    files = BUILDERS[scenario](random.Random(seed))
+    for relpath, data in files.items():
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return sum(len(data) for data in files.values())
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Static file handler that delays every response and throttles its body"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def end_headers(self):
+        # Let the pipeline's HTTP cache logic see cacheable responses
+        self.send_header('Cache-Control', 'max-age=3600')
+        super().end_headers()
+
+    def send_head(self):
+        self.server.count_request()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        chunk_size = 16 * 1024
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            self.server.count_bytes(len(chunk))
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+class FixtureServer(ThreadingHTTPServer):
+    """Serves root on 127.0.0.1 and counts requests and bytes served.
+
+    latency is seconds added before each response, bandwidth is bytes per
+    second per connection (0 for unlimited).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, root, port=0, latency=0.0, bandwidth=0):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        super().__init__(('127.0.0.1', port), lambda *args: FixtureHandler(*args, directory=root))
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_bytes(self, size):
+        with self._lock:
+            self.bytes_served += size
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_served = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--root', default=None, help='directory to write the fixture to (default: a temp dir)')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help='KB/s per connection, 0 for unlimited')
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix=f'fixture_{args.scenario}_')
+    size = write_fixture(args.scenario, root)
+    server = FixtureServer(root, args.port, args.latency_ms / 1000, args.bandwidth_kbps * 1024)
+    print(f'{args.scenario}: {size / 1024:.0f} KB in {root}, serving {server.base_url}/index.html')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
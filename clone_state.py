@@ -0,0 +1,182 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import zipfile
+import threading
+from collections import Counter
+from http_client import http_get
+from asset_cache import CachedAsset, SharedAssetStore, stream_to_file, link_or_copy
+
+# Last clone of each source URL, kept so the next clone of that URL can be incremental
+CLONE_STATE_DIR = os.environ.get('CLONE_STATE_DIR', '.clone_state')
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+def state_key(url):
+    return hashlib.sha256(url.strip().encode('utf-8')).hexdigest()[:32]
+
+class CloneState:
+    """The previous clone of one source URL: manifest.json, its archive and the raw asset bodies.
+
+    Raw bodies are kept, not the archive's rewritten or recompressed copies,
+    so an asset answered with 304 can go through the pipeline again.
+    """
+
+    def __init__(self, url, root=None):
+        self.url = url
+        self.dir = os.path.join(root or CLONE_STATE_DIR, state_key(url))
+        self.archive_path = os.path.join(self.dir, 'archive.zip')
+        self.manifest_path = os.path.join(self.dir, 'manifest.json')
+        self.blob_dir = os.path.join(self.dir, 'blobs')
+        # Re-clones of the same URL run one at a time
+        with _locks_lock:
+            self.lock = _locks.setdefault(self.dir, threading.Lock())
+        self.manifest = None
+
+    def load(self):
+        """Read the previous manifest (None when this URL has no usable previous clone)"""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = None
+        self.manifest = manifest if manifest and os.path.exists(self.archive_path) else None
+        return self.manifest
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def save(self, archive, manifest, store):
+        """Keep archive, manifest and the raw body of every asset store fetched for the next clone"""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        for url, entry in manifest['assets'].items():
+            blob = self.blob_path(entry['digest'])
+            if not os.path.exists(blob):
+                link_or_copy(store.body_path(url), blob)
+        keep = {entry['digest'] for entry in manifest['assets'].values()}
+        for name in os.listdir(self.blob_dir):
+            if name not in keep:
+                os.remove(self.blob_path(name))
+
+        # Replace the archive and manifest atomically so a crash leaves the old pair usable
+        tmp_archive = f'{self.archive_path}.{uuid.uuid4().hex}.tmp'
+        shutil.copyfile(archive, tmp_archive)
+        os.replace(tmp_archive, self.archive_path)
+        tmp_manifest = f'{self.manifest_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, self.manifest_path)
+        self.manifest = manifest
+
+class IncrementalStore(SharedAssetStore):
+    """SharedAssetStore that revalidates every asset against the previous clone of the same URL.
+
+    Assets the previous clone fetched are requested with If-None-Match /
+    If-Modified-Since, and a 304 reuses the kept body. Each fetch is recorded
+    with its digest and validators for the next manifest and counted as
+    'unchanged', 'changed', 'new' or 'failed'.
+    """
+
+    def __init__(self, state):
+        super().__init__()
+        self.state = state  # CloneState, already loaded
+        self.previous = (state.manifest or {}).get('assets', {})
+        self.records = {}  # url -> manifest entry
+        self.outcomes = {}  # url -> outcome
+
+    def _download(self, url, budget=None):
+        previous = self.previous.get(url)
+        headers = {}
+        if previous and os.path.exists(self.state.blob_path(previous['digest'])):
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+
+        with http_get(url, stream=True, headers=headers) as response:
+            if headers and response.status_code == 304:
+                cached = CachedAsset(self.state.blob_path(previous['digest']), previous['content_type'], 'unchanged', size=previous['size'], digest=previous['digest'])
+                etag = response.headers.get('ETag') or previous.get('etag')
+                last_modified = response.headers.get('Last-Modified') or previous.get('last_modified')
+            else:
+                tmp_path = os.path.join(self.root, uuid.uuid4().hex)
+                digest, size = stream_to_file(response, tmp_path, budget=budget)
+                # Servers without validators still count as unchanged when the body hashes the same
+                if not previous:
+                    status = 'new'
+                else:
+                    status = 'unchanged' if previous['digest'] == digest else 'changed'
+                content_type = response.headers.get('Content-Type', '').split(';')[0]
+                cached = CachedAsset(tmp_path, content_type, status, temporary=True, size=size, ok=response.ok, digest=digest)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+
+        with self._lock:
+            self.outcomes[url] = cached.status if cached.ok else 'failed'
+            if cached.ok:
+                self.records[url] = {
+                    'digest': cached.digest,
+                    'size': cached.size,
+                    'content_type': cached.content_type,
+                    'etag': etag,
+                    'last_modified': last_modified,
+                }
+        return cached
+
+    def fetch(self, url, budget=None):
+        try:
+            return super().fetch(url, budget)
+        except Exception:
+            with self._lock:
+                self.outcomes[url] = 'failed'
+            raise
+
+    def body_path(self, url):
+        with self._lock:
+            return self._entries[url].path
+
+    def outcome_counts(self):
+        with self._lock:
+            return dict(Counter(self.outcomes.values()))
+
+def archive_digests(path):
+    """{entry name: sha256 hex} for every file in a zip"""
+    digests = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            digest = hashlib.sha256()
+            with archive.open(info) as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            digests[info.filename] = digest.hexdigest()
+    return digests
+
+def replace_entries(source_path, dest_path, replacements):
+    """Copy a zip to dest_path with the entries named in replacements ({name: file path}) swapped"""
+    with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(dest_path, 'w', zipfile.ZIP_DEFLATED) as dest:
+        for info in source.infolist():
+            if info.is_dir():
+                dest.writestr(info, b'')
+                continue
+            if info.filename in replacements:
+                dest.write(replacements[info.filename], info.filename)
+                continue
+            with source.open(info) as src, dest.open(info.filename, 'w') as dst:
+                shutil.copyfileobj(src, dst)
+
+def write_delta(archive_path, files, previous_files, dest_path, base=None):
+    """Write the files of archive_path that differ from previous_files, plus delta.json; returns the counts"""
+    changed = sorted(name for name, digest in files.items() if name in previous_files and previous_files[name] != digest)
+    added = sorted(name for name in files if name not in previous_files)
+    removed = sorted(name for name in previous_files if name not in files)
+    with zipfile.ZipFile(archive_path) as source, zipfile.ZipFile(dest_path, 'w', zipfile.ZIP_DEFLATED) as delta:
+        for name in changed + added:
+            with source.open(name) as src, delta.open(name, 'w') as dst:
+                shutil.copyfileobj(src, dst)
+        delta.writestr('delta.json', json.dumps({'base': base, 'changed': changed, 'added': added, 'removed': removed}, indent=2))
+    return {'changed': len(changed), 'added': len(added), 'removed': len(removed)}
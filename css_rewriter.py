@@ -0,0 +1,151 @@
+import re
+import posixpath
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+# One scan finds every reference: comments and strings are matched first so url()s inside them are skipped
+CSS_REFERENCE_PATTERN = re.compile(
+    r'''/\*.*?\*/'''
+    r'''|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*\''''
+    r'''|@import\s+(?:url\(\s*(?:"(?P<import_dq>[^"]*)"|'(?P<import_sq>[^']*)'|(?P<import_bare>[^)\s'"]*))\s*\)'''
+    r'''|"(?P<import_str_dq>[^"]*)"|'(?P<import_str_sq>[^']*)')'''
+    r'''|url\(\s*(?:"(?P<url_dq>[^"]*)"|'(?P<url_sq>[^']*)'|(?P<url_bare>[^)\s'"]*))\s*\)''',
+    re.IGNORECASE | re.DOTALL
+)
+# Named group -> reference kind; each alternative above has exactly one group
+REFERENCE_GROUPS = {
+    'import_dq': 'import', 'import_sq': 'import', 'import_bare': 'import', 'import_str_dq': 'import', 'import_str_sq': 'import',
+    'url_dq': 'url', 'url_sq': 'url', 'url_bare': 'url',
+}
+
+# References that point at nothing downloadable
+SKIPPED_PREFIXES = ('data:', '#', 'about:', 'javascript:')
+
+class CssReference:
+    """One @import or url() in a stylesheet; start/end span only the URL text, inside any quotes"""
+
+    __slots__ = ('kind', 'url', 'start', 'end')
+
+    def __init__(self, kind, url, start, end):
+        self.kind = kind  # 'import' or 'url'
+        self.url = url
+        self.start = start
+        self.end = end
+
+def find_references(css):
+    """Every @import and url() reference in css, in order"""
+    references = []
+    for match in CSS_REFERENCE_PATTERN.finditer(css):
+        group = match.lastgroup
+        if group is None:
+            continue  # comment or string
+        value = match.group(group)
+        stripped = value.strip()
+        if stripped and not stripped.lower().startswith(SKIPPED_PREFIXES):
+            offset = len(value) - len(value.lstrip())
+            references.append(CssReference(REFERENCE_GROUPS[group], stripped, match.start(group) + offset, match.start(group) + offset + len(stripped)))
+    return references
+
+def rewrite_references(css, references, replacement_for):
+    """Replace reference URLs in one pass; replacement_for(reference) returns new text or None to keep it"""
+    pieces = []
+    position = 0
+    for reference in references:
+        replacement = replacement_for(reference)
+        if replacement is None:
+            continue
+        pieces.append(css[position:reference.start])
+        pieces.append(replacement)
+        position = reference.end
+    if not pieces:
+        return css
+    pieces.append(css[position:])
+    return ''.join(pieces)
+
+class Stylesheet:
+    """A stylesheet's text, where it came from and the references found in it"""
+
+    def __init__(self, url, text, filename=None):
+        self.url = url  # base URL for resolving references
+        self.text = text
+        self.filename = filename  # local file under css/, None for <style> blocks and style attributes
+        self.references = find_references(text)
+
+    def absolute(self, reference):
+        return urljoin(self.url, reference.url)
+
+class CssPipeline:
+    """Downloads everything a page's CSS needs and rewrites it.
+
+    Stylesheets are followed through @import recursively, one concurrent
+    round per import depth; a sheet already seen is not fetched again, so
+    import cycles end. All fonts, images and other url() targets of every
+    sheet, <style> block and style attribute are then fetched in one
+    concurrent round, and each text is rewritten in a single pass.
+
+    fetch_text(url) returns a stylesheet's text or None, fetch_asset(url)
+    returns the asset's local path (e.g. 'fonts/a.woff2') or None,
+    map_urls(fn, urls) runs fn over urls concurrently and returns
+    {url: result}, and filename_for(sheet) names a loaded Stylesheet's file
+    under css/. Sheets are named in document order, so naming that depends
+    on what was claimed before stays the same from run to run.
+    """
+
+    def __init__(self, fetch_text, fetch_asset, map_urls, filename_for):
+        self.fetch_text = fetch_text
+        self.fetch_asset = fetch_asset
+        self.map_urls = map_urls
+        self.filename_for = filename_for
+        self.sheets = OrderedDict()  # url -> Stylesheet for every external sheet loaded
+        self.inline = []
+        self.assets = {}  # url -> local path
+        self._seen = set()
+
+    def load(self, urls):
+        """Fetch stylesheets and, recursively, everything they @import"""
+        frontier = [sheet_url for sheet_url in dict.fromkeys(urls) if sheet_url not in self._seen]
+        while frontier:
+            self._seen.update(frontier)
+            texts = self.map_urls(self.fetch_text, frontier)
+            imports = []
+            for sheet_url in frontier:
+                text = texts.get(sheet_url)
+                if text is None:
+                    continue
+                sheet = self.sheets[sheet_url] = Stylesheet(sheet_url, text)
+                sheet.filename = self.filename_for(sheet)
+                for reference in sheet.references:
+                    if reference.kind == 'import':
+                        imports.append(sheet.absolute(reference))
+            frontier = [sheet_url for sheet_url in dict.fromkeys(imports) if sheet_url not in self._seen]
+
+    def add_inline(self, text, base_url):
+        """Register CSS embedded in the page; returns its Stylesheet"""
+        sheet = Stylesheet(base_url, text)
+        self.inline.append(sheet)
+        self.load(sheet.absolute(reference) for reference in sheet.references if reference.kind == 'import')
+        return sheet
+
+    def fetch_assets(self):
+        """Download every url() target of every loaded sheet concurrently"""
+        urls = []
+        for sheet in list(self.sheets.values()) + self.inline:
+            for reference in sheet.references:
+                if reference.kind == 'url':
+                    asset_url = sheet.absolute(reference)
+                    if asset_url not in self.sheets and asset_url not in self.assets:
+                        urls.append(asset_url)
+        self.assets.update(self.map_urls(self.fetch_asset, list(dict.fromkeys(urls))))
+
+    def local_path(self, url):
+        """Path of a downloaded sheet or asset relative to the page, or None"""
+        if url in self.sheets:
+            return f'css/{self.sheets[url].filename}'
+        return self.assets.get(url)
+
+    def rewrite(self, sheet, from_dir):
+        """sheet's text with every downloaded reference pointing at its local copy, relative to from_dir"""
+        def replacement_for(reference):
+            local_path = self.local_path(sheet.absolute(reference))
+            return posixpath.relpath(local_path, from_dir) if local_path else None
+        return rewrite_references(sheet.text, sheet.references, replacement_for)
@@ -0,0 +1,192 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+from webdriver_manager.chrome import ChromeDriverManager
+from http_client import USER_AGENT
+
+# Number of browsers kept alive, and how many pages one browser renders before it is replaced
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', 2))
+DRIVER_MAX_PAGES = int(os.environ.get('DRIVER_MAX_PAGES', 50))
+# Seconds a request waits for a free browser before giving up
+DRIVER_CHECKOUT_TIMEOUT = float(os.environ.get('DRIVER_CHECKOUT_TIMEOUT', 60))
+# Browsers started in the background when the app boots
+DRIVER_POOL_PREWARM = int(os.environ.get('DRIVER_POOL_PREWARM', 1))
+DRIVER_PAGE_LOAD_TIMEOUT = int(os.environ.get('DRIVER_PAGE_LOAD_TIMEOUT', 30))
+
+_driver_path = os.environ.get('CHROMEDRIVER_PATH')
+_driver_path_lock = threading.Lock()
+
+class DriverPoolTimeout(Exception):
+    """Raised when no browser became free within the checkout timeout"""
+
+def get_driver_path():
+    """Resolve the chromedriver binary once per process"""
+    global _driver_path
+    if _driver_path is None:
+        with _driver_path_lock:
+            if _driver_path is None:
+                _driver_path = ChromeDriverManager().install()
+    return _driver_path
+
+def build_chrome_options():
+    """Headless Chrome options shared by every pooled browser"""
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-infobars')
+    options.add_argument('--window-size=1920,1080')
+
+    # Add user agent to avoid detection
+    options.add_argument(f'--user-agent={USER_AGENT}')
+    # Network events for the captureNetwork option (read back with get_log('performance'))
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    return options
+
+class PooledDriver:
+    """A browser owned by the pool plus the bookkeeping needed to recycle it"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.time()
+        self.broken = False
+
+class DriverPool:
+    """Warm pool of headless Chrome sessions with checkout/return"""
+
+    def __init__(self, size=None, max_pages=None):
+        self.size = max(1, size or DRIVER_POOL_SIZE)
+        self.max_pages = max(1, max_pages or DRIVER_MAX_PAGES)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._live = set()
+        self._closed = False
+
+    def _create(self):
+        driver = webdriver.Chrome(service=ChromeService(get_driver_path()), options=build_chrome_options())
+        driver.set_page_load_timeout(DRIVER_PAGE_LOAD_TIMEOUT)
+        pooled = PooledDriver(driver)
+        with self._lock:
+            self._live.add(pooled)
+        return pooled
+
+    def _discard(self, pooled):
+        with self._lock:
+            self._live.discard(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error closing WebDriver: {str(e)}")
+
+    def is_healthy(self, pooled):
+        try:
+            return pooled.driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        # Drop page state so the next site starts from a clean browser
+        pooled.driver.get('about:blank')
+        pooled.driver.delete_all_cookies()
+        # Drain the performance log so it does not grow with every page this browser renders
+        pooled.driver.get_log('performance')
+
+    def acquire(self, timeout=None):
+        """Check out a healthy browser, starting a new one if none is idle"""
+        if not self._slots.acquire(timeout=timeout or DRIVER_CHECKOUT_TIMEOUT):
+            raise DriverPoolTimeout(f'No browser available after {timeout or DRIVER_CHECKOUT_TIMEOUT}s')
+        try:
+            while True:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if self.is_healthy(pooled):
+                    return pooled
+                print('Discarding unresponsive WebDriver')
+                self._discard(pooled)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, pooled):
+        """Return a browser to the pool, recycling it if it crashed or is worn out"""
+        try:
+            pooled.pages += 1
+            if pooled.broken or pooled.pages >= self.max_pages or self._closed:
+                self._discard(pooled)
+                return
+            try:
+                self._reset(pooled)
+            except Exception as e:
+                print(f"Error resetting WebDriver: {str(e)}")
+                self._discard(pooled)
+                return
+            self._idle.put(pooled)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Context manager yielding a driver; a browser that raised is recycled"""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled.driver
+        except Exception:
+            pooled.broken = not self.is_healthy(pooled)
+            raise
+        finally:
+            self.release(pooled)
+
+    def warm(self, count=None):
+        """Start browsers ahead of the first request"""
+        count = min(self.size, self.size if count is None else count)
+        started = []
+        try:
+            for _ in range(count):
+                started.append(self.acquire())
+        except Exception as e:
+            print(f"Error warming WebDriver pool: {str(e)}")
+        for pooled in started:
+            pooled.pages -= 1  # Warming does not count as a rendered page
+            self.release(pooled)
+
+    def stats(self):
+        with self._lock:
+            live = len(self._live)
+        return {'size': self.size, 'live': live, 'idle': self._idle.qsize()}
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_driver_pool():
+    """Return the process-wide browser pool"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DriverPool()
+                atexit.register(_pool.shutdown)
+    return _pool
+
+def warm_driver_pool_async():
+    """Pre-start DRIVER_POOL_PREWARM browsers on a background thread"""
+    if DRIVER_POOL_PREWARM > 0:
+        threading.Thread(target=get_driver_pool().warm, args=(DRIVER_POOL_PREWARM,), daemon=True).start()
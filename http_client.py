@@ -0,0 +1,352 @@
+import os
+import time
+import weakref
+import threading
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import REGISTRY
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Connection pooling: number of hosts kept in the pool cache and connections kept per host
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 32))
+HTTP_POOL_PER_HOST = int(os.environ.get('HTTP_POOL_PER_HOST', 16))
+
+# Retry policy for transient failures; throttling answers are retried by the host scheduler instead
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.5))
+HTTP_RETRY_STATUSES = (500, 502, 504)
+HTTP_THROTTLE_STATUSES = (429, 503)
+
+# Politeness per origin, process-wide: simultaneous requests and request starts per second (0 = no limit).
+# ASSET_PER_HOST_LIMIT is the older name of HOST_CONCURRENCY and is still honoured.
+HOST_CONCURRENCY = int(os.environ.get('HOST_CONCURRENCY', os.environ.get('ASSET_PER_HOST_LIMIT', 6)))
+HOST_RPS = float(os.environ.get('HOST_RPS', 0))
+# Adaptive backoff: each 429/503 doubles the gap between requests to that host (from HOST_BACKOFF_MIN
+# up to HOST_BACKOFF_MAX seconds) and each success shrinks it by HOST_BACKOFF_DECAY
+HOST_BACKOFF_MIN = float(os.environ.get('HOST_BACKOFF_MIN', 0.5))
+HOST_BACKOFF_MAX = float(os.environ.get('HOST_BACKOFF_MAX', 30))
+HOST_BACKOFF_DECAY = float(os.environ.get('HOST_BACKOFF_DECAY', 0.8))
+# Longest Retry-After waited for; a throttled request asking for more is returned as is
+HOST_RETRY_AFTER_MAX = float(os.environ.get('HOST_RETRY_AFTER_MAX', 120))
+
+# (connect, read) timeout applied to every request that does not pass its own
+HTTP_TIMEOUT = (
+    float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10)),
+    float(os.environ.get('HTTP_READ_TIMEOUT', 30)),
+)
+
+# Streaming transfers: read size, largest single asset (0 = no cap) and bytes one clone may download (0 = no cap)
+STREAM_CHUNK_BYTES = int(os.environ.get('STREAM_CHUNK_BYTES', 64 * 1024))
+ASSET_MAX_BYTES = int(os.environ.get('ASSET_MAX_BYTES', 100 * 1024 * 1024))
+JOB_MAX_BYTES = int(os.environ.get('JOB_MAX_BYTES', 1024 * 1024 * 1024))
+# Resume interrupted bodies with Range requests when the server supports them
+RANGE_RESUME = os.environ.get('RANGE_RESUME', '1') != '0'
+RANGE_RESUME_ATTEMPTS = int(os.environ.get('RANGE_RESUME_ATTEMPTS', 2))
+
+_session = None
+_session_lock = threading.Lock()
+
+def build_session():
+    """Create a requests session with keep-alive pooling and retry/backoff"""
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        # 429/503 with Retry-After are left to the host scheduler, which pauses the whole host
+        respect_retry_after_header=False,
+        raise_on_status=False,  # Hand the last response back instead of raising
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_PER_HOST, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return session
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+def retry_after_seconds(value):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class HostState:
+    """Scheduling state of one host"""
+
+    def __init__(self, lock, delay):
+        self.ready = threading.Condition(lock)
+        self.queued = 0  # requests waiting for a slot or their start time
+        self.in_flight = 0  # slots taken, including requests waiting for their start time
+        self.pacing = 0  # requests holding a slot while waiting for their start time
+        self.delay = delay  # seconds between request starts
+        self.next_start = 0.0
+        self.paused_until = 0.0  # set by Retry-After
+        self.backed_off_at = 0.0
+
+class HostScheduler:
+    """Paces every outgoing request per host.
+
+    A request waits for a free slot on its host (HOST_CONCURRENCY), then for
+    its start time: starts are spaced by the host's delay (1 / HOST_RPS,
+    grown by backoff after 429/503) and held while a Retry-After is pending.
+    Hosts never wait on each other, so fetching across hosts stays parallel.
+    """
+
+    def __init__(self, concurrency=None, rps=None):
+        self.concurrency = HOST_CONCURRENCY if concurrency is None else concurrency
+        rps = HOST_RPS if rps is None else rps
+        self.base_delay = 1 / rps if rps else 0.0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """Block until a request to url may start; returns the host to pass to record() and release()"""
+        host = urlparse(url).netloc.lower()
+        started = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState(self._lock, self.base_delay)
+            state.queued += 1
+            while self.concurrency and state.in_flight >= self.concurrency:
+                state.ready.wait()
+            state.in_flight += 1
+            state.pacing += 1
+            now = time.monotonic()
+            start = max(now, state.next_start, state.paused_until)
+            state.next_start = start + state.delay
+
+        while True:
+            wait = start - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self._lock:
+                # A Retry-After that arrived while this request was waiting holds it as well
+                if state.paused_until <= time.monotonic():
+                    state.queued -= 1
+                    state.pacing -= 1
+                    break
+                start = state.paused_until
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            REGISTRY.inc('http_host_wait_seconds_total', waited, host=REGISTRY.host_label(host))
+        return host
+
+    def record(self, host, status, retry_after=None):
+        """Adapt the host's pace to a response status"""
+        with self._lock:
+            state = self._hosts[host]
+            now = time.monotonic()
+            if status in HTTP_THROTTLE_STATUSES:
+                # Throttles from requests that were already in flight count as one
+                if now - state.backed_off_at >= state.delay:
+                    state.delay = min(max(state.delay * 2, HOST_BACKOFF_MIN), HOST_BACKOFF_MAX)
+                    state.backed_off_at = now
+                state.next_start = max(state.next_start, now + state.delay)
+                if retry_after is not None:
+                    state.paused_until = max(state.paused_until, now + min(retry_after, HOST_RETRY_AFTER_MAX))
+            elif state.delay > self.base_delay:
+                state.delay *= HOST_BACKOFF_DECAY
+                if state.delay < max(self.base_delay, HOST_BACKOFF_MIN / 4):
+                    state.delay = self.base_delay
+        if status in HTTP_THROTTLE_STATUSES:
+            REGISTRY.inc('http_host_throttled_total', host=REGISTRY.host_label(host))
+
+    def release(self, host):
+        """Free the slot taken by acquire()"""
+        with self._lock:
+            state = self._hosts[host]
+            state.in_flight -= 1
+            state.ready.notify()
+            # Forget hosts with nothing pending so the table does not grow without bound
+            now = time.monotonic()
+            if (not state.in_flight and not state.queued and state.delay == self.base_delay
+                    and state.next_start <= now and state.paused_until <= now):
+                del self._hosts[host]
+
+    def stats(self):
+        """{host: {'queued', 'in_flight', 'delay', 'paused'}} for hosts with requests pending or backing off"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'queued': state.queued,
+                    'in_flight': state.in_flight - state.pacing,
+                    'delay': round(state.delay, 3),
+                    'paused': round(max(0.0, state.paused_until - now), 3),
+                }
+                for host, state in self._hosts.items()
+            }
+
+_scheduler = None
+
+def get_scheduler():
+    """Return the process-wide host scheduler, creating it on first use"""
+    global _scheduler
+    if _scheduler is None:
+        with _session_lock:
+            if _scheduler is None:
+                _scheduler = HostScheduler()
+    return _scheduler
+
+def hold_until_closed(response, release):
+    """Keep a streamed response's host slot until it is closed (or garbage collected)"""
+    finalizer = weakref.finalize(response, release)
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            finalizer()
+
+    response.close = close_and_release
+
+def http_get(url, **kwargs):
+    """GET through the shared session with the default timeout, paced by the host scheduler.
+
+    429 and 503 answers slow the host down and are retried up to
+    HTTP_RETRIES times once its Retry-After or backoff has passed; the last
+    answer is returned. A streamed response holds its host slot until closed.
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    kwargs.setdefault('allow_redirects', True)
+    scheduler = get_scheduler()
+    for attempt in range(HTTP_RETRIES + 1):
+        host = scheduler.acquire(url)
+        try:
+            response = get_session().get(url, **kwargs)
+        except Exception:
+            scheduler.release(host)
+            raise
+        retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+        scheduler.record(host, response.status_code, retry_after)
+        if (response.status_code in HTTP_THROTTLE_STATUSES and attempt < HTTP_RETRIES
+                and (retry_after is None or retry_after <= HOST_RETRY_AFTER_MAX)):
+            response.close()
+            scheduler.release(host)
+            continue
+        if kwargs.get('stream'):
+            hold_until_closed(response, lambda: scheduler.release(host))
+        else:
+            scheduler.release(host)
+        return response
+
+class AssetTooLarge(Exception):
+    """Raised when a body is over the per-asset cap, before or while it streams"""
+
+    def __init__(self, url, size, limit, content_type=''):
+        super().__init__(f'{url} is larger than {limit} bytes')
+        self.url = url
+        self.size = size  # Content-Length, or the bytes read when the cap was hit
+        self.limit = limit
+        self.content_type = content_type
+
+class ByteBudgetExceeded(Exception):
+    """Raised when a clone has used up its byte budget"""
+
+class ByteBudget:
+    """Bytes one clone may still download, shared by its worker threads"""
+
+    def __init__(self, limit=None):
+        self.limit = JOB_MAX_BYTES if limit is None else limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            if self.limit and self.used + size > self.limit:
+                raise ByteBudgetExceeded(f'Byte budget of {self.limit} bytes used up')
+            self.used += size
+
+    def check(self, size):
+        """Raise without consuming when size no longer fits"""
+        if self.limit and self.used + size > self.limit:
+            raise ByteBudgetExceeded(f'Byte budget of {self.limit} bytes used up')
+
+def content_length(response):
+    try:
+        return int(response.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        return None
+
+def iter_body(response, max_bytes=None, budget=None, chunk_size=None):
+    """Yield a streamed response body in fixed-size chunks without holding it in memory.
+
+    Raises AssetTooLarge as soon as Content-Length or the bytes read exceed
+    max_bytes (ASSET_MAX_BYTES by default, 0 for no cap), and
+    ByteBudgetExceeded when budget runs out. If the connection drops part way
+    and the server accepts ranges, the rest is fetched with a Range request.
+    Compressed bodies are decoded, so sizes count decoded bytes.
+    """
+    max_bytes = ASSET_MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or STREAM_CHUNK_BYTES
+    content_type = response.headers.get('Content-Type', '').split(';')[0]
+    length = content_length(response)
+    if max_bytes and length is not None and length > max_bytes:
+        raise AssetTooLarge(response.url, length, max_bytes, content_type)
+    if budget and length is not None:
+        budget.check(length)
+
+    resumable = (
+        RANGE_RESUME
+        and response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        and not response.headers.get('Content-Encoding')
+    )
+    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+    received = 0
+    attempts = 0
+    current = response
+    try:
+        while True:
+            try:
+                for chunk in current.iter_content(chunk_size=chunk_size):
+                    received += len(chunk)
+                    if max_bytes and received > max_bytes:
+                        raise AssetTooLarge(response.url, received, max_bytes, content_type)
+                    if budget:
+                        budget.consume(len(chunk))
+                    yield chunk
+                return
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError):
+                if not resumable or not received or attempts >= RANGE_RESUME_ATTEMPTS:
+                    raise
+                attempts += 1
+                headers = {'Range': f'bytes={received}-'}
+                if validator:
+                    headers['If-Range'] = validator
+                print(f'Resuming {response.url} at byte {received}')
+                # Closing the broken response frees its host slot for the range request
+                current.close()
+                current = http_get(response.url, stream=True, headers=headers)
+                if current.status_code != 206 or not current.headers.get('Content-Range', '').startswith(f'bytes {received}-'):
+                    # The server sent the whole body again (or refused), so the partial copy can not be completed
+                    raise
+    finally:
+        if current is not response:
+            current.close()
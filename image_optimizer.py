@@ -0,0 +1,214 @@
+import os
+import time
+import uuid
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from asset_cache import CachedAsset
+
+try:
+    from PIL import Image, ImageOps, features
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+# Worker processes shared by every clone that optimizes images
+IMAGE_OPTIMIZE_WORKERS = int(os.environ.get('IMAGE_OPTIMIZE_WORKERS', os.cpu_count() or 2))
+# Defaults for the optimizeImages option (0 means no dimension limit)
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp')
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+IMAGE_MAX_WIDTH = int(os.environ.get('IMAGE_MAX_WIDTH', 1920))
+IMAGE_MAX_HEIGHT = int(os.environ.get('IMAGE_MAX_HEIGHT', 1920))
+# Images smaller than this are left as they are
+IMAGE_MIN_BYTES = int(os.environ.get('IMAGE_MIN_BYTES', 50 * 1024))
+
+# Output format -> (Pillow format, file extension, content type)
+OUTPUT_FORMATS = {
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'avif': ('AVIF', '.avif', 'image/avif'),
+}
+# Only raster formats are recompressed; SVG and GIF (often animated) are kept as downloaded
+OPTIMIZABLE_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/bmp', 'image/tiff'}
+OPTIMIZABLE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+
+def supported_formats():
+    """Output formats the installed Pillow can write"""
+    if not PILLOW_AVAILABLE:
+        return []
+    return [name for name in OUTPUT_FORMATS if features.check(name)]
+
+def image_settings(value):
+    """Validate the optimizeImages option (true or an object) and return settings, or None when off"""
+    if not value:
+        return None
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        raise ValueError('optimizeImages must be true or an object')
+    if not PILLOW_AVAILABLE:
+        raise ValueError('optimizeImages needs Pillow, which is not installed')
+
+    settings = {
+        'format': str(value.get('format', IMAGE_FORMAT)).lower(),
+        'quality': value.get('quality', IMAGE_QUALITY),
+        'max_width': value.get('maxWidth', IMAGE_MAX_WIDTH),
+        'max_height': value.get('maxHeight', IMAGE_MAX_HEIGHT),
+        'min_bytes': value.get('minBytes', IMAGE_MIN_BYTES),
+    }
+    if settings['format'] not in OUTPUT_FORMATS:
+        raise ValueError(f'optimizeImages.format must be one of: {", ".join(OUTPUT_FORMATS)}')
+    if settings['format'] not in supported_formats():
+        raise ValueError(f'optimizeImages.format {settings["format"]} is not supported by the installed Pillow')
+    for key, name, low, high in (
+        ('quality', 'quality', 1, 100),
+        ('max_width', 'maxWidth', 0, 16384),
+        ('max_height', 'maxHeight', 0, 16384),
+        ('min_bytes', 'minBytes', 0, 2 ** 31),
+    ):
+        try:
+            settings[key] = int(settings[key])
+        except (TypeError, ValueError):
+            raise ValueError(f'optimizeImages.{name} must be an integer')
+        if not low <= settings[key] <= high:
+            raise ValueError(f'optimizeImages.{name} must be between {low} and {high}')
+    return settings
+
+def recompress(src_path, dest_path, settings):
+    """Worker: write a resized, recompressed copy of src_path to dest_path.
+
+    Returns (width, height, size), or None when the result would not be
+    smaller than the original (dest_path is then removed).
+    """
+    pillow_format = OUTPUT_FORMATS[settings['format']][0]
+    with Image.open(src_path) as image:
+        if getattr(image, 'is_animated', False):
+            return None
+        image = ImageOps.exif_transpose(image)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if transparent else 'RGB')
+        # thumbnail() only ever shrinks and keeps the aspect ratio
+        image.thumbnail((settings['max_width'] or image.width, settings['max_height'] or image.height), Image.LANCZOS)
+        image.save(dest_path, pillow_format, quality=settings['quality'])
+        width, height = image.size
+
+    size = os.path.getsize(dest_path)
+    if size >= os.path.getsize(src_path):
+        os.remove(dest_path)
+        return None
+    return width, height, size
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_image_pool():
+    """Return the process pool, starting it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a threaded web server can deadlock, so workers are spawned fresh
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_OPTIMIZE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def discard_image_pool(pool):
+    """Drop a broken pool (a worker died) so the next image starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+class ImageOptimizer:
+    """Recompresses one clone's images in the shared process pool.
+
+    optimize() is called from the download threads, so several images are
+    recompressed at once while other assets are still downloading. Each
+    optimized image is recorded with its sizes and seconds.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.images = []  # one entry per optimized image
+        self.skipped = 0
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def wants(self, url, cached):
+        """True for raster images at or over min_bytes"""
+        content_type = (cached.content_type or '').lower()
+        extension = os.path.splitext(url.split('?')[0])[1].lower()
+        if content_type not in OPTIMIZABLE_TYPES and extension not in OPTIMIZABLE_EXTENSIONS:
+            return False
+        return cached.size >= self.settings['min_bytes']
+
+    def optimize(self, url, cached):
+        """Return (CachedAsset, extension) for the optimized body, or None to keep the original"""
+        if not self.wants(url, cached):
+            with self._lock:
+                self.skipped += 1
+            return None
+
+        _, extension, content_type = OUTPUT_FORMATS[self.settings['format']]
+        dest_path = os.path.join(tempfile.gettempdir(), uuid.uuid4().hex + extension)
+        started = time.perf_counter()
+        with self._lock:
+            self._started = self._started or started
+        pool = get_image_pool()
+        try:
+            result = pool.submit(recompress, cached.path, dest_path, self.settings).result()
+        except BrokenProcessPool as e:
+            print(f'Error optimizing image {url}: {str(e)}')
+            discard_image_pool(pool)
+            result = None
+        except Exception as e:
+            print(f'Error optimizing image {url}: {str(e)}')
+            result = None
+        if result is None and os.path.exists(dest_path):
+            os.remove(dest_path)
+        finished = time.perf_counter()
+        with self._lock:
+            self._finished = max(self._finished or finished, finished)
+            if result is None:
+                self.skipped += 1
+                return None
+            width, height, size = result
+            self.images.append({
+                'url': url,
+                'original_bytes': cached.size,
+                'optimized_bytes': size,
+                'saved_bytes': cached.size - size,
+                'width': width,
+                'height': height,
+                'seconds': round(finished - started, 3),
+            })
+
+        if cached.temporary:
+            os.remove(cached.path)
+        return CachedAsset(dest_path, content_type, cached.status, temporary=True, size=size, ok=cached.ok), extension
+
+    def wall_seconds(self):
+        """Time from the first recompression starting to the last one finishing"""
+        with self._lock:
+            if self._started is None:
+                return 0.0
+            return self._finished - self._started
+
+    def report(self):
+        with self._lock:
+            images = list(self.images)
+            skipped = self.skipped
+        original = sum(image['original_bytes'] for image in images)
+        optimized = sum(image['optimized_bytes'] for image in images)
+        return {
+            'format': self.settings['format'],
+            'optimized': len(images),
+            'skipped': skipped,
+            'original_bytes': original,
+            'optimized_bytes': optimized,
+            'saved_bytes': original - optimized,
+            'seconds': round(self.wall_seconds(), 3),
+            'images': images,
+        }
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import socket
+import sqlite3
+import threading
+from contextlib import closing
+
+# Background workers running clone jobs, and how many jobs may wait for one
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 16))
+# Seconds a finished job (and its archive) is kept for polling/download
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+
+# Shared SQLite queue used instead of the in-process one when set: web processes only enqueue
+# and serve results, `python app.py worker` processes (on this box or others) run the clones
+JOB_QUEUE_DB = os.environ.get('JOB_QUEUE_DB')
+# Where workers leave finished archives; every web and worker process must see the same directory
+JOB_RESULT_DIR = os.environ.get('JOB_RESULT_DIR', '.job_results')
+# A running job's lease is renewed every JOB_HEARTBEAT seconds; once it runs out another worker takes the job over
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+JOB_HEARTBEAT = float(os.environ.get('JOB_HEARTBEAT', 5))
+# Times a job is started before a worker dying on it marks it failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Seconds an idle worker waits before looking for a job again
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+
+# Stages reported while a job runs, in pipeline order
+JOB_STAGES = ('render', 'assets', 'rewrite', 'zip')
+
+class JobQueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+class Job:
+    """State of one clone request as seen by pollers"""
+
+    def __init__(self, options, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.options = options
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = {stage: {'state': 'pending'} for stage in JOB_STAGES}
+        self.result = None
+        self.error = None
+        self.metrics = None  # CloneMetrics set by the runner, shown while the job runs
+        self.result_key = None  # result cache key the finished archive is stored under (shared queue only)
+        self._lock = threading.Lock()
+
+    def update_progress(self, stage, **details):
+        """Progress callback handed to download_assets"""
+        with self._lock:
+            self.stages.setdefault(stage, {}).update(details)
+
+    def to_dict(self):
+        with self._lock:
+            stages = {stage: dict(details) for stage, details in self.stages.items()}
+        return {
+            'id': self.id,
+            'status': self.status,
+            'url': self.options.get('url'),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'stages': stages,
+            'metrics': self.metrics.to_dict() if self.metrics else None,
+            'error': self.error,
+        }
+
+class JobManager:
+    """Bounded job queue drained by a fixed pool of worker threads"""
+
+    def __init__(self, runner, workers=None, queue_depth=None, ttl=None):
+        self.runner = runner  # runner(job) -> archive path, raises on failure
+        self.workers = max(1, workers or JOB_WORKERS)
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self._queue = queue.Queue(maxsize=max(1, queue_depth or JOB_QUEUE_DEPTH))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = self.runner(job)
+            job.status = 'done'
+        except Exception as e:
+            print(f'Job {job.id} failed: {str(e)}')
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def _purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            if job.result and os.path.exists(job.result):
+                try:
+                    os.remove(job.result)
+                except Exception as e:
+                    print(f'Error removing archive for job {job.id}: {str(e)}')
+
+    def submit(self, options):
+        """Queue a new job, raising JobQueueFull when the queue is at capacity"""
+        self._purge_expired()
+        self._start_workers()
+        job = Job(options)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise JobQueueFull(f'Job queue is full ({self._queue.maxsize} waiting)')
+        return job
+
+    def get(self, job_id):
+        self._purge_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize(),
+            'queue_depth': self._queue.maxsize,
+            'running': statuses.count('running'),
+        }
+
+class JobRecord:
+    """A job of the shared queue as stored in its row, for pollers and downloads"""
+
+    def __init__(self, row):
+        (self.id, options, self.status, self.created_at, self.started_at, self.finished_at,
+         self.attempts, stages, metrics, self.result, self.error) = row
+        self.options = json.loads(options)
+        self.stages = json.loads(stages) if stages else {stage: {'state': 'pending'} for stage in JOB_STAGES}
+        self.metrics = json.loads(metrics) if metrics else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'url': self.options.get('url'),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'attempts': self.attempts,
+            'stages': self.stages,
+            'metrics': self.metrics,
+            'error': self.error,
+        }
+
+JOB_COLUMNS = 'id, options, status, created_at, started_at, finished_at, attempts, stages, metrics, result, error'
+
+class SharedJobQueue:
+    """Job queue in a SQLite file that any number of web and worker processes share.
+
+    Web processes call submit() and get() like on JobManager. Workers call
+    work(): each claim takes a lease that a heartbeat keeps renewing while
+    the clone runs, along with its progress. A job whose worker died is
+    claimed again once the lease runs out, up to JOB_MAX_ATTEMPTS starts.
+    Archives are moved into result_dir, so downloads work from any web process.
+    """
+
+    def __init__(self, path=None, result_dir=None, queue_depth=None, ttl=None, lease_seconds=None):
+        self.path = path or JOB_QUEUE_DB
+        self.result_dir = os.path.abspath(result_dir or JOB_RESULT_DIR)
+        self.queue_depth = max(1, queue_depth or JOB_QUEUE_DEPTH)
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self.lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+        os.makedirs(self.result_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    options TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_expires REAL,
+                    stages TEXT,
+                    metrics TEXT,
+                    result TEXT,
+                    error TEXT,
+                    result_key TEXT
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+                CREATE TABLE IF NOT EXISTS workers (
+                    id TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                );
+            ''')
+            try:
+                db.execute('ALTER TABLE jobs ADD COLUMN result_key TEXT')  # Queue files from before result keys
+            except sqlite3.OperationalError:
+                pass
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_result_key ON jobs (result_key, status)')
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and processes
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def submit(self, options, result_key=None):
+        """Queue a new job, raising JobQueueFull when the queue is at capacity.
+
+        With a result_key, a queued or running job for the same key is
+        returned instead of a new one, and the worker stores the finished
+        archive in the result cache under that key.
+        """
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            if result_key:
+                pending = db.execute(
+                    "SELECT id FROM jobs WHERE result_key = ? AND status IN ('queued', 'running') ORDER BY created_at LIMIT 1", (result_key,)
+                ).fetchone()
+                if pending:
+                    db.execute('COMMIT')
+                    return self.get(pending[0])
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.queue_depth:
+                db.execute('ROLLBACK')
+                raise JobQueueFull(f'Job queue is full ({self.queue_depth} waiting)')
+            db.execute("INSERT INTO jobs (id, options, status, created_at, result_key) VALUES (?, ?, 'queued', ?, ?)",
+                       (job_id, json.dumps(options), time.time(), result_key))
+            db.execute('COMMIT')
+        return self.get(job_id)
+
+    def get(self, job_id):
+        self._purge_expired()
+        with self._connect() as db:
+            row = db.execute(f'SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return JobRecord(row) if row else None
+
+    def _purge_expired(self):
+        with self._connect() as db:
+            expired = db.execute(
+                "SELECT id, result FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (time.time() - self.ttl,)
+            ).fetchall()
+            if expired:
+                db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id, _ in expired])
+            db.execute('DELETE FROM workers WHERE last_seen < ?', (time.time() - self.ttl,))
+        for job_id, result in expired:
+            if result and os.path.exists(result):
+                try:
+                    os.remove(result)
+                except Exception as e:
+                    print(f'Error removing archive for job {job_id}: {str(e)}')
+
+    def stats(self):
+        with self._connect() as db:
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            workers = db.execute('SELECT COUNT(*) FROM workers WHERE last_seen > ?', (time.time() - self.lease_seconds,)).fetchone()[0]
+        return {
+            'workers': workers,
+            'queued': counts.get('queued', 0),
+            'queue_depth': self.queue_depth,
+            'running': counts.get('running', 0),
+        }
+
+    def _seen(self, db, worker_id):
+        db.execute('INSERT OR REPLACE INTO workers (id, last_seen) VALUES (?, ?)', (worker_id, time.time()))
+
+    def claim(self, worker_id):
+        """Lease the oldest queued job, or one whose worker stopped renewing its lease; returns (Job, attempt) or None"""
+        while True:
+            now = time.time()
+            with self._connect() as db:
+                db.execute('BEGIN IMMEDIATE')
+                self._seen(db, worker_id)
+                row = db.execute(
+                    "SELECT id, options, attempts, worker, result_key FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND lease_expires < ?) ORDER BY created_at LIMIT 1", (now,)
+                ).fetchone()
+                if row is None:
+                    db.execute('COMMIT')
+                    return None
+                job_id, options, attempts, previous, key = row
+                if attempts >= JOB_MAX_ATTEMPTS:
+                    db.execute("UPDATE jobs SET status = 'failed', finished_at = ?, lease_expires = NULL, error = ? WHERE id = ?",
+                               (now, f'Worker stopped responding (last {previous}) on all {attempts} attempts', job_id))
+                    db.execute('COMMIT')
+                    continue
+                db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, attempts = ?, started_at = ? WHERE id = ?",
+                    (worker_id, now + self.lease_seconds, attempts + 1, now, job_id)
+                )
+                db.execute('COMMIT')
+            if previous:
+                print(f'Job {job_id} taken over from {previous} (attempt {attempts + 1})')
+            job = Job(json.loads(options), job_id)
+            job.result_key = key
+            job.status = 'running'
+            job.started_at = now
+            return job, attempts + 1
+
+    def _progress(self, job):
+        details = job.to_dict()
+        return json.dumps(details['stages']), json.dumps(details['metrics']) if details['metrics'] else None
+
+    def heartbeat(self, job, worker_id):
+        """Renew the lease and save progress; False when another worker has taken the job over"""
+        stages, metrics = self._progress(job)
+        with self._connect() as db:
+            self._seen(db, worker_id)
+            updated = db.execute(
+                "UPDATE jobs SET lease_expires = ?, stages = ?, metrics = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, stages, metrics, job.id, worker_id)
+            ).rowcount
+        return updated == 1
+
+    def finish(self, job, worker_id, attempt, archive=None, error=None):
+        """Record the outcome, moving the archive into result_dir; a job lost to another worker is left to it"""
+        result = None
+        if archive:
+            result = os.path.join(self.result_dir, f'{job.id}_{attempt}.zip')
+            shutil.move(archive, result)
+        stages, metrics = self._progress(job)
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, lease_expires = NULL, stages = ?, metrics = ?, result = ?, error = ? "
+                "WHERE id = ? AND worker = ? AND attempts = ? AND status = 'running'",
+                ('done' if archive else 'failed', time.time(), stages, metrics, result, error, job.id, worker_id, attempt)
+            ).rowcount
+        if not updated:
+            print(f'Job {job.id} was taken over by another worker; dropping attempt {attempt}')
+            if result:
+                os.remove(result)
+
+    def _run(self, runner, worker_id):
+        claimed = self.claim(worker_id)
+        if claimed is None:
+            return False
+        job, attempt = claimed
+        stop = threading.Event()
+
+        def keep_lease():
+            while not stop.wait(JOB_HEARTBEAT):
+                if not self.heartbeat(job, worker_id):
+                    print(f'Job {job.id}: lease lost')
+                    return
+
+        heartbeat = threading.Thread(target=keep_lease, name=f'{worker_id}-lease', daemon=True)
+        heartbeat.start()
+        try:
+            archive = runner(job)
+        except Exception as e:
+            print(f'Job {job.id} failed: {str(e)}')
+            job.finished_at = time.time()
+            stop.set()
+            self.finish(job, worker_id, attempt, error=str(e))
+        else:
+            job.finished_at = time.time()
+            stop.set()
+            self.finish(job, worker_id, attempt, archive=archive)
+        heartbeat.join()
+        return True
+
+    def _work(self, runner, worker_id):
+        while True:
+            try:
+                ran = self._run(runner, worker_id)
+            except Exception as e:
+                # Queue database busy or unreachable; try again after a pause
+                print(f'Worker {worker_id} error: {str(e)}')
+                ran = False
+            if not ran:
+                time.sleep(JOB_POLL_INTERVAL)
+
+    def work(self, runner, workers=None):
+        """Run jobs from the queue on worker threads until the process is stopped"""
+        workers = max(1, workers or JOB_WORKERS)
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [threading.Thread(target=self._work, args=(runner, f'{prefix}:{i}'), name=f'job-worker-{i}', daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        print(f'Worker {prefix} running {workers} job threads on {self.path}')
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Hosts tracked individually on /metrics; any further hosts are counted as "other"
+METRICS_MAX_HOSTS = int(os.environ.get('METRICS_MAX_HOSTS', 100))
+
+# Metric families exposed on /metrics, in output order: name -> (type, help)
+METRIC_FAMILIES = OrderedDict([
+    ('clone_requests_total', ('counter', 'Finished clones by result')),
+    ('clone_stage_seconds', ('summary', 'Wall time spent in each pipeline stage')),
+    ('clone_time_to_ready_seconds', ('summary', 'Seconds from browser navigation until the page was taken, by readiness strategy and outcome')),
+    ('clone_assets_total', ('counter', 'Assets fetched by type')),
+    ('clone_asset_bytes_total', ('counter', 'Asset bytes fetched by type')),
+    ('clone_asset_failures_total', ('counter', 'Assets that failed to download by type')),
+    ('clone_assets_skipped_total', ('counter', 'Assets left out by type and reason (oversized, budget)')),
+    ('clone_duplicate_assets_total', ('counter', 'Assets whose body was already saved under another URL, by type')),
+    ('clone_duplicate_bytes_total', ('counter', 'Bytes not written again thanks to content-hash deduplication, by type')),
+    ('clone_images_optimized_total', ('counter', 'Images recompressed by the image optimization stage')),
+    ('clone_image_bytes_saved_total', ('counter', 'Bytes saved by image recompression')),
+    ('clone_asset_cache_total', ('counter', 'Asset fetches by cache outcome')),
+    ('clone_render_blocked_total', ('counter', 'Requests the browser was kept from making while rendering, by resource type')),
+    ('clone_host_requests_total', ('counter', 'Asset requests by host')),
+    ('clone_host_seconds_total', ('counter', 'Seconds spent fetching assets by host')),
+    ('http_host_wait_seconds_total', ('counter', 'Seconds requests waited for the host scheduler, by host')),
+    ('http_host_throttled_total', ('counter', 'Responses with 429 or 503 that slowed a host down, by host')),
+])
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels)
+        name = f'{name}{{{label_text}}}'
+    if isinstance(value, float):
+        value = round(value, 6)
+    return f'{name} {value}'
+
+class MetricsRegistry:
+    """Process-wide counters and summaries rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._values = {}  # (sample name, sorted label items) -> value
+        self._hosts = set()
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Add one observation to a summary (its _sum and _count samples)"""
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[(f'{name}_sum', labels)] = self._values.get((f'{name}_sum', labels), 0) + value
+            self._values[(f'{name}_count', labels)] = self._values.get((f'{name}_count', labels), 0) + 1
+
+    def host_label(self, host):
+        """Label value for a host, capped at METRICS_MAX_HOSTS distinct hosts"""
+        with self._lock:
+            if host in self._hosts or len(self._hosts) < METRICS_MAX_HOSTS:
+                self._hosts.add(host)
+                return host
+        return 'other'
+
+    def render(self, gauges=None):
+        """Text exposition of every family, plus gauges given as {name: (help, value)}.
+
+        A gauge value may also be {host: value}, rendered with a host label
+        (capped like every other host label, extra hosts summed as "other").
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        for family, (kind, help_text) in METRIC_FAMILIES.items():
+            samples = [(name, labels, value) for (name, labels), value in values
+                       if name == family or name in (f'{family}_sum', f'{family}_count')]
+            if not samples:
+                continue
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            lines.extend(format_sample(name, labels, value) for name, labels, value in samples)
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            if not isinstance(value, dict):
+                lines.append(format_sample(name, (), value))
+                continue
+            by_host = {}
+            for host, host_value in value.items():
+                label = self.host_label(host)
+                by_host[label] = by_host.get(label, 0) + host_value
+            lines.extend(format_sample(name, (('host', host),), host_value) for host, host_value in sorted(by_host.items()))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+class CloneMetrics:
+    """Stage timings and asset counters for one clone.
+
+    Everything recorded here is also added to the process-wide registry, so
+    /metrics aggregates every clone while the job response shows this one.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or REGISTRY
+        self.stages = OrderedDict()  # stage -> seconds
+        self.assets = {}  # asset type -> {'count', 'bytes', 'failures'}
+        self.cache = {}  # cache outcome -> count
+        self.hosts = {}  # host -> {'requests', 'seconds'}
+        self.skipped = {}  # reason -> count
+        self.duplicates = {'assets': 0, 'bytes_saved': 0}
+        self.image_optimization = None  # ImageOptimizer report when the stage ran
+        self.readiness = None  # wait_until_ready() report for browser renders
+        self.render_blocked = None  # count_blocked() result for browser renders with a block list
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with-block as stage name (repeated stages add up)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+        self.registry.observe('clone_stage_seconds', seconds, stage=name)
+
+    def asset(self, asset_type, host, seconds, size=0, cache=None, failed=False):
+        """Record one asset fetch"""
+        with self._lock:
+            counts = self.assets.setdefault(asset_type, {'count': 0, 'bytes': 0, 'failures': 0})
+            host_counts = self.hosts.setdefault(host, {'requests': 0, 'seconds': 0})
+            host_counts['requests'] += 1
+            host_counts['seconds'] += seconds
+            if failed:
+                counts['failures'] += 1
+            else:
+                counts['count'] += 1
+                counts['bytes'] += size
+            if cache:
+                self.cache[cache] = self.cache.get(cache, 0) + 1
+
+        host = self.registry.host_label(host)
+        self.registry.inc('clone_host_requests_total', host=host)
+        self.registry.inc('clone_host_seconds_total', seconds, host=host)
+        if failed:
+            self.registry.inc('clone_asset_failures_total', type=asset_type)
+            return
+        self.registry.inc('clone_assets_total', type=asset_type)
+        self.registry.inc('clone_asset_bytes_total', size, type=asset_type)
+        if cache:
+            self.registry.inc('clone_asset_cache_total', status=cache)
+
+    def skip(self, asset_type, reason):
+        """Record an asset deliberately left out of the clone"""
+        with self._lock:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+        self.registry.inc('clone_assets_skipped_total', type=asset_type, reason=reason)
+
+    def duplicate(self, asset_type, size):
+        """Record an asset whose body was already saved under another URL"""
+        with self._lock:
+            self.duplicates['assets'] += 1
+            self.duplicates['bytes_saved'] += size
+        self.registry.inc('clone_duplicate_assets_total', type=asset_type)
+        self.registry.inc('clone_duplicate_bytes_total', size, type=asset_type)
+
+    def optimized_images(self, report):
+        """Record the image optimization stage's report"""
+        with self._lock:
+            self.image_optimization = report
+        self.registry.inc('clone_images_optimized_total', report['optimized'])
+        self.registry.inc('clone_image_bytes_saved_total', report['saved_bytes'])
+
+    def ready(self, report):
+        """Record how long a browser render took to become ready and why it stopped waiting"""
+        with self._lock:
+            self.readiness = report
+        self.registry.observe('clone_time_to_ready_seconds', report['seconds'], strategy=report['strategy'], outcome=report['outcome'])
+
+    def blocked(self, counts):
+        """Record the requests the block list stopped while rendering"""
+        with self._lock:
+            self.render_blocked = counts
+        for resource_type, count in counts['types'].items():
+            self.registry.inc('clone_render_blocked_total', count, type=resource_type)
+
+    def finish(self, result):
+        """Count the clone as 'done', 'failed' or 'cancelled'"""
+        self.registry.inc('clone_requests_total', result=result)
+
+    def to_dict(self):
+        with self._lock:
+            extra = {'image_optimization': self.image_optimization} if self.image_optimization else {}
+            if self.readiness:
+                extra['ready'] = self.readiness
+            if self.render_blocked:
+                extra['render_blocked'] = self.render_blocked
+            return {
+                'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+                'assets': {asset_type: dict(counts) for asset_type, counts in self.assets.items()},
+                'cache': dict(self.cache),
+                'skipped': dict(self.skipped),
+                'duplicates': dict(self.duplicates),
+                'hosts': {host: {'requests': counts['requests'], 'seconds': round(counts['seconds'], 3)} for host, counts in self.hosts.items()},
+                **extra,
+            }
+
+    def server_timing(self):
+        """Server-Timing header value with one entry per stage"""
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items())
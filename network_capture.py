@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import codecs
+import uuid
+import base64
+import shutil
+import tempfile
+import threading
+from http_client import ASSET_MAX_BYTES
+from asset_cache import CachedAsset, SharedAssetStore
+
+# Chrome's buffers for response bodies kept for Network.getResponseBody, in total and per resource
+CAPTURE_BUFFER_BYTES = int(os.environ.get('CAPTURE_BUFFER_BYTES', 256 * 1024 * 1024))
+CAPTURE_RESOURCE_BUFFER_BYTES = int(os.environ.get('CAPTURE_RESOURCE_BUFFER_BYTES', 64 * 1024 * 1024))
+
+# Resources loaded by scripts that the DOM walk can not see; these are archived even when nothing references them
+CAPTURE_EXTRA_TYPES = {'Image', 'Font', 'Media', 'XHR', 'Fetch'}
+
+def network_events(entries):
+    """(method, params) of each DevTools event in driver.get_log('performance') entries"""
+    for entry in entries:
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, ValueError):
+            continue
+        yield message.get('method'), message.get('params', {})
+
+def response_charset(response):
+    """Python codec for a DevTools response's charset, utf-8 when none is given or it is unknown"""
+    charset = response.get('charset')
+    if not charset:
+        headers = {name.lower(): value for name, value in (response.get('headers') or {}).items()}
+        match = re.search(r'charset=["\']?([\w.:-]+)', headers.get('content-type', ''), re.I)
+        charset = match.group(1) if match else None
+    try:
+        return codecs.lookup(charset).name if charset else 'utf-8'
+    except LookupError:
+        return 'utf-8'
+
+class NetworkCapture:
+    """Response bodies recorded from one browser page load.
+
+    start() runs before driver.get() and collect() after it, while the
+    page is still open: the performance log entries say which requests
+    finished, and Network.getResponseBody returns each body from Chrome's buffer.
+    Bodies are written to a temp directory; failed, redirected and
+    oversized responses are left for a normal fetch.
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='capture_')
+        self.entries = {}  # url -> (CachedAsset, resource type)
+        self.failed = 0
+        self.bytes = 0
+
+    def start(self, driver):
+        driver.get_log('performance')  # Drop events from before this page
+        driver.execute_cdp_cmd('Network.enable', {
+            'maxTotalBufferSize': CAPTURE_BUFFER_BYTES,
+            'maxResourceBufferSize': CAPTURE_RESOURCE_BUFFER_BYTES,
+        })
+
+    def collect(self, driver, page_urls, entries):
+        """Keep the body of every successful response in the performance log entries"""
+        responses = {}  # request id -> (url, type, mime type, charset)
+        finished = []
+        for method, params in network_events(entries):
+            if method == 'Network.responseReceived':
+                response = params.get('response', {})
+                if response.get('status') == 200 and response.get('url', '').startswith(('http://', 'https://')):
+                    responses[params['requestId']] = (response['url'], params.get('type'), response.get('mimeType', ''), response_charset(response))
+            elif method == 'Network.loadingFinished':
+                finished.append(params.get('requestId'))
+
+        for request_id in finished:
+            if request_id not in responses:
+                continue
+            url, resource_type, mime_type, charset = responses[request_id]
+            if resource_type == 'Document' and url in page_urls:
+                continue  # the page itself comes from page_source
+            try:
+                result = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+            except Exception:
+                # Evicted from the buffer or not retrievable (e.g. a streamed media range)
+                self.failed += 1
+                continue
+            if result.get('base64Encoded'):
+                body = base64.b64decode(result['body'])
+            else:
+                # Chrome hands text back decoded; encode it the way the server sent it so the bytes match its charset
+                body = result['body'].encode(charset, errors='replace')
+            if ASSET_MAX_BYTES and len(body) > ASSET_MAX_BYTES:
+                self.failed += 1
+                continue
+            path = os.path.join(self.root, uuid.uuid4().hex)
+            with open(path, 'wb') as f:
+                f.write(body)
+            previous = self.entries.get(url)
+            if previous:
+                self.bytes -= previous[0].size
+                os.remove(previous[0].path)
+            self.entries[url] = (CachedAsset(path, mime_type.split(';')[0], 'captured', size=len(body)), resource_type)
+            self.bytes += len(body)
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        return entry[0] if entry else None
+
+    def extra_urls(self):
+        """Captured resources of the kinds scripts load on their own (lazy images, fonts, XHR/fetch data)"""
+        return [url for url, (_, resource_type) in self.entries.items() if resource_type in CAPTURE_EXTRA_TYPES]
+
+    def stats(self):
+        return {'captured': len(self.entries), 'captured_bytes': self.bytes, 'capture_failed': self.failed}
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+class CaptureStore(SharedAssetStore):
+    """SharedAssetStore that serves bodies the browser already loaded.
+
+    URLs the browser never requested are fetched from fallback (another
+    store, e.g. a batch's shared one) or, without one, from the asset cache
+    or the network.
+    """
+
+    def __init__(self, capture, fallback=None):
+        super().__init__()
+        self.capture = capture
+        self.fallback = fallback
+        self.requested = set()
+        self._requested_lock = threading.Lock()
+
+    def capture_stats(self):
+        """Counts of requested URLs served from the capture and fetched again"""
+        with self._requested_lock:
+            requested = set(self.requested)
+        served = sum(1 for url in requested if self.capture.get(url))
+        return dict(self.capture.stats(), served=served, refetched=len(requested) - served)
+
+    def _download(self, url, budget=None):
+        with self._requested_lock:
+            self.requested.add(url)
+        captured = self.capture.get(url)
+        if captured:
+            return captured
+        if self.fallback:
+            return self.fallback.fetch(url, budget)
+        return super()._download(url, budget)
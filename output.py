@@ -0,0 +1,339 @@
+import os
+import queue
+import shutil
+import zipfile
+import tempfile
+import threading
+from asset_cache import REWRITTEN_EXTENSIONS, materialize
+
+# Folders whose files are rewritten after download (domain replacement, CSS url() rewriting)
+REWRITTEN_FOLDERS = ('css', 'js')
+
+# Large streamed assets spill to disk above this size before they are copied into the zip
+ZIP_SPOOL_BYTES = int(os.environ.get('ZIP_SPOOL_BYTES', 4 * 1024 * 1024))
+# Chunks buffered between the clone and a slow client before the clone blocks
+STREAM_QUEUE_CHUNKS = int(os.environ.get('STREAM_QUEUE_CHUNKS', 64))
+
+class CloneCancelled(Exception):
+    """Raised when the client reading a streamed archive has gone away"""
+
+def is_rewritable(relpath):
+    """True for files the pipeline may rewrite or overwrite after the first write"""
+    # The parent folder decides, so page subfolders in a batch archive behave the same
+    folder = relpath.rsplit('/', 2)[-2] if '/' in relpath else ''
+    return folder in REWRITTEN_FOLDERS or os.path.splitext(relpath)[1].lower() in REWRITTEN_EXTENSIONS
+
+class DirectoryOutput:
+    """Writes the clone into save_dir and zips it at the end"""
+
+    def __init__(self, save_dir, directories=()):
+        self.save_dir = save_dir
+        for directory in directories:
+            os.makedirs(os.path.join(save_dir, directory), exist_ok=True)
+
+    def path(self, relpath):
+        full_path = os.path.join(self.save_dir, relpath)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+
+    def write_bytes(self, relpath, data):
+        with open(self.path(relpath), 'wb') as f:
+            f.write(data)
+
+    def write_chunks(self, relpath, chunks):
+        path = self.path(relpath)
+        try:
+            with open(path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except Exception:
+            # Do not leave a truncated file behind when the download is cut off
+            os.remove(path)
+            raise
+
+    def write_text(self, relpath, text, encoding='utf-8', errors='ignore'):
+        with open(self.path(relpath), 'w', encoding=encoding, errors=errors) as f:
+            f.write(text)
+
+    def write_cached(self, relpath, cached):
+        """Place a CachedAsset body at relpath"""
+        materialize(cached, self.path(relpath))
+
+    def rewrite_text(self, folder, rewrite):
+        """Apply rewrite(text) -> text to every file in folder"""
+        folder_path = os.path.join(self.save_dir, folder)
+        if not os.path.isdir(folder_path):
+            return
+        for name in os.listdir(folder_path):
+            file_path = os.path.join(folder_path, name)
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    content = f.read()
+                content = rewrite(content)
+                with open(file_path, 'w', encoding='utf-8', errors='ignore') as f:
+                    f.write(content)
+            except Exception as e:
+                print(f'Error processing file {folder}/{name}: {str(e)}')
+
+    def finalize(self, zip_name):
+        """Zip save_dir, remove it and return the archive name"""
+        shutil.make_archive(os.path.splitext(zip_name)[0], 'zip', self.save_dir)
+        self.abort()
+        return zip_name
+
+    def abort(self):
+        # Clean up the temporary directory
+        try:
+            shutil.rmtree(self.save_dir)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Error cleaning up temporary directory: {str(e)}')
+
+class ZipOutput:
+    """Writes the clone straight into a zip archive on any writable stream.
+
+    Binary assets go into the archive as soon as they arrive. Files that may
+    still be rewritten (HTML, CSS, JS) are kept in memory and written when
+    the archive is finalized.
+    """
+
+    def __init__(self, fileobj, directories=()):
+        self.fileobj = fileobj
+        self.directories = list(directories)
+        self._zip = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+        self._pending = {}
+        self._written = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        """True once nobody reads the stream any more, so the clone can stop"""
+        return getattr(self.fileobj, 'cancelled', False)
+
+    def _add(self, relpath, data=None, src_path=None):
+        with self._lock:
+            if relpath in self._written:
+                # Entries can not be replaced once streamed, keep the first copy
+                print(f'Skipping duplicate archive entry: {relpath}')
+                return
+            self._written.add(relpath)
+            if src_path is not None:
+                self._zip.write(src_path, relpath)
+            else:
+                self._zip.writestr(relpath, data)
+
+    def write_bytes(self, relpath, data):
+        if is_rewritable(relpath):
+            with self._lock:
+                self._pending[relpath] = data
+        else:
+            self._add(relpath, data)
+
+    def write_chunks(self, relpath, chunks):
+        # Spool so a slow download does not hold the archive lock
+        with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES) as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+            spool.seek(0)
+            if is_rewritable(relpath):
+                self.write_bytes(relpath, spool.read())
+                return
+            with self._lock:
+                if relpath in self._written:
+                    print(f'Skipping duplicate archive entry: {relpath}')
+                    return
+                self._written.add(relpath)
+                with self._zip.open(relpath, 'w') as entry:
+                    shutil.copyfileobj(spool, entry)
+
+    def write_text(self, relpath, text, encoding='utf-8', errors='ignore'):
+        self.write_bytes(relpath, text.encode(encoding, errors=errors))
+
+    def write_cached(self, relpath, cached):
+        """Add a CachedAsset body at relpath"""
+        try:
+            if is_rewritable(relpath):
+                with open(cached.path, 'rb') as f:
+                    self.write_bytes(relpath, f.read())
+            else:
+                self._add(relpath, src_path=cached.path)
+        finally:
+            if cached.temporary:
+                os.remove(cached.path)
+
+    def rewrite_text(self, folder, rewrite):
+        """Apply rewrite(text) -> text to every buffered file in folder"""
+        prefix = f'{folder}/'
+        with self._lock:
+            relpaths = [relpath for relpath in self._pending if relpath.startswith(prefix)]
+        for relpath in relpaths:
+            try:
+                content = rewrite(self._pending[relpath].decode('utf-8', errors='ignore'))
+                self._pending[relpath] = content.encode('utf-8', errors='ignore')
+            except Exception as e:
+                print(f'Error processing file {relpath}: {str(e)}')
+
+    def discard_pending(self, prefix):
+        """Drop buffered files under prefix (entries already streamed can not be removed)"""
+        with self._lock:
+            for relpath in [relpath for relpath in self._pending if relpath.startswith(prefix)]:
+                del self._pending[relpath]
+
+    def finalize(self, zip_name):
+        """Write buffered files and the folder entries, close the archive and return its name"""
+        with self._lock:
+            for relpath, data in self._pending.items():
+                self._zip.writestr(relpath, data)
+            self._pending.clear()
+            for directory in self.directories:
+                self._zip.writestr(zipfile.ZipInfo(f'{directory}/'), b'')
+            self._zip.close()
+        self.fileobj.close()
+        return getattr(self.fileobj, 'name', zip_name)
+
+    def abort(self):
+        # Close the archive so nothing is written to the stream after this point
+        for close in (self._zip.close, self.fileobj.close):
+            try:
+                close()
+            except Exception:
+                pass
+
+class PrefixedOutput:
+    """View of another output that places every file under a subfolder.
+
+    Used when several pages are cloned into one archive; finalizing or
+    aborting one page leaves the shared archive to its owner.
+    """
+
+    def __init__(self, output, prefix):
+        self.output = output
+        self.prefix = prefix.strip('/') + '/'
+
+    def write_bytes(self, relpath, data):
+        self.output.write_bytes(self.prefix + relpath, data)
+
+    def write_chunks(self, relpath, chunks):
+        self.output.write_chunks(self.prefix + relpath, chunks)
+
+    def write_text(self, relpath, text, encoding='utf-8', errors='ignore'):
+        self.output.write_text(self.prefix + relpath, text, encoding, errors)
+
+    def write_cached(self, relpath, cached):
+        self.output.write_cached(self.prefix + relpath, cached)
+
+    def rewrite_text(self, folder, rewrite):
+        self.output.rewrite_text(self.prefix + folder, rewrite)
+
+    def finalize(self, zip_name):
+        return zip_name
+
+    def abort(self):
+        # Files still buffered for this page are dropped; streamed ones stay in the archive
+        if hasattr(self.output, 'discard_pending'):
+            self.output.discard_pending(self.prefix)
+
+class SiteOutput:
+    """View of another output shared by every page of a crawl.
+
+    Pages write into one tree so common assets land once. Folder rewrites
+    are recorded instead of applied, and the owner runs them once after the
+    last page, so shared CSS/JS is not rewritten again for every page.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.rewrites = {}
+        self._placed = set()
+        self._lock = threading.Lock()
+
+    def write_bytes(self, relpath, data):
+        self.output.write_bytes(relpath, data)
+
+    def write_chunks(self, relpath, chunks):
+        self.output.write_chunks(relpath, chunks)
+
+    def write_text(self, relpath, text, encoding='utf-8', errors='ignore'):
+        self.output.write_text(relpath, text, encoding, errors)
+
+    def write_cached(self, relpath, cached):
+        # Assets shared by several pages are placed once
+        if not is_rewritable(relpath):
+            with self._lock:
+                if relpath in self._placed:
+                    if cached.temporary:
+                        os.remove(cached.path)
+                    return
+                self._placed.add(relpath)
+        self.output.write_cached(relpath, cached)
+
+    def rewrite_text(self, folder, rewrite):
+        self.rewrites[folder] = rewrite
+
+    def apply_rewrites(self):
+        for folder, rewrite in self.rewrites.items():
+            self.output.rewrite_text(folder, rewrite)
+
+    def finalize(self, zip_name):
+        return zip_name
+
+    def abort(self):
+        pass
+
+class QueueStream:
+    """Write-only file object whose chunks are read back by a streaming HTTP response"""
+
+    _DONE = object()
+
+    def __init__(self, max_chunks=None):
+        self._queue = queue.Queue(maxsize=max_chunks or STREAM_QUEUE_CHUNKS)
+        self._started = threading.Event()
+        self.closed = False
+        self.cancelled = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.cancelled or self.closed:
+            raise CloneCancelled('Client stopped reading the archive')
+        if data:
+            self._queue.put(bytes(data))
+            self._started.set()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(self._DONE)
+
+    def finish(self):
+        """Called by the producer once it is done, successfully or not"""
+        self.close()
+        self._started.set()
+
+    def wait_started(self, timeout=None):
+        """Block until the first chunk is written or the producer has finished"""
+        return self._started.wait(timeout)
+
+    def iter_chunks(self):
+        """Generator for the HTTP response body"""
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is self._DONE:
+                    return
+                yield chunk
+        finally:
+            # Runs when the client disconnects, unblocking and stopping the writer
+            self.cancelled = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+def as_output(save_path):
+    """Accept either a directory path or an output object"""
+    return DirectoryOutput(save_path) if isinstance(save_path, str) else save_path
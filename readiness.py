@@ -0,0 +1,135 @@
+import os
+import time
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from network_capture import network_events
+
+# When a browser-rendered page counts as ready: 'load' (the load event and a <body>) or
+# 'idle' (loaded, then no request in flight for RENDER_QUIET_MS; costs at least that long per render)
+READY_STRATEGIES = ('load', 'idle')
+RENDER_READY = os.environ.get('RENDER_READY', 'load')
+RENDER_QUIET_MS = int(os.environ.get('RENDER_QUIET_MS', 500))
+# Scroll down a viewport at a time so lazy loaders fire, at most this many steps
+RENDER_SCROLL = os.environ.get('RENDER_SCROLL', '0') != '0'
+RENDER_SCROLL_MAX_STEPS = int(os.environ.get('RENDER_SCROLL_MAX_STEPS', 20))
+# Seconds from driver.get() after which the page is taken as it is, loaded or not
+RENDER_DEADLINE = float(os.environ.get('RENDER_DEADLINE', 20))
+READY_POLL_SECONDS = 0.1
+
+# Streams stay open for the life of the page, so they do not keep it from going idle
+IDLE_IGNORED_TYPES = {'EventSource', 'WebSocket'}
+SCROLL_SCRIPT = '''
+window.scrollBy(0, window.innerHeight);
+return window.scrollY + window.innerHeight >= document.documentElement.scrollHeight;
+'''
+
+def ready_settings(value):
+    """Validate the ready option ('load', 'idle' or an object) and return settings with the defaults filled in"""
+    if value is None:
+        value = {}
+    if isinstance(value, str):
+        value = {'strategy': value}
+    if not isinstance(value, dict):
+        raise ValueError('ready must be a strategy name or an object')
+
+    settings = {
+        'strategy': value.get('strategy', RENDER_READY),
+        'quiet_ms': value.get('quietMs', RENDER_QUIET_MS),
+        'scroll': bool(value.get('scroll', RENDER_SCROLL)),
+        'deadline': value.get('deadline', RENDER_DEADLINE),
+    }
+    if settings['strategy'] not in READY_STRATEGIES:
+        raise ValueError(f'ready.strategy must be one of: {", ".join(READY_STRATEGIES)}')
+    try:
+        settings['quiet_ms'] = int(settings['quiet_ms'])
+        settings['deadline'] = float(settings['deadline'])
+    except (TypeError, ValueError):
+        raise ValueError('ready.quietMs and ready.deadline must be numbers')
+    if not 0 <= settings['quiet_ms'] <= 60000:
+        raise ValueError('ready.quietMs must be between 0 and 60000')
+    if not 1 <= settings['deadline'] <= 300:
+        raise ValueError('ready.deadline must be between 1 and 300 seconds')
+    return settings
+
+def load_page(driver, url, settings):
+    """driver.get() bounded by the deadline; returns False when loading was cut off"""
+    driver.set_page_load_timeout(max(1, int(settings['deadline'])))
+    try:
+        driver.get(url)
+        return True
+    except TimeoutException:
+        # Keep whatever has loaded so far
+        driver.execute_script('window.stop();')
+        return False
+
+def wait_for_idle(driver, quiet_seconds, deadline, log):
+    """Poll until no request has been in flight for quiet_seconds; False when the deadline came first.
+
+    Requests are followed in the performance log, in flight from
+    Network.requestWillBeSent until loadingFinished or loadingFailed. The
+    entries read are appended to log, as get_log() hands each one out once.
+    """
+    in_flight = set()
+    last_change = time.perf_counter()
+    while True:
+        entries = driver.get_log('performance')
+        log.extend(entries)
+        changed = False
+        for method, params in network_events(entries):
+            if method == 'Network.requestWillBeSent' and params.get('type') not in IDLE_IGNORED_TYPES:
+                in_flight.add(params.get('requestId'))
+                changed = True
+            elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+                in_flight.discard(params.get('requestId'))
+                changed = True
+        state = driver.execute_script('return document.readyState;')
+        now = time.perf_counter()
+        if changed or in_flight or state != 'complete':
+            last_change = now
+        elif now - last_change >= quiet_seconds:
+            return True
+        if now >= deadline:
+            return False
+        time.sleep(READY_POLL_SECONDS)
+
+def wait_until_ready(driver, settings, started, loaded=True, log=None):
+    """Wait after load_page() as the settings ask; returns a report with the time-to-ready.
+
+    started is the perf_counter() value from just before driver.get(), so
+    the deadline and the reported seconds include the page load. loaded is
+    load_page()'s result; a page cut off at the deadline is not waited on.
+    Performance log entries read while waiting for idle are added to log.
+    """
+    log = [] if log is None else log
+    deadline = started + settings['deadline']
+    outcome = settings['strategy'] if loaded else 'deadline'
+    if loaded:
+        try:
+            WebDriverWait(driver, max(0.1, deadline - time.perf_counter())).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+        except TimeoutException:
+            outcome = 'deadline'
+
+    quiet_seconds = settings['quiet_ms'] / 1000
+    if outcome == 'idle' and not wait_for_idle(driver, quiet_seconds, deadline, log):
+        outcome = 'deadline'
+
+    steps = 0
+    if settings['scroll'] and outcome != 'deadline':
+        at_bottom = False
+        while not at_bottom and steps < RENDER_SCROLL_MAX_STEPS:
+            at_bottom = driver.execute_script(SCROLL_SCRIPT)
+            steps += 1
+            # Give lazy loaders the quiet window to start and finish their requests
+            if not wait_for_idle(driver, quiet_seconds, deadline, log):
+                outcome = 'deadline'
+                break
+        driver.execute_script('window.scrollTo(0, 0);')
+
+    return {
+        'strategy': settings['strategy'],
+        'outcome': outcome,
+        'seconds': round(time.perf_counter() - started, 3),
+        'scroll_steps': steps,
+    }
@@ -0,0 +1,94 @@
+import os
+import re
+from collections import Counter
+from tracking_rules import get_tracking_rules
+from network_capture import network_events
+
+# Resource types the browser does not load while rendering, e.g. 'image,media,font'; assets are fetched
+# separately afterwards, so page_source does not need them. None by default, since some pages only build
+# their markup once images or fonts have loaded. Captured renders (captureNetwork) block none unless asked to.
+RENDER_BLOCK_TYPES = [name.strip() for name in os.environ.get('RENDER_BLOCK_TYPES', '').split(',') if name.strip()]
+
+# Network.setBlockedURLs takes wildcard patterns, not resource types, so types are blocked by extension
+BLOCKABLE_TYPES = {
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'bmp', 'ico', 'tif', 'tiff'),
+    'media': ('mp4', 'webm', 'ogv', 'mov', 'm4v', 'mp3', 'ogg', 'oga', 'wav', 'm4a', 'aac', 'flac', 'm3u8', 'mpd'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+}
+
+# Regex pieces that stand for "some characters" and become a wildcard
+WILDCARD_PIECES = re.compile(r'\[\^?[^\]]*\][*+?]?|\.[*+]\??|\\[dDwWsS][*+]?')
+REGEX_SPECIALS = set('|()^$?*+{}[]')
+
+def wildcard_from_regex(pattern):
+    """Turn a tracker regex into a setBlockedURLs wildcard pattern, or None when it can not be expressed"""
+    pattern = WILDCARD_PIECES.sub('*', pattern)
+    text = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            text.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '*':
+            text.append('*')
+        elif char in REGEX_SPECIALS:
+            return None
+        else:
+            text.append(char)
+    # Regexes match anywhere in the URL
+    return f'*{"".join(text)}*'
+
+def block_settings(value, remove_tracking=False, remove_custom_tracking=False, capture_network=False):
+    """Validate the block option (true/false or {types, trackers}) and return settings with the defaults filled in.
+
+    Resource types are only blocked when block.types or RENDER_BLOCK_TYPES
+    asks for them. Trackers are blocked by default when the same clone
+    removes them from the page anyway, using the same tracking_rules patterns.
+    """
+    if value is None or value is True:
+        value = {}
+    if value is False:
+        return {'types': [], 'trackers': False, 'custom_trackers': False}
+    if not isinstance(value, dict):
+        raise ValueError('block must be true, false or an object')
+
+    types = value.get('types', [] if capture_network else RENDER_BLOCK_TYPES)
+    if not isinstance(types, list) or any(name not in BLOCKABLE_TYPES for name in types):
+        raise ValueError(f'block.types must be a list of: {", ".join(BLOCKABLE_TYPES)}')
+    trackers = value.get('trackers')
+    return {
+        'types': types,
+        'trackers': bool(remove_tracking if trackers is None else trackers),
+        'custom_trackers': bool(remove_custom_tracking if trackers is None else trackers),
+    }
+
+def blocked_url_patterns(settings):
+    """Wildcard patterns for Network.setBlockedURLs from block_settings()"""
+    patterns = []
+    for name in settings['types']:
+        for extension in BLOCKABLE_TYPES[name]:
+            patterns.extend((f'*.{extension}', f'*.{extension}?*'))
+    rules = get_tracking_rules()
+    regexes = (rules.config['tracking_script_src'] if settings['trackers'] else []) + \
+        (rules.config['custom_script_src'] if settings['custom_trackers'] else [])
+    for regex in regexes:
+        wildcard = wildcard_from_regex(regex)
+        if wildcard:
+            patterns.append(wildcard)
+        else:
+            print(f'Tracker pattern can not be blocked while rendering: {regex}')
+    return list(dict.fromkeys(patterns))
+
+def start_blocking(driver, patterns):
+    """Set this render's block list (an empty list clears the previous render's)"""
+    driver.get_log('performance')  # Only this page's requests are counted
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+
+def count_blocked(entries):
+    """{'requests': n, 'types': {resource type: n}} for requests the block list stopped"""
+    types = Counter(params.get('type', 'Other') for method, params in network_events(entries)
+                    if method == 'Network.loadingFailed' and params.get('blockedReason') == 'inspector')
+    return {'requests': sum(types.values()), 'types': dict(types)}
@@ -0,0 +1,164 @@
+import os
+import time
+import json
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+# Finished archives kept for repeated /download requests with the same URL and options
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '.result_cache')
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+
+def result_key(url, options):
+    """sha256 of the normalized URL plus every option that shapes the archive"""
+    text = json.dumps({'url': url, 'options': options}, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Zip archives of finished clones keyed by result_key(), with a TTL and an LRU size cap.
+
+    fetch() serves a fresh archive straight from disk. Concurrent requests
+    for a key that is still being cloned wait for that clone instead of
+    starting their own.
+    """
+
+    def __init__(self, root=None, ttl=None, max_bytes=None):
+        self.root = root or RESULT_CACHE_DIR
+        self.ttl = RESULT_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.archive_dir = os.path.join(self.root, 'archives')
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> threading.Event, with .error set when that clone failed
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False, timeout=30)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+        ''')
+        self._db.commit()
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def archive_path(self, key):
+        return os.path.join(self.archive_dir, f'{key}.zip')
+
+    def lookup(self, key):
+        """Path of a fresh archive for key, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT created FROM results WHERE key = ?', (key,)).fetchone()
+            if not row or row[0] + self.ttl <= now or not os.path.exists(self.archive_path(key)):
+                return None
+            self._db.execute('UPDATE results SET last_used = ? WHERE key = ?', (now, key))
+            self._db.commit()
+        return self.archive_path(key)
+
+    def store(self, key, archive):
+        """Move a finished archive into the cache and return its cached path"""
+        tmp_path = os.path.join(self.archive_dir, f'{uuid.uuid4().hex}.tmp')
+        shutil.move(archive, tmp_path)
+        os.replace(tmp_path, self.archive_path(key))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO results (key, size, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, os.path.getsize(self.archive_path(key)), now, now)
+            )
+            self._db.commit()
+        self.evict(keep=key)
+        return self.archive_path(key)
+
+    def evict(self, keep=None):
+        """Drop expired archives, then least recently used ones until the cache fits in max_bytes"""
+        removed = []
+        with self._lock:
+            rows = self._db.execute('SELECT key, size, created FROM results ORDER BY last_used').fetchall()
+            total = sum(size for _, size, _ in rows)
+            expired_before = time.time() - self.ttl
+            for key, size, created in rows:
+                if key != keep and (created <= expired_before or total > self.max_bytes):
+                    self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    removed.append(key)
+                    total -= size
+            self._db.commit()
+            self.counters['evictions'] += len(removed)
+        for key in removed:
+            try:
+                os.remove(self.archive_path(key))
+            except OSError:
+                pass
+
+    def fetch(self, key, produce):
+        """Return (archive path, 'hit' | 'miss' | 'coalesced') for key.
+
+        On a miss produce() runs and must return the path of a new archive,
+        which is moved into the cache; an exception it raises is raised to
+        every request that was waiting for it too.
+        """
+        path = self.lookup(key)
+        if path:
+            with self._lock:
+                self.counters['hits'] += 1
+            return path, 'hit'
+
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+                event.error = None
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                self.counters['coalesced'] += 1
+            if event.error:
+                raise event.error
+            path = self.lookup(key)
+            if path:
+                return path, 'coalesced'
+            # Evicted before this request got to it; clone again
+            return self.fetch(key, produce)
+
+        try:
+            path = self.store(key, produce())
+            with self._lock:
+                self.counters['misses'] += 1
+            return path, 'miss'
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            counters = dict(self.counters)
+        counters.update({'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes, 'ttl': self.ttl})
+        return counters
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Return the process-wide result cache, or None when it is disabled"""
+    global _cache
+    if not RESULT_CACHE_ENABLED or RESULT_CACHE_TTL <= 0 or RESULT_CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
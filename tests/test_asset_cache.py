@@ -0,0 +1,84 @@
+import os
+import time
+
+from asset_cache import AssetCache, ContentIndex
+from http_client import ByteBudget
+
+def test_stale_entry_is_revalidated_with_its_etag(serve, tmp_path):
+    requests = []
+
+    def respond(handler):
+        requests.append(handler.headers.get('If-None-Match'))
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"', 'Cache-Control': 'no-cache'}, b''
+        return 200, {'ETag': '"v1"', 'Cache-Control': 'no-cache', 'Content-Type': 'text/css'}, b'body{}'
+
+    url = serve(respond) + '/a.css'
+    cache = AssetCache(root=str(tmp_path))
+
+    first = cache.fetch(url)
+    second = cache.fetch(url)
+
+    assert first.status == 'miss'
+    assert second.status == 'revalidated'
+    assert requests == [None, '"v1"']
+    assert second.path == first.path
+    with open(second.path, 'rb') as f:
+        assert f.read() == b'body{}'
+    assert cache.stats()['revalidated'] == 1
+
+def test_fresh_entry_is_served_without_a_request(serve, tmp_path):
+    requests = []
+
+    def respond(handler):
+        requests.append(handler.path)
+        return 200, {'Cache-Control': 'max-age=60'}, b'x' * 10
+
+    url = serve(respond) + '/a.png'
+    cache = AssetCache(root=str(tmp_path))
+    budget = ByteBudget(0)
+
+    assert cache.fetch(url, budget=budget).status == 'miss'
+    assert cache.fetch(url, budget=budget).status == 'hit'
+    assert requests == ['/a.png']
+    # Only the bytes that came over the network are charged
+    assert budget.used == 10
+
+def test_least_recently_used_blob_is_evicted(serve, tmp_path):
+    bodies = {'/a.png': b'a' * 100, '/b.png': b'b' * 100, '/c.png': b'c' * 100}
+    base = serve(lambda handler: (200, {'Cache-Control': 'max-age=60'}, bodies[handler.path]))
+    cache = AssetCache(root=str(tmp_path), max_bytes=250)
+
+    cache.fetch(base + '/a.png')
+    time.sleep(0.01)
+    cache.fetch(base + '/b.png')
+    time.sleep(0.01)
+    assert cache.fetch(base + '/a.png').status == 'hit'  # a is now the most recently used
+    time.sleep(0.01)
+    c = cache.fetch(base + '/c.png')
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 200
+    assert cache.fetch(base + '/a.png').status == 'hit'
+    assert os.path.exists(c.path)
+    assert cache.fetch(base + '/b.png').status == 'miss'
+
+def test_content_index_names_depend_on_claim_order_and_digest_only():
+    a, b = 'a' * 64, 'b' * 64
+    names = []
+    for _ in range(2):
+        index = ContentIndex()
+        names.append([
+            index.claim('images/logo.png', a),
+            index.claim('images/logo.png', b),
+            index.claim('images/other.png', a),
+            index.claim('images/logo.png', 'stub:https://x.test/logo.png'),
+        ])
+
+    assert names[0] == names[1]
+    first, second, duplicate, stub = names[0]
+    assert first == ('images/logo.png', False)
+    assert second == ('images/logo_bbbbbbbb.png', False)
+    assert duplicate == ('images/logo.png', True)
+    assert stub[0].startswith('images/logo_') and ':' not in stub[0]
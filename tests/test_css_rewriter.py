@@ -0,0 +1,105 @@
+import hashlib
+import posixpath
+
+from asset_cache import ContentIndex
+from css_rewriter import CssPipeline, find_references
+
+def references(css):
+    return [(reference.kind, reference.url) for reference in find_references(css)]
+
+def test_url_and_import_forms():
+    css = '''@import "a.css"; @import url('b.css') screen; @IMPORT url(c.css);
+    p { background: url( "d.png" ) } q { background: URL(e.png) } r { src: url('f.woff2') }'''
+    assert references(css) == [
+        ('import', 'a.css'), ('import', 'b.css'), ('import', 'c.css'),
+        ('url', 'd.png'), ('url', 'e.png'), ('url', 'f.woff2'),
+    ]
+
+def test_url_inside_comments_is_skipped():
+    css = '/* background: url(old.png); @import "old.css"; */ p { background: url(new.png) } /* url(\nmultiline.png) */'
+    assert references(css) == [('url', 'new.png')]
+
+def test_url_inside_strings_is_skipped():
+    css = '''p::before { content: "url(a.png)" } q::after { content: 'it\\'s url(b.png)' }
+    r { content: "/*" } s { background: url(c.png) } t { content: "*/ \\" url(d.png)" }'''
+    assert references(css) == [('url', 'c.png')]
+
+def test_data_uris_and_fragments_are_skipped():
+    css = 'p { background: url(data:image/png;base64,AAAA) } q { filter: url(#blur) } r { background: url(x.png) }'
+    assert references(css) == [('url', 'x.png')]
+
+def test_reference_spans_cover_only_the_url():
+    css = 'p { background: url( "a.png" ) }'
+    reference, = find_references(css)
+    assert css[reference.start:reference.end] == 'a.png'
+
+def make_pipeline(texts, fetched):
+    def fetch_text(url):
+        fetched.append(url)
+        return texts.get(url)
+
+    return CssPipeline(
+        fetch_text=fetch_text,
+        fetch_asset=lambda url: f'images/{posixpath.basename(url)}',
+        map_urls=lambda fn, urls: {url: fn(url) for url in urls},
+        filename_for=lambda sheet: posixpath.basename(sheet.url),
+    )
+
+def test_import_cycle_is_fetched_once():
+    texts = {
+        'https://x.test/css/a.css': '@import "b.css"; p { background: url(../img/p.png) }',
+        'https://x.test/css/b.css': '@import "a.css"; @import "b.css"; @import "c.css";',
+        'https://x.test/css/c.css': '@import url(a.css); q { background: url(/img/q.png) }',
+    }
+    fetched = []
+    css = make_pipeline(texts, fetched)
+
+    css.load(['https://x.test/css/a.css'])
+    css.fetch_assets()
+
+    assert sorted(fetched) == sorted(texts)
+    assert list(css.sheets) == ['https://x.test/css/a.css', 'https://x.test/css/b.css', 'https://x.test/css/c.css']
+    assert css.assets == {'https://x.test/img/p.png': 'images/p.png', 'https://x.test/img/q.png': 'images/q.png'}
+    rewritten = css.rewrite(css.sheets['https://x.test/css/b.css'], 'css')
+    assert rewritten == '@import "a.css"; @import "b.css"; @import "c.css";'
+    rewritten = css.rewrite(css.sheets['https://x.test/css/a.css'], 'css')
+    assert rewritten == '@import "b.css"; p { background: url(../images/p.png) }'
+
+def test_missing_import_keeps_its_reference():
+    fetched = []
+    css = make_pipeline({'https://x.test/a.css': '@import "gone.css"; p { color: red }'}, fetched)
+
+    css.load(['https://x.test/a.css', 'https://x.test/a.css'])
+
+    assert fetched == ['https://x.test/a.css', 'https://x.test/gone.css']
+    assert css.rewrite(css.sheets['https://x.test/a.css'], 'css') == '@import "gone.css"; p { color: red }'
+
+def test_sheets_sharing_a_name_get_stable_names_from_a_content_index():
+    def run(index, texts):
+        def filename_for(sheet):
+            key = hashlib.sha256(sheet.text.encode()).hexdigest()
+            relpath, _ = index.claim(f'css/{posixpath.basename(sheet.url)}', f'css:{key}')
+            return relpath.split('/', 1)[1]
+
+        css = CssPipeline(
+            fetch_text=texts.get,
+            fetch_asset=lambda url: None,
+            map_urls=lambda fn, urls: {url: fn(url) for url in urls},
+            filename_for=filename_for,
+        )
+        css.load(list(texts))
+        return {url: css.local_path(url) for url in texts}
+
+    blog = {'https://x.test/blog/style.css': 'p { color: blue }', 'https://x.test/blog/print.css': 'p { color: black }'}
+    shop = {'https://x.test/shop/style.css': 'p { color: red }', 'https://x.test/blog/style.css?v=2': 'p { color: blue }'}
+    results = []
+    for _ in range(2):
+        # One index shared by two pages, as in a crawl
+        index = ContentIndex()
+        results.append((run(index, blog), run(index, shop)))
+
+    assert results[0] == results[1]
+    blog_paths, shop_paths = results[0]
+    assert blog_paths['https://x.test/blog/style.css'] == 'css/style.css'
+    assert shop_paths['https://x.test/blog/style.css?v=2'] == 'css/style.css'
+    assert shop_paths['https://x.test/shop/style.css'].startswith('css/style_')
@@ -0,0 +1,115 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import http_client
+from http_client import HostScheduler, http_get, retry_after_seconds
+
+URL = 'https://slow.test/page'
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, 'HOST_BACKOFF_MIN', 0.1)
+    monkeypatch.setattr(http_client, 'HOST_BACKOFF_MAX', 0.4)
+    monkeypatch.setattr(http_client, 'HOST_BACKOFF_DECAY', 0.5)
+
+def timed_acquire(scheduler, url=URL):
+    started = time.monotonic()
+    host = scheduler.acquire(url)
+    scheduler.release(host)
+    return time.monotonic() - started
+
+def throttle(scheduler, status=429, retry_after=None):
+    host = scheduler.acquire(URL)
+    scheduler.record(host, status, retry_after)
+    scheduler.release(host)
+    return host
+
+def test_retry_after_seconds():
+    assert retry_after_seconds('3') == 3.0
+    assert retry_after_seconds('-1') == 0.0
+    assert retry_after_seconds('') is None
+    assert retry_after_seconds('soon') is None
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 28 <= retry_after_seconds(later) <= 30
+
+def test_throttle_doubles_delay_up_to_the_cap():
+    scheduler = HostScheduler(concurrency=0, rps=0)
+    delays = []
+    for _ in range(4):
+        host = throttle(scheduler)
+        delays.append(scheduler.stats()[host]['delay'])
+        time.sleep(delays[-1])
+    assert delays == [0.1, 0.2, 0.4, 0.4]
+
+def test_throttles_in_flight_together_back_off_once():
+    scheduler = HostScheduler(concurrency=0, rps=0)
+    hosts = [scheduler.acquire(f'https://slow.test/{n}') for n in range(3)]
+    for host in hosts:
+        scheduler.record(host, 503)
+    assert scheduler.stats()['slow.test']['delay'] == 0.1
+    for host in hosts:
+        scheduler.release(host)
+
+def test_backoff_spaces_request_starts_and_decays_on_success():
+    scheduler = HostScheduler(concurrency=0, rps=0)
+    host = throttle(scheduler)
+    time.sleep(0.1)
+    throttle(scheduler)
+    assert scheduler.stats()[host]['delay'] == 0.2
+
+    assert timed_acquire(scheduler) >= 0.15
+    host = scheduler.acquire(URL)
+    delays = []
+    for _ in range(4):
+        scheduler.record(host, 200)
+        delays.append(scheduler.stats()[host]['delay'])
+    scheduler.release(host)
+    # Below a quarter of HOST_BACKOFF_MIN the host is back at its base pace
+    assert delays == [0.1, 0.05, 0.025, 0.0]
+    time.sleep(0.25)
+    assert timed_acquire(scheduler) < 0.05
+    assert scheduler.stats() == {}
+
+def test_retry_after_pauses_the_host_only():
+    scheduler = HostScheduler(concurrency=0, rps=0)
+    throttle(scheduler, retry_after=0.3)
+
+    assert timed_acquire(scheduler, 'https://other.test/') < 0.05
+    assert timed_acquire(scheduler) >= 0.25
+
+def test_retry_after_is_capped(monkeypatch):
+    monkeypatch.setattr(http_client, 'HOST_RETRY_AFTER_MAX', 0.2)
+    scheduler = HostScheduler(concurrency=0, rps=0)
+    throttle(scheduler, retry_after=60)
+
+    assert scheduler.stats()['slow.test']['paused'] <= 0.2
+
+def test_http_get_waits_out_retry_after(serve, monkeypatch):
+    monkeypatch.setattr(http_client, '_scheduler', HostScheduler(concurrency=0, rps=0))
+    answers = [(429, {'Retry-After': '1'}, b''), (200, {}, b'ok')]
+    base = serve(lambda handler: answers.pop(0))
+
+    started = time.monotonic()
+    response = http_get(base + '/')
+
+    assert response.status_code == 200
+    assert response.content == b'ok'
+    assert time.monotonic() - started >= 0.9
+    assert answers == []
+
+def test_http_get_returns_a_throttle_asking_for_too_long(serve, monkeypatch):
+    monkeypatch.setattr(http_client, '_scheduler', HostScheduler(concurrency=0, rps=0))
+    monkeypatch.setattr(http_client, 'HOST_RETRY_AFTER_MAX', 1)
+    hits = []
+
+    def respond(handler):
+        hits.append(handler.path)
+        return 503, {'Retry-After': '30'}, b''
+
+    response = http_get(serve(respond) + '/')
+
+    assert response.status_code == 503
+    assert hits == ['/']
@@ -0,0 +1,89 @@
+import os
+import time
+
+import jobs
+from jobs import SharedJobQueue
+
+LEASE = 0.2
+
+def make_queue(tmp_path):
+    return SharedJobQueue(path=str(tmp_path / 'queue.db'), result_dir=str(tmp_path / 'results'), lease_seconds=LEASE)
+
+def make_archive(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'zip')
+    return str(path)
+
+def test_live_lease_is_not_claimed_twice(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit({'url': 'https://example.com/'})
+
+    job, attempt = queue.claim('w1')
+
+    assert attempt == 1
+    assert queue.claim('w2') is None
+    assert queue.get(job.id).status == 'running'
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit({'url': 'https://example.com/'})
+    job, _ = queue.claim('w1')
+
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert queue.heartbeat(job, 'w1')
+
+    assert queue.claim('w2') is None
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = make_queue(tmp_path)
+    submitted = queue.submit({'url': 'https://example.com/'})
+    first, first_attempt = queue.claim('w1')
+
+    time.sleep(LEASE * 1.5)
+    second, second_attempt = queue.claim('w2')
+
+    assert second.id == first.id == submitted.id
+    assert second_attempt == first_attempt + 1
+    # The first worker has lost the job: it can not renew it or record its result
+    assert not queue.heartbeat(first, 'w1')
+    stale = make_archive(tmp_path, 'stale.zip')
+    queue.finish(first, 'w1', first_attempt, archive=stale)
+    assert queue.get(first.id).status == 'running'
+    assert not os.path.exists(os.path.join(queue.result_dir, f'{first.id}_{first_attempt}.zip'))
+
+    queue.finish(second, 'w2', second_attempt, archive=make_archive(tmp_path, 'fresh.zip'))
+    record = queue.get(first.id)
+    assert record.status == 'done'
+    assert record.attempts == 2
+    assert record.result == os.path.join(queue.result_dir, f'{first.id}_{second_attempt}.zip')
+    assert os.path.exists(record.result)
+
+def test_job_fails_once_every_attempt_lost_its_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    queue = make_queue(tmp_path)
+    job_id = queue.submit({'url': 'https://example.com/'}).id
+
+    queue.claim('w1')
+    time.sleep(LEASE * 1.5)
+    queue.claim('w2')
+    time.sleep(LEASE * 1.5)
+
+    assert queue.claim('w3') is None
+    record = queue.get(job_id)
+    assert record.status == 'failed'
+    assert 'w2' in record.error
+
+def test_identical_pending_request_gets_the_same_job(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.submit({'url': 'https://example.com/'}, result_key='k')
+
+    assert queue.submit({'url': 'https://example.com/'}, result_key='k').id == first.id
+    assert queue.submit({'url': 'https://example.com/'}).id != first.id
+
+    job, attempt = queue.claim('w1')
+    assert job.result_key == 'k'
+    assert queue.submit({'url': 'https://example.com/'}, result_key='k').id == first.id
+
+    queue.finish(job, 'w1', attempt, archive=make_archive(tmp_path, 'done.zip'))
+    assert queue.submit({'url': 'https://example.com/'}, result_key='k').id != first.id
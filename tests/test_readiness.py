@@ -0,0 +1,47 @@
+import json
+import time
+
+from readiness import wait_for_idle
+
+QUIET = 0.2
+
+def event(method, request_id, type='XHR'):
+    return {'message': json.dumps({'message': {'method': method, 'params': {'requestId': request_id, 'type': type}}})}
+
+class FakeDriver:
+    """Hands out scripted performance log batches, one per get_log() call"""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def get_log(self, name):
+        return self.batches.pop(0) if self.batches else []
+
+    def execute_script(self, script):
+        return 'complete'
+
+def test_request_in_flight_keeps_the_page_busy_until_it_finishes():
+    slow = [[event('Network.requestWillBeSent', '1'), event('Network.requestWillBeSent', '2')],
+            [event('Network.loadingFinished', '1')]] + [[]] * 5 + [[event('Network.loadingFinished', '2')]]
+    driver = FakeDriver(slow)
+    log = []
+
+    started = time.perf_counter()
+    assert wait_for_idle(driver, QUIET, started + 5, log)
+
+    # Eight polls before the slow request finished, then the quiet window
+    assert time.perf_counter() - started >= 0.7 + QUIET
+    assert len(log) == 4
+
+def test_request_that_never_finishes_runs_into_the_deadline():
+    driver = FakeDriver([[event('Network.requestWillBeSent', '1')]])
+    started = time.perf_counter()
+    assert not wait_for_idle(driver, QUIET, started + 0.5, [])
+    assert time.perf_counter() - started >= 0.5
+
+def test_streams_and_failed_requests_do_not_keep_the_page_busy():
+    driver = FakeDriver([[event('Network.requestWillBeSent', '1', type='EventSource'),
+                          event('Network.requestWillBeSent', '2'), event('Network.loadingFailed', '2')]])
+    started = time.perf_counter()
+    assert wait_for_idle(driver, QUIET, started + 5, [])
+    assert time.perf_counter() - started < QUIET + 0.3
@@ -0,0 +1,23 @@
+import json
+
+from tracking_rules import DEFAULT_TRACKING_RULES, load_tracking_rules
+
+def test_missing_override_file_uses_the_built_in_rules(tmp_path):
+    rules = load_tracking_rules(str(tmp_path / 'absent.json'))
+    assert rules.config == DEFAULT_TRACKING_RULES
+    assert rules.is_tracking_url('https://www.googletagmanager.com/gtm.js?id=X')
+
+def test_override_file_replaces_only_the_categories_it_defines(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'custom_script_src': [r'beacon\.js']}))
+
+    rules = load_tracking_rules(str(path))
+
+    assert rules.is_tracking_url('https://x.test/beacon.js')
+    assert not rules.is_tracking_url('https://x.test/tracker.js')
+    assert rules.config['tracking_script_src'] == DEFAULT_TRACKING_RULES['tracking_script_src']
+
+def test_invalid_override_file_falls_back_to_the_built_in_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text('{not json')
+    assert load_tracking_rules(str(path)).config == DEFAULT_TRACKING_RULES
@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import threading
+
+# Optional override file (not shipped): a JSON object whose categories replace the
+# built-in lists below; creating or editing it takes effect on the next request without a redeploy
+TRACKING_RULES_PATH = os.environ.get(
+    'TRACKING_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracking_rules.json')
+)
+
+# Built-in rules, the only copy of the defaults; used for any category the override file does not define
+DEFAULT_TRACKING_RULES = {
+    # Regexes matched against <script src> when removeTracking is set
+    'tracking_script_src': [
+        # Meta Pixel
+        r'connect\.facebook\.net/[^/]+/fbevents\.js',
+        r'facebook-jssdk',
+        r'fb-root',
+        # Google Analytics
+        r'google-analytics\.com/analytics\.js',
+        r'googletagmanager\.com/gtag/js',
+        r'ga\.js',
+        r'gtag',
+        # Google Tag Manager
+        r'googletagmanager\.com/gtm\.js',
+        r'gtm\.js',
+        # Ringba
+        r'ringba\.com',
+        r'ringba\.js',
+        # Other common trackers
+        r'analytics',
+        r'pixel\.js',
+        r'tracking\.js',
+        r'mixpanel',
+        r'segment\.com',
+        r'hotjar\.com',
+    ],
+    # Substrings of inline script bodies when removeTracking is set
+    'tracking_script_content': ['fbq(', 'gtag(', 'ga(', '_ringba', 'mixpanel'],
+    # Regexes matched against <script src> when removeCustomTracking is set
+    'custom_script_src': [r'track\.js', r'tracking\.js', r'tracker\.js'],
+    # Substrings of inline script bodies when removeCustomTracking is set
+    'custom_script_content': ['track'],
+    # <meta name> values removed when removeTracking is set
+    'tracking_meta_names': ['facebook-domain-verification', 'google-site-verification'],
+    # Substrings that mark a <noscript> block as a tracking pixel
+    'noscript_keywords': ['facebook', 'gtm', 'google-analytics'],
+    # Substrings that mark an on* event handler as tracking
+    'event_handler_keywords': ['track', 'gtag', 'ga', 'fbq'],
+}
+
+def compile_patterns(patterns, literal=False):
+    """Combine a list of patterns into one case-insensitive regex (None when empty)"""
+    if not patterns:
+        return None
+    if literal:
+        patterns = [re.escape(pattern) for pattern in patterns]
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE)
+
+class TrackingRules:
+    """Tracker-detection rules compiled into one regex per category"""
+
+    def __init__(self, config=None):
+        config = dict(DEFAULT_TRACKING_RULES, **(config or {}))
+        self.config = config
+        self.tracking_script_src = compile_patterns(config['tracking_script_src'])
+        self.tracking_script_content = compile_patterns(config['tracking_script_content'], literal=True)
+        self.custom_script_src = compile_patterns(config['custom_script_src'])
+        self.custom_script_content = compile_patterns(config['custom_script_content'], literal=True)
+        self.tracking_meta_names = set(config['tracking_meta_names'])
+        self.noscript_keywords = compile_patterns(config['noscript_keywords'], literal=True)
+        self.event_handler_keywords = compile_patterns(config['event_handler_keywords'], literal=True)
+
+    @staticmethod
+    def matches(pattern, text):
+        return bool(pattern and text and pattern.search(text))
+
+    def is_tracking_url(self, url):
+        """True when a resource URL looks like any known tracker"""
+        return self.matches(self.tracking_script_src, url) or self.matches(self.custom_script_src, url)
+
+def load_tracking_rules(path=None):
+    """Built-in rules with the override file applied, or the built-in rules alone if it is missing or invalid"""
+    path = path or TRACKING_RULES_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return TrackingRules(json.load(f))
+    except FileNotFoundError:
+        return TrackingRules()
+    except Exception as e:
+        print(f'Error loading tracking rules from {path}: {str(e)}')
+        return TrackingRules()
+
+_rules = load_tracking_rules()
+_rules_mtime = os.path.getmtime(TRACKING_RULES_PATH) if os.path.exists(TRACKING_RULES_PATH) else None
+_rules_lock = threading.Lock()
+
+def get_tracking_rules():
+    """Return the compiled ruleset, recompiling it if the override file appeared, changed or went away"""
+    global _rules, _rules_mtime
+    try:
+        mtime = os.path.getmtime(TRACKING_RULES_PATH)
+    except OSError:
+        mtime = None
+    if mtime != _rules_mtime:
+        with _rules_lock:
+            if mtime != _rules_mtime:
+                _rules = load_tracking_rules()
+                _rules_mtime = mtime
+    return _rules